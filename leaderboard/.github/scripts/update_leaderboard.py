@@ -1,41 +1,440 @@
-import pandas as pd
-import numpy as np
-
-# Load the CSV file
-df = pd.read_csv('output/central_results.csv')
-
-# Convert "Date Time" to datetime for sorting
-df['Date Time'] = pd.to_datetime(df['Date Time'])
-
-# Process the DataFrame
-# 1. Prioritize feasible solutions
-# 2. Sort by score (descending, since higher is better), then by Date Time (most recent first)
-# 3. Drop duplicates, keeping the first occurrence (best score per group)
-best_scores = df.sort_values(by=['Overall Feasible', 'Score', 'Date Time'], ascending=[False, False, False])\
-                .drop_duplicates('Group')
-
-# Read the existing README.md content
-with open('README.md', 'r') as file:
-    content = file.read()
-
-# Find the leaderboard section and prepare new content
-start = content.find('<!-- LEADERBOARD_START -->') + len('<!-- LEADERBOARD_START -->')
-end = content.find('<!-- LEADERBOARD_END -->')
-leaderboard_header = "| Rank | Date | GroupNumber | Feasible/Bugs | Score | Cumulative profit | Runtime |\n| ------ | ------------ | ------------------- |-------------| ------- | ------- | ------- |"
-
-new_leaderboard_rows = []
-rank = 1
-for i, row in best_scores.iterrows():
-    passed_icon = '✅' if row['Overall Feasible'] == 'Yes' else '❌'
-    date_str = row['Date Time'].strftime("%Y-%m-%d %H:%M")
-    new_leaderboard_rows.append(f"| {rank} | {date_str} | {row['Group']} | {passed_icon} | {np.round(100.0*row['Score'],2)} | {np.round(row['Cumulative Profits'],2)} | {row['Total Runtime (seconds)']}s |")
-    rank += 1
-
-new_leaderboard_content = "\n".join([leaderboard_header] + new_leaderboard_rows)
-
-# Replace the old leaderboard section with the new content
-new_content = content[:start] + "\n" + new_leaderboard_content + "\n" + content[end:]
-
-# Write the updated content back to README.md
-with open('README.md', 'w') as file:
-    file.write(new_content)
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import sys
+from array import array
+
+# Leaderboard builder without third-party packages. The best result per group is kept in a small state file
+# (output/leaderboard_state.json) together with the number of bytes of central_results.csv that were read already,
+# so every run only reads the rows appended since the last run. The state is rebuilt from scratch when the CSV was
+# rewritten (e.g. new columns) or the state file is missing. Every group also gets a page in groups/ with its latest
+# per-instance results (the <Group>_<date>.csv files that push.py copies to output/), a page is only rendered again
+# when the group has a new run or a new best result.
+#
+# The per-instance results are also kept in a columnar history with one binary file per round (a day of runs, see
+# write_round) in history/. New per-group CSVs are read once into the file of their round, the per-instance ranks and
+# the trend sparklines are rendered from the last TREND_ROUNDS round files instead of all CSVs.
+
+STATE_VERSION = 2
+LEADERBOARD_START = '<!-- LEADERBOARD_START -->'
+LEADERBOARD_END = '<!-- LEADERBOARD_END -->'
+LEADERBOARD_HEADER = ("| Rank | Date | GroupNumber | Feasible/Bugs | Score | Cumulative profit | Runtime | Trend |\n"
+                      "| ------ | ------------ | ------------------- |-------------| ------- | ------- | ------- | ------- |")
+INSTANCE_RANKS_START = '<!-- INSTANCE_RANKS_START -->'
+INSTANCE_RANKS_END = '<!-- INSTANCE_RANKS_END -->'
+GROUP_CSV_PATTERN = re.compile(r'^(?P<group>.+)_(?P<date>\d{4}-\d{2}-\d{2} \d{2}:\d{2})\.csv$')
+# Bytes before the read offset that must be unchanged for the CSV to count as appended to
+CHECK_BYTES = 256
+
+HISTORY_MAGIC = b'VRPHIST1'
+# Columns of a round file and their array type codes, group and instance are indices into the names in the header
+HISTORY_COLUMNS = (('group', 'I'), ('instance', 'I'), ('profit', 'd'), ('runtime', 'd'), ('feasible', 'b'),
+                   ('violations', 'i'))
+TREND_ROUNDS = 20
+SPARKLINE_BARS = '▁▂▃▄▅▆▇█'
+
+
+def empty_state():
+    # history: date of the newest per-group CSV in the history, per group
+    return {"version": STATE_VERSION, "offset": 0, "header": None, "check": None, "best": {}, "pages": {},
+            "history": {}}
+
+
+def load_state(path):
+    try:
+        with open(path) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return empty_state()
+    return state if state.get("version") == STATE_VERSION else empty_state()
+
+
+def save_state(state, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def check_digest(file, offset):
+    # Hash of the bytes just before `offset`, they change when the file is rewritten instead of appended to
+    start = max(0, offset - CHECK_BYTES)
+    file.seek(start)
+    return hashlib.sha256(file.read(offset - start)).hexdigest()
+
+
+def rank_key(best):
+    """Feasible results first, then the highest score, then the most recent."""
+    return best["feasible"], best["score"] if best["score"] is not None else -math.inf, best["date_time"]
+
+
+def parse_score(value):
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return None  # "N/A" of infeasible results
+    return None if math.isnan(score) else score
+
+
+def read_new_rows(central_path, state):
+    """Rows of central_results.csv appended since the last run, resets the state if the file was rewritten."""
+    with open(central_path, 'rb') as file:
+        header_line = file.readline()
+        header = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+        size = os.fstat(file.fileno()).st_size
+        unchanged = (state["header"] == header and state["offset"] <= size and
+                     state["check"] == check_digest(file, state["offset"]))
+        if not unchanged:
+            print("central_results.csv was rewritten or is new, rebuilding the leaderboard state")
+            state.update({key: value for key, value in empty_state().items() if key != "history"})
+            state["header"], state["offset"] = header, len(header_line)
+
+        file.seek(state["offset"])
+        data = file.read()
+        # Only complete lines, a line that is still being written is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        state["offset"] += len(data)
+        state["check"] = check_digest(file, state["offset"])
+
+    rows = []
+    for cells in csv.reader(data.decode('utf-8').splitlines()):
+        if not cells:
+            continue
+        if len(cells) < len(header):
+            print(f"Warning: skipping malformed row {cells}")
+            continue
+        rows.append(dict(zip(header, cells)))
+    return rows
+
+
+def update_best(state, rows):
+    """Merge new central rows into the best result per group, returns the groups whose best result changed."""
+    changed = set()
+    for row in rows:
+        candidate = {
+            "date_time": row["Date Time"],
+            "feasible": row["Overall Feasible"] == "Yes",
+            "score": parse_score(row["Score"]),
+            "profit": row["Cumulative Profits"],
+            "runtime": row["Total Runtime (seconds)"],
+        }
+        best = state["best"].get(row["Group"])
+        if best is None or rank_key(candidate) >= rank_key(best):
+            state["best"][row["Group"]] = candidate
+            changed.add(row["Group"])
+    return changed
+
+
+def page_name(group):
+    return re.sub(r'[^\w.-]', '_', group) + ".md"
+
+
+def format_number(value):
+    try:
+        return str(round(float(value), 2))
+    except ValueError:
+        return value
+
+
+def leaderboard_table(state, pages_folder, trends):
+    rows = [LEADERBOARD_HEADER]
+    ranking = sorted(state["best"].items(), key=lambda item: rank_key(item[1]), reverse=True)
+    for rank, (group, best) in enumerate(ranking, 1):
+        passed_icon = '✅' if best["feasible"] else '❌'
+        score = "N/A" if best["score"] is None else round(100.0 * best["score"], 2)
+        name = group
+        if group in state["pages"]:
+            name = f"[{group}]({pages_folder}/{page_name(group)})"
+        rows.append(f"| {rank} | {best['date_time'][:16]} | {name} | {passed_icon} | {score} | "
+                    f"{format_number(best['profit'])} | {format_number(best['runtime'])}s | {trends.get(group, '')} |")
+    return "\n".join(rows)
+
+
+def replace_block(content, start, end, text):
+    block = f"{start}\n{text}\n{end}"
+    pattern = re.compile(re.escape(start) + r'.*?' + re.escape(end), re.DOTALL)
+    if pattern.search(content):
+        return pattern.sub(lambda _: block, content, count=1)
+    # No markers yet: replace the first leaderboard table (of READMEs from before the markers), or add the block at
+    # the end
+    table_pattern = re.compile(r'^\| Rank \|.*\n(?:\|.*(?:\n|$))*', re.MULTILINE)
+    if start == LEADERBOARD_START and table_pattern.search(content):
+        return table_pattern.sub(lambda _: block + "\n", content, count=1)
+    return content.rstrip("\n") + "\n\n" + block + "\n"
+
+
+def render_readme(readme_path, blocks):
+    """Replace the text between the markers of every (start, end, text) block, returns whether README.md changed."""
+    with open(readme_path) as file:
+        content = file.read()
+    new_content = content
+    for start, end, text in blocks:
+        new_content = replace_block(new_content, start, end, text)
+    if new_content == content:
+        return False
+    with open(readme_path, 'w') as file:
+        file.write(new_content)
+    return True
+
+
+def latest_group_csvs(output_folder):
+    """The newest per-instance CSV of every group, {group: file name}."""
+    latest = {}
+    for name in os.listdir(output_folder):
+        match = GROUP_CSV_PATTERN.match(name)
+        if match and (match['group'] not in latest or
+                      GROUP_CSV_PATTERN.match(latest[match['group']])['date'] < match['date']):
+            latest[match['group']] = name
+    return latest
+
+
+def to_float(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def result_values(result):
+    # (profit, runtime, feasible, violations) of a row of a per-group CSV, -1 violations if the CSV has no count
+    return (to_float(result.get("Profit"), -math.inf), to_float(result.get("Runtime (seconds)"), math.nan),
+            result.get("Feasible") == "Yes", int(to_float(result.get("Violations"), -1)))
+
+
+def write_round(path, records):
+    """Write the results of a round, {(group, instance): (profit, runtime, feasible, violations)}.
+
+    Layout: HISTORY_MAGIC, the length of the JSON header as a little-endian uint32, the header (group and instance
+    names, number of rows, HISTORY_COLUMNS), then every column as a little-endian array of its type code.
+    """
+    groups = sorted({group for group, _ in records})
+    instances = sorted({instance for _, instance in records})
+    group_index = {group: i for i, group in enumerate(groups)}
+    instance_index = {instance: i for i, instance in enumerate(instances)}
+
+    columns = [array(code) for _, code in HISTORY_COLUMNS]
+    for (group, instance), values in sorted(records.items()):
+        for column, value in zip(columns, (group_index[group], instance_index[instance], *values)):
+            column.append(value)
+
+    header = json.dumps({"groups": groups, "instances": instances, "rows": len(records),
+                         "columns": [list(column) for column in HISTORY_COLUMNS]}).encode()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(HISTORY_MAGIC + struct.pack('<I', len(header)) + header)
+        for column in columns:
+            if sys.byteorder == 'big':
+                column.byteswap()
+            file.write(column.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_round(path):
+    """The records of a round file, see write_round."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(HISTORY_MAGIC):
+        raise ValueError(f"{path} is not a leaderboard history file")
+    offset = len(HISTORY_MAGIC) + 4
+    (length,) = struct.unpack_from('<I', data, len(HISTORY_MAGIC))
+    header = json.loads(data[offset:offset + length])
+    offset += length
+
+    columns = []
+    for _, code in header["columns"]:
+        column = array(code)
+        size = column.itemsize * header["rows"]
+        column.frombytes(data[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        offset += size
+
+    groups, instances = header["groups"], header["instances"]
+    return {(groups[g], instances[i]): (profit, runtime, bool(feasible), violations)
+            for g, i, profit, runtime, feasible, violations in zip(*columns)}
+
+
+def update_history(state, output_folder, history_folder):
+    """Add the per-group CSVs newer than the history to the files of their rounds, returns the updated rounds."""
+    new = {}
+    for name in os.listdir(output_folder):
+        match = GROUP_CSV_PATTERN.match(name)
+        if match and match['date'] > state["history"].get(match['group'], ""):
+            new.setdefault(match['date'][:10], []).append((match['date'], match['group'], name))
+
+    os.makedirs(history_folder, exist_ok=True)
+    for round_name, files in sorted(new.items()):
+        path = os.path.join(history_folder, f"{round_name}.bin")
+        records = read_round(path) if os.path.exists(path) else {}
+        # A later run of a group in the same round replaces its earlier results
+        for date, group, name in sorted(files):
+            with open(os.path.join(output_folder, name), newline='', encoding='utf-8-sig') as file:
+                results = list(csv.DictReader(file))
+            records = {key: values for key, values in records.items() if key[0] != group}
+            records.update({(group, result["Instance"]): result_values(result) for result in results})
+            state["history"][group] = max(date, state["history"].get(group, ""))
+        write_round(path, records)
+    return sorted(new)
+
+
+def recent_rounds(history_folder, count=TREND_ROUNDS):
+    """(round, records) of the last `count` rounds, oldest first."""
+    if not os.path.isdir(history_folder):
+        return []
+    names = sorted(name for name in os.listdir(history_folder) if re.match(r'^\d{4}-\d{2}-\d{2}\.bin$', name))
+    return [(name[:-len('.bin')], read_round(os.path.join(history_folder, name))) for name in names[-count:]]
+
+
+def sparkline(values):
+    values = [value for value in values if math.isfinite(value)]
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARKLINE_BARS[len(SPARKLINE_BARS) // 2] * len(values)
+    return "".join(SPARKLINE_BARS[round((value - low) / (high - low) * (len(SPARKLINE_BARS) - 1))] for value in values)
+
+
+def profit_series(rounds, group, instance=None):
+    # Profit of a group per round it took part in, of one instance or summed over all (missing profits and infeasible
+    # results count as 0, like in the ranking)
+    series = []
+    for _, records in rounds:
+        profits = [profit if feasible else 0.0 for (g, i), (profit, _, feasible, _) in records.items()
+                   if g == group and (instance is None or i == instance)]
+        if profits:
+            series.append(sum(profit for profit in profits if math.isfinite(profit)))
+    return series
+
+
+def group_trends(rounds):
+    groups = {group for _, records in rounds for group, _ in records}
+    return {group: sparkline(profit_series(rounds, group)) for group in groups}
+
+
+def instance_ranks(records):
+    """Rank of every group per instance in a round, feasible results first and then by profit, {instance: {group: rank}}.
+
+    Equal results share a rank.
+    """
+    by_instance = {}
+    for (group, instance), (profit, _, feasible, _) in records.items():
+        by_instance.setdefault(instance, []).append(((feasible, profit), group))
+    ranks = {}
+    for instance, results in by_instance.items():
+        results.sort(reverse=True)
+        ranks[instance] = {}
+        for position, (key, group) in enumerate(results):
+            previous = results[position - 1]
+            ranks[instance][group] = ranks[instance][previous[1]] if position and previous[0] == key else position + 1
+    return ranks
+
+
+def instance_ranks_table(state, rounds):
+    if not rounds:
+        return "No per-instance results yet."
+    round_name, records = rounds[-1]
+    ranks = instance_ranks(records)
+    instances = sorted(ranks)
+    # Groups in leaderboard order, groups without a central row last
+    order = [group for group, _ in sorted(state["best"].items(), key=lambda item: rank_key(item[1]), reverse=True)]
+    groups = [group for group in order if any(group in ranks[instance] for instance in instances)]
+    groups += sorted({group for group, _ in records} - set(groups))
+
+    rows = [f"Per-instance rank (profit) in the round of {round_name}, ❌ marks infeasible results.", "",
+            "| GroupNumber | " + " | ".join(instances) + " |",
+            "| ------------------- |" + " ------- |" * len(instances)]
+    for group in groups:
+        cells = []
+        for instance in instances:
+            if group not in ranks[instance]:
+                cells.append("")
+                continue
+            profit, _, feasible, _ = records[group, instance]
+            profit = f"{profit:.0f}" if math.isfinite(profit) else "-"
+            cells.append(f"{ranks[instance][group]} ({profit}){'' if feasible else ' ❌'}")
+        rows.append(f"| {group} | " + " | ".join(cells) + " |")
+    return "\n".join(rows)
+
+
+def render_group_page(path, group, csv_path, best, rounds):
+    with open(csv_path, newline='', encoding='utf-8-sig') as file:
+        results = list(csv.DictReader(file))
+    date = GROUP_CSV_PATTERN.match(os.path.basename(csv_path))['date']
+
+    lines = [f"# {group}", ""]
+    if best is not None:
+        score = "N/A" if best["score"] is None else round(100.0 * best["score"], 2)
+        lines += [f"Best result: score {score}, cumulative profit {format_number(best['profit'])}, "
+                  f"runtime {format_number(best['runtime'])}s ({best['date_time'][:16]})", ""]
+    lines += [f"## Latest run ({date})", "",
+              "| Instance | Feasible | Profit | Runtime (s) | Violations | Errors |",
+              "| -------- | -------- | ------ | ----------- | ---------- | ------ |"]
+    for result in results:
+        errors = (result.get("Error") or "").replace("|", "\\|")
+        lines.append(f"| {result.get('Instance', '')} | {'✅' if result.get('Feasible') == 'Yes' else '❌'} | "
+                     f"{format_number(result.get('Profit', ''))} | {format_number(result.get('Runtime (seconds)', ''))} | "
+                     f"{result.get('Violations', '')} | {'' if errors == '[]' else errors} |")
+
+    instances = sorted({instance for _, records in rounds for g, instance in records if g == group})
+    if instances:
+        lines += ["", f"## Trend (last {len(rounds)} rounds)", "", "| Instance | Profit | Best | Latest |",
+                  "| -------- | ------ | ---- | ------ |"]
+        for instance in instances:
+            series = profit_series(rounds, group, instance)
+            lines.append(f"| {instance} | {sparkline(series)} | {format_number(max(series))} | "
+                         f"{format_number(series[-1])} |")
+    with open(path, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def update_group_pages(state, output_folder, pages_folder, changed_best, rounds):
+    """Render the pages of groups with a new run or a new best result, returns the number of pages written."""
+    os.makedirs(pages_folder, exist_ok=True)
+    written = 0
+    for group, name in latest_group_csvs(output_folder).items():
+        page_path = os.path.join(pages_folder, page_name(group))
+        if state["pages"].get(group) == name and group not in changed_best and os.path.exists(page_path):
+            continue
+        render_group_page(page_path, group, os.path.join(output_folder, name), state["best"].get(group), rounds)
+        state["pages"][group] = name
+        written += 1
+    return written
+
+
+def update_leaderboard(output_folder='output', readme_path='README.md', pages_folder='groups', history_folder='history',
+                       state_path=None, rebuild=False):
+    state_path = state_path or os.path.join(output_folder, 'leaderboard_state.json')
+    state = empty_state() if rebuild else load_state(state_path)
+
+    rows = read_new_rows(os.path.join(output_folder, 'central_results.csv'), state)
+    changed_best = update_best(state, rows)
+    new_rounds = update_history(state, output_folder, history_folder)
+    rounds = recent_rounds(history_folder)
+    pages = update_group_pages(state, output_folder, pages_folder, changed_best, rounds)
+    readme_changed = render_readme(readme_path, [
+        (LEADERBOARD_START, LEADERBOARD_END, leaderboard_table(state, os.path.basename(pages_folder), group_trends(rounds))),
+        (INSTANCE_RANKS_START, INSTANCE_RANKS_END, instance_ranks_table(state, rounds)),
+    ])
+    save_state(state, state_path)
+    print(f"{len(rows)} new rows, {len(changed_best)} groups with a new best result, {len(new_rounds)} history rounds "
+          f"updated, {pages} group pages written, README.md {'updated' if readme_changed else 'unchanged'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the leaderboard in README.md from output/central_results.csv.")
+    parser.add_argument("--output_folder", default='output', type=str, help="Folder with central_results.csv and the per-group CSVs")
+    parser.add_argument("--readme", default='README.md', type=str, help="README with the leaderboard markers")
+    parser.add_argument("--pages_folder", default='groups', type=str, help="Folder for the per-group pages")
+    parser.add_argument("--history_folder", default='history', type=str, help="Folder for the per-round history files")
+    parser.add_argument("--state", default=None, type=str, help="State file, defaults to leaderboard_state.json in the output folder")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the state file and read all rows again")
+    args = parser.parse_args()
+
+    update_leaderboard(args.output_folder, args.readme, args.pages_folder, args.history_folder, args.state, args.rebuild)
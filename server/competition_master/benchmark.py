@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import generate_instances
+
+# Benchmarks of the helper.py hot paths on synthetic instances of growing size. Every function is timed (median and
+# minimum over repeated calls) and its peak memory is measured once with tracemalloc. Results can be stored as a
+# baseline and later runs are compared against it, a function that got slower or uses more memory than the tolerance
+# allows is reported as a regression (and the exit code is 1).
+
+
+def load_helper(path):
+    spec = importlib.util.spec_from_file_location("benchmarked_helper", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def quiet(func):
+    # The legacy checks print a warning for every violation
+    if func is None:
+        return None
+
+    def run(*args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+    return run
+
+
+def feasible_solution(helper, instance, arrays):
+    # Regret insertion, or for a helper.py without it one pickup and delivery pair per truck
+    if arrays is not None and hasattr(helper, 'regret_insertion'):
+        return helper.regret_insertion(arrays)
+    depot_id = min(instance['depots'])
+    offset = len(instance['pick_up_locations'])
+    pickups = sorted(instance['pick_up_locations'])[:instance['number_of_trucks']]
+    return {'routes': [[{'node_id': node_id, 'waiting_time': 0}
+                        for node_id in (depot_id, pickup_id, pickup_id + offset, depot_id)] for pickup_id in pickups]}
+
+
+def benchmarks(helper, instance_path):
+    """(name, function, arguments) of every benchmarked helper function for one instance.
+
+    Functions that the helper does not have (an older helper.py, e.g. the one of a stored baseline) are left out.
+    """
+    lines = helper.read_instance(instance_path)
+    instance = helper.parse_instance(lines)
+    build_instance_arrays = getattr(helper, 'build_instance_arrays', None)
+    arrays = build_instance_arrays(instance) if build_instance_arrays is not None else None
+    depot_id = min(instance['depots'])
+
+    random.seed(0)
+    solution = {'routes': helper.generate_random_routes_from_instance(instance, depot_id)}
+    # The checks stop at the first violation, which the random routes have right away, so they are timed on a
+    # feasible solution too ("name:feasible")
+    feasible = feasible_solution(helper, instance, arrays)
+
+    def random_routes():
+        random.seed(0)
+        return helper.generate_random_routes_from_instance(instance, depot_id)
+
+    def solution_benchmarks(suffix, solution):
+        checks = [
+            ("check_vehicle_capacity", quiet(getattr(helper, 'check_vehicle_capacity', None)), (solution, instance, instance['vehicle_capacity'])),
+            ("check_start_end_at_depot", quiet(getattr(helper, 'check_start_end_at_depot', None)), (solution, instance)),
+            ("check_number_of_trucks", quiet(getattr(helper, 'check_number_of_trucks', None)), (solution, instance['number_of_trucks'])),
+            ("check_pickup_before_delivery", quiet(getattr(helper, 'check_pickup_before_delivery', None)), (solution, instance)),
+            ("check_no_duplicate_visits", quiet(getattr(helper, 'check_no_duplicate_visits', None)), (solution,)),
+            ("check_solution_feasibility", quiet(getattr(helper, 'check_solution_feasibility', None)), (solution, instance)),
+            ("validate_solution", getattr(helper, 'validate_solution', None), (solution, arrays)),
+            ("total_profit_with_penalties", helper.total_profit_with_penalties, (solution, instance)),
+            ("total_profit_fast", getattr(helper, 'total_profit_fast', None), (solution, arrays)),
+        ]
+        return [(name + suffix, func, args) for name, func, args in checks]
+
+    entries = [
+        ("read_instance", helper.read_instance, (instance_path,)),
+        ("parse_instance", helper.parse_instance, (lines,)),
+        ("parse_instance_arrays", getattr(helper, 'parse_instance_arrays', None), (lines,)),
+        ("build_instance_arrays", build_instance_arrays, (instance,)),
+        ("generate_random_routes_from_instance", random_routes, ()),
+    ] + solution_benchmarks("", solution) + solution_benchmarks(":feasible", feasible)
+    return [(name, func, args) for name, func, args in entries
+            if func is not None and all(arg is not None for arg in args)]
+
+
+def time_function(func, args, min_time=0.2, min_repeats=3, max_repeats=1000):
+    # Repeats the call until it ran for min_time seconds in total, with the garbage collector disabled like timeit
+    times = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while len(times) < max_repeats and (len(times) < min_repeats or sum(times) < min_time):
+            start_time = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start_time)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return times
+
+
+def peak_memory(func, args):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(helper, sizes, depots=3, seed=0, min_time=0.2, only=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            instance_path = generate_instances.write_instance(
+                os.path.join(folder, generate_instances.instance_name(size, depots, seed)), size, depots, seed)
+            for name, func, args in benchmarks(helper, instance_path):
+                if only and name not in only:
+                    continue
+                times = time_function(func, args, min_time)
+                median = statistics.median(times)
+                results[f"{name}[n={size}]"] = {
+                    "median_seconds": median, "min_seconds": min(times), "repeats": len(times),
+                    "nodes_per_second": size / median if median > 0 else float('inf'),
+                    "peak_memory_mb": peak_memory(func, args) / 2 ** 20,
+                }
+                print_result(f"{name}[n={size}]", results[f"{name}[n={size}]"])
+    return results
+
+
+def print_result(key, result):
+    print(f"{key:<48} {result['median_seconds'] * 1000:>11.3f} ms {result['min_seconds'] * 1000:>11.3f} ms "
+          f"{result['nodes_per_second']:>14,.0f} nodes/s {result['peak_memory_mb']:>9.2f} MB")
+
+
+def compare(results, baseline, tolerance=0.25, memory_tolerance=0.1):
+    """Regressions against a baseline: (key, metric, baseline value, new value) for every metric over tolerance."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        if result["median_seconds"] > old["median_seconds"] * (1 + tolerance):
+            regressions.append((key, "median_seconds", old["median_seconds"], result["median_seconds"]))
+        # A small absolute margin, tracemalloc peaks of tiny functions vary by a few KB
+        if result["peak_memory_mb"] > old["peak_memory_mb"] * (1 + memory_tolerance) + 0.05:
+            regressions.append((key, "peak_memory_mb", old["peak_memory_mb"], result["peak_memory_mb"]))
+    return regressions
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "node": platform.node()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the helper.py functions on synthetic instances.")
+    parser.add_argument("--helper", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "helper.py"), type=str, help="The helper.py to benchmark")
+    parser.add_argument("--sizes", nargs='+', default=[100, 1000, 10000], type=int, help="Number of pickup and delivery nodes per instance")
+    parser.add_argument("--depots", default=3, type=int, help="Number of depots")
+    parser.add_argument("--seed", default=0, type=int, help="Random seed of the instance generator")
+    parser.add_argument("--min_time", default=0.2, type=float, help="Minimum total time in seconds to repeat every function")
+    parser.add_argument("--only", nargs='*', help="Only benchmark these functions")
+    parser.add_argument("--output", default=None, type=str, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, type=str, help="Baseline JSON file to compare against")
+    parser.add_argument("--save_baseline", action="store_true", help="Store the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", default=0.25, type=float, help="Allowed relative slowdown before a function counts as a regression")
+    args = parser.parse_args()
+
+    print(f"{'function[nodes]':<48} {'median':>14} {'min':>14} {'throughput':>21} {'peak memory':>12}")
+    results = run_benchmarks(load_helper(args.helper), args.sizes, args.depots, args.seed, args.min_time, args.only)
+    report = {"environment": environment(), "results": results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print("Baseline saved:", args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["environment"] != report["environment"]:
+            print("Warning: the baseline was measured in a different environment:", baseline["environment"])
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key} {metric}: {old:.6g} -> {new:.6g} ({(new / old - 1) * 100 if old else float('inf'):+.1f}%)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
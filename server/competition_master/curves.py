@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+
+# Anytime curves: the best profit of a run over time. Every solution a run emits while it is still running (result
+# records and "incumbent" records on the result channel, RESULT and INCUMBENT lines on stdout) is scored with the fast
+# scorer when it arrives, the curve keeps the (seconds, profit) points where the best profit improved. evaluate.py
+# stores the curve of every run in the Curve column and can score groups on it instead of on the final profit only
+# (--score_mode auc or budgets, see curve_score).
+
+# Solutions arriving faster than this are not all scored, only the last one of such a burst (the solvers emit their
+# best solution so far, so the curve only loses resolution)
+CURVE_MIN_INTERVAL = 1.0
+SCORE_MODES = ("final", "auc", "budgets")
+DEFAULT_BUDGETS = (10, 60, 600)
+
+
+class Curve:
+    """Best profit over time of a single run, fed by the threads that read its output.
+
+    Args:
+        score: function that returns the profit of a solution dict, None for an infeasible one (see
+            evaluate.instance_curve)
+        start_time: time.perf_counter() value at which the clock of the run started
+        offset: seconds added to every point, the startup overhead of a persistent worker
+    """
+
+    def __init__(self, score, start_time, offset=0.0):
+        self.score = score
+        self.start_time = start_time
+        self.offset = offset
+        self.points = []
+        self.best_profit = None
+        self._pending = None
+        self._last_scored = None
+        self._lock = threading.Lock()
+
+    def add(self, solution, now=None):
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            if self._last_scored is not None and now - self._last_scored < CURVE_MIN_INTERVAL:
+                self._pending = (solution, now)
+                return
+            # The last solution of the previous burst is scored at the time it arrived, before the new one
+            if self._pending is not None:
+                self._add_point(*self._pending)
+                self._pending = None
+            self._last_scored = now
+            self._add_point(solution, now)
+
+    def finish(self):
+        # Scores the last solution of a burst, call once the output of the run has been read
+        with self._lock:
+            if self._pending is not None:
+                self._add_point(*self._pending)
+                self._pending = None
+
+    def _add_point(self, solution, now):
+        try:
+            profit = self.score(solution)
+        except Exception:
+            # A broken final solution is reported by evaluate_output, a broken intermediate one is only skipped
+            return
+        if profit is None:
+            return
+        if self.best_profit is None or profit > self.best_profit + 1e-9:
+            self.best_profit = profit
+            self.points.append([round(now - self.start_time + self.offset, 3), round(profit, 2)])
+
+    def to_json(self):
+        return json.dumps(self.points, separators=(',', ':')) if self.points else ""
+
+
+def parse_curve(text):
+    return json.loads(text) if text else []
+
+
+def profit_at(points, budget):
+    """Best profit reached within `budget` seconds, 0 if the run had no solution by then."""
+    profit = 0.0
+    for seconds, point_profit in points:
+        if seconds > budget:
+            break
+        profit = point_profit
+    return profit
+
+
+def area_under_curve(points, horizon):
+    """Mean best profit over [0, horizon] seconds (0 before the first solution), the final profit for an instant run."""
+    area, previous_time, previous_profit = 0.0, 0.0, 0.0
+    for seconds, profit in points:
+        seconds = min(seconds, horizon)
+        area += (seconds - previous_time) * previous_profit
+        previous_time, previous_profit = seconds, profit
+    area += (horizon - previous_time) * previous_profit
+    return area / horizon
+
+
+def result_curve(result):
+    # The curve of an instance result, results without one (cached from before curves, the reference constructor)
+    # count as a single solution at the end of the run, failed runs as no solution
+    if result["Profit"] == '-inf':
+        return []
+    points = parse_curve(result.get("Curve"))
+    if not points:
+        points = [[float(result["Runtime (seconds)"]), float(result["Profit"])]]
+    return points
+
+
+def curve_score(instance_results, mode, horizon, budgets=DEFAULT_BUDGETS, max_profit=225000):
+    """Score of a group on the curves of its instance results.
+
+    auc: the summed mean profit over [0, horizon] of every instance, so a solver that gets close to its final profit
+    early scores higher than one that needs the full time. budgets: the summed profit at every budget (in seconds),
+    averaged over the budgets. Both are normalized by max_profit like calculate_score.
+    """
+    group_curves = [result_curve(result) for result in instance_results]
+    if mode == "auc":
+        total = sum(area_under_curve(points, horizon) for points in group_curves)
+    elif mode == "budgets":
+        total = sum(profit_at(points, budget) for points in group_curves for budget in budgets) / len(budgets)
+    else:
+        raise ValueError(f"Unknown score mode {mode!r}, expected one of {', '.join(SCORE_MODES[1:])}")
+    return total / max_profit
@@ -3,12 +3,36 @@ import pathlib
 import subprocess
 import argparse
 import re
+import curves
 import helper
-import ast
+import instance_cache
+import resource_usage
+import result_protocol
+import results_cache
+import results_store
 import csv
 import time
+import queue
+import select
+import json
+import tempfile
+import threading
+import signal
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+RESOURCE_COLUMNS = ["User CPU (seconds)", "System CPU (seconds)", "Peak RSS (MB)", "Max processes", "Max threads"]
+RESULT_COLUMNS = ["Instance", "Runtime (seconds)", "Feasible", "Profit", "Error", "Violations",
+                  "Algorithm runtime (seconds)", "Startup overhead (seconds)"] + RESOURCE_COLUMNS + ["Profile", "Curve"]
+# evaluate.py --profile -> value of result_protocol.PROFILE_ENV for the runs
+PROFILE_MODES = {"off": None, "timers": "1", "cprofile": "cprofile"}
+# A time-budgeted run gets these signals at its deadline, each followed by a grace period in seconds, before it is
+# killed. SIGUSR1 asks the solver to stop and emit its best solution (helper.STOP_SIGNALS)
+BUDGET_STOP_SIGNALS = ((signal.SIGUSR1, 2.0), (signal.SIGTERM, 1.0))
+CENTRAL_COLUMNS = results_store.CENTRAL_COLUMNS
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+
 def calculate_score(cumulative_profits, total_runtime_seconds, max_profit=225000, max_runtime_seconds=1800):
     normalized_profit = cumulative_profits / max_profit
     normalized_runtime = 1 - (total_runtime_seconds / max_runtime_seconds)
@@ -16,150 +40,751 @@ def calculate_score(cumulative_profits, total_runtime_seconds, max_profit=225000
     return score
 
 
-def run_in_repo(repo_path, original_dir, instances):
+def find_group_folder(repo_path):
     group_folder_pattern = re.compile(r'^Group\d+$')
-    group_folder_path = None
-    instance_results = []
 
     for item in os.listdir(repo_path):
         if group_folder_pattern.match(item) and os.path.isdir(os.path.join(repo_path, item)):
-            group_folder_path = os.path.join(repo_path, item)
-            break
+            return os.path.join(repo_path, item)
+    return None
 
-    if not group_folder_path:
-        print(f"No group folder found in {repo_path}. Skipping...")
-        return
 
-    os.chdir(group_folder_path)
-    group_name = os.path.basename(group_folder_path)
-    
-    for instance in instances:
-        error_message, feasibility_checks = "", []
-        start_time = time.time()
+def make_cpu_slots(workers, cpus_per_job=None):
+    # Every worker gets its own disjoint set of CPUs, so concurrent jobs do not compete for the same core and the
+    # measured wall-clock time of a job stays comparable to a sequential run. A single worker is only pinned if
+    # cpus_per_job is given, otherwise its jobs may use all cores like in a plain sequential run
+    slots = queue.Queue()
+    if workers <= 1 and cpus_per_job is None:
+        slots.put(None)
+        return slots
+    cpus_per_job = cpus_per_job or 1
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+
+    if len(cpus) < workers * cpus_per_job:
+        print(f"Warning: {workers} workers x {cpus_per_job} CPUs requested but only {len(cpus)} CPUs available, "
+              f"jobs will not be pinned and runtimes may be inflated by contention!")
+        for _ in range(workers):
+            slots.put(None)
+        return slots
+
+    for i in range(workers):
+        slots.put(set(cpus[i * cpus_per_job:(i + 1) * cpus_per_job]))
+    return slots
+
+
+def pin_to(cpus):
+    # preexec_fn of a job: the child is pinned before it runs any code, so all its threads and processes inherit it
+    if not cpus:
+        return None
+    return lambda: os.sched_setaffinity(0, cpus)
+
+
+def signal_process_group(process, signum):
+    try:
+        os.killpg(process.pid, signum)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def kill_process_group(process):
+    signal_process_group(process, signal.SIGKILL)
+
+
+def budget_stop_steps(process):
+    # The stop_steps of resource_usage.wait_with_rusage for a time-budgeted run
+    return [(lambda signum=signum: signal_process_group(process, signum), grace)
+            for signum, grace in BUDGET_STOP_SIGNALS]
+
+
+class RunOutput:
+    """Output of a run of main.py, streamed instead of buffered.
+
+    Keeps the last result and profile records from the result channel, the legacy RESULT and PROFILE lines from stdout
+    and bounded tails of stdout and stderr for error messages. With a curve (see curves.Curve) every solution that
+    arrives is added to it. The last incumbent is kept for runs that are stopped at their time budget.
+    """
+
+    def __init__(self, curve=None):
+        self.curve = curve
+        self.stdout = result_protocol.OutputScanner(handlers={"RESULT:": self.add_line, "INCUMBENT:": self.add_line})
+        self.stderr = result_protocol.OutputScanner(prefixes=(), tail_lines=200)
+        self.result_record = None
+        self.profile_record = None
+        self.incumbent = None
+        self.stopped = False  # stopped at the time budget
+        self.channel_error = None
+        self._threads = []
+        self._streams = []
+
+    def follow(self, stream, consume):
+        # Consume a stream in a background thread while the process is running
+        thread = threading.Thread(target=consume, args=(stream,), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        self._streams.append(stream)
+
+    def consume_channel(self, stream):
+        for record in result_protocol.read_records(stream):
+            self.add_record(record)
+
+    def add_record(self, record, now=None):
+        # `now` is the time.perf_counter() value at which the record arrived, if it was queued before
+        if isinstance(record, result_protocol.ProtocolError):
+            self.channel_error = str(record)
+            return
+        if record.get("type") == "result":
+            self.result_record = record
+        elif record.get("type") == "profile":
+            self.profile_record = record
+        if record.get("type") in ("result", "incumbent"):
+            try:
+                solution = result_protocol.decode_solution(record)
+            except result_protocol.ProtocolError:
+                return
+            self.add_solution(solution, record["type"] == "incumbent", now)
+
+    def add_line(self, line):
+        try:
+            solution = result_protocol.parse_solution_line(line)
+        except (ValueError, SyntaxError):
+            return
+        self.add_solution(solution, line.startswith("INCUMBENT:"))
+
+    def add_solution(self, solution, incumbent, now=None):
+        if incumbent:
+            self.incumbent = solution
+        if self.curve is not None:
+            self.curve.add(solution, now)
+
+    def join(self, timeout=10):
+        for thread in self._threads:
+            thread.join(timeout)
+        for stream in self._streams:
+            stream.close()
+        if self.curve is not None:
+            self.curve.finish()
+
+    @property
+    def result_line(self):
+        return self.stdout.protocol_lines.get("RESULT:")
 
+    @property
+    def profile(self):
+        # The profile summary as compact JSON for the Profile column, "" if the run did not report one
+        if self.profile_record is not None:
+            summary = {key: value for key, value in self.profile_record.items() if key not in ("v", "type")}
+            return json.dumps(summary, separators=(',', ':'))
+        line = self.stdout.protocol_lines.get("PROFILE:")
+        return line[len("PROFILE:"):].strip() if line else ""
+
+    @property
+    def curve_json(self):
+        return self.curve.to_json() if self.curve is not None else ""
+
+
+def instance_curve(instance, instance_cache_dir=None, start_time=None, offset=0.0):
+    # Scores the solutions of a run with the fast scorer on the cached instance arrays, infeasible solutions are no
+    # points of the curve, like an infeasible final solution gets no score
+    arrays = instance_cache.load_instance_arrays(instance, instance_cache_dir)
+
+    def score(solution):
+        if not helper.validate_solution(solution, arrays)['feasible']:
+            return None
+        return helper.total_profit_fast(solution, arrays)
+
+    return curves.Curve(score, time.perf_counter() if start_time is None else start_time, offset)
+
+
+def evaluate_output(output, instance, instance_cache_dir=None):
+    error_message, feasibility_checks, violations = "", [], ""
+
+    # The result channel takes precedence, the RESULT line on stdout is the legacy fallback. A run stopped at its time
+    # budget without a result is scored on its last incumbent
+    incumbent = output.incumbent if output.stopped else None
+    if output.result_record is not None or output.result_line or incumbent is not None:
         try:
-            result = subprocess.run(['python3', 'main.py', '--instance_path', instance], capture_output=True, text=True, check=True, timeout=605)
-            runtime = time.time() - start_time
-            
-            output_lines = result.stdout.strip().split('\n')
-            output_line = next((line for line in output_lines if line.startswith("RESULT:")), None)
-            
-            if output_line:
-                dict_str = output_line.replace("RESULT: ", "").strip()
-                try:
-                    result_dict = ast.literal_eval(dict_str)
-                    read_instance = helper.read_instance(instance)
-                    instance_dict = helper.parse_instance(read_instance)
-
-                    # Proceed with feasibility checks and cost calculation
-                    feasible = True
-                    if not helper.check_vehicle_capacity(result_dict, instance_dict, instance_dict.get('vehicle_capacity', 0)):
-                        feasibility_checks.append("Vehicle capacity exceeded")
-                        feasible = False
-                    if not helper.check_start_end_at_depot(result_dict, instance_dict):
-                        feasibility_checks.append("Route does not start/end at depot")
-                        feasible = False
-                    if not helper.check_number_of_trucks(result_dict, instance_dict.get('number_of_trucks', 0)):
-                        feasibility_checks.append("Number of trucks exceeded")
-                        feasible = False
-                    if not helper.check_pickup_before_delivery(result_dict, instance_dict):
-                        feasibility_checks.append("Delivery before pickup OR only pickup, no delivery")
-                        feasible = False
-                    if not helper.check_no_duplicate_visits(result_dict):
-                        feasibility_checks.append("Visiting customer(s) more than once")
-                        feasible = False
-                    
-                    profit = helper.total_profit_with_penalties(result_dict, instance_dict)# if feasible else '-inf'
-                    feasibility = "Yes" if feasible else "No"
-                except Exception as e:
-                    error_message = str(e)
-                    feasibility = "No"
-                    profit = '-inf'
+            if output.result_record is not None:
+                result_dict = result_protocol.decode_solution(output.result_record)
+            elif output.result_line:
+                result_dict = result_protocol.parse_solution_line(output.result_line)
             else:
-                feasibility = "No"
-                profit = '-inf'
-                error_message = "No RESULT line found"
-                
-            instance_results.append((os.path.basename(instance), f"{runtime:.2f}", feasibility, profit, "; ".join([f"[{msg}]" for msg in feasibility_checks]) if feasibility_checks else f"[{error_message}]"))
-
-        except subprocess.TimeoutExpired as e:
-            runtime = (time.time() - start_time)
-            error_details = e.stderr if e.stderr else "No error details available."
-            # Include both the default error message and the specific error details
-            error_message = f"[Error running script: {e}. Details: {error_details}]"
-            instance_results.append((os.path.basename(instance), f"{runtime:.2f}", "No", '-inf', error_message))
+                result_dict = incumbent
+            instance_arrays = instance_cache.load_instance_arrays(instance, instance_cache_dir)
+
+            # Proceed with feasibility checks and cost calculation, all constraints are checked in a single pass
+            report = helper.validate_solution(result_dict, instance_arrays)
+            feasibility_checks = helper.feasibility_messages(report)
+            violations = len(report['violations'])
+            feasible = report['feasible']
+
+            profit = helper.total_profit_fast(result_dict, instance_arrays)# if feasible else '-inf'
+            feasibility = "Yes" if feasible else "No"
+        except Exception as e:
+            error_message = str(e)
+            feasibility = "No"
+            profit = '-inf'
+    else:
+        feasibility = "No"
+        profit = '-inf'
+        error_message = output.channel_error or ("No solution emitted within the time budget" if output.stopped
+                                                 else "No RESULT line found")
+
+    return feasibility, profit, "; ".join([f"[{msg}]" for msg in feasibility_checks]) if feasibility_checks else f"[{error_message}]", violations
+
+
+def limit_error(returncode, sampler, max_processes=None):
+    # Reason for a run that was stopped by one of the resource limits, if any
+    if sampler.limit_exceeded:
+        return f"Process limit exceeded (more than {max_processes} processes)"
+    return resource_usage.limit_message(returncode)
+
+
+def profile_env(env, profile):
+    # Profiling is opt-in, a VRP_PROFILE of the server environment is not passed on to the runs
+    env.pop(result_protocol.PROFILE_ENV, None)
+    if PROFILE_MODES.get(profile):
+        env[result_protocol.PROFILE_ENV] = PROFILE_MODES[profile]
+    return env
+
+
+def budget_env(env, time_budget):
+    # The budget and deadline of a time-budgeted run, call right before the run starts
+    for name in (result_protocol.TIME_BUDGET_ENV, result_protocol.DEADLINE_ENV):
+        env.pop(name, None)
+    if time_budget:
+        env[result_protocol.TIME_BUDGET_ENV] = str(time_budget)
+        env[result_protocol.DEADLINE_ENV] = str(time.time() + time_budget)
+    return env
+
+
+def entry_group_name(group_name, time_budget=None, score_mode="final"):
+    # Every budget of a --budgets night is a separate entry of the leaderboard, and so is every score mode other than
+    # final, since the curve scores are not comparable with calculate_score (e.g. GroupX@60s[auc])
+    name = f"{group_name}@{time_budget:g}s" if time_budget else group_name
+    return f"{name}[{score_mode}]" if score_mode != "final" else name
+
+
+def run_instance(group_folder_path, instance, cpus=None, timeout=605, instance_cache_dir=None,
+                 max_memory_mb=None, max_cpu_seconds=None, max_processes=None, profile=None, time_budget=None):
+    # The job runs with its own working directory (cwd=...), never via os.chdir, so concurrent jobs do not interfere
+    channel_read, channel_write = os.pipe()
+    env = profile_env(dict(os.environ, **{result_protocol.RESULT_FD_ENV: str(channel_write)}), profile)
+    env = budget_env(env, time_budget)
+    start_time = time.perf_counter()
+    output = RunOutput(instance_curve(instance, instance_cache_dir, start_time))
+    usage = {}
+
+    try:
+        try:
+            process = subprocess.Popen(['python3', 'main.py', '--instance_path', instance], cwd=group_folder_path,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env,
+                                       pass_fds=(channel_write,), start_new_session=True, preexec_fn=pin_to(cpus))
+        finally:
+            os.close(channel_write)
+        resource_usage.set_limits(process.pid, max_memory_mb, max_cpu_seconds)
+        sampler = resource_usage.ProcessTreeSampler(process.pid, max_processes=max_processes,
+                                                    on_limit=lambda: kill_process_group(process))
+        output.follow(process.stdout, output.stdout.consume)
+        output.follow(process.stderr, output.stderr.consume)
+        output.follow(os.fdopen(channel_read, 'r'), output.consume_channel)
+
+        # wait4 instead of process.wait, so the CPU time and peak memory of the run are known. A time-budgeted run is
+        # asked to stop at its deadline instead of the timeout
+        timed_out, rusage = resource_usage.wait_with_rusage(process, time_budget or timeout,
+                                                            lambda: kill_process_group(process),
+                                                            budget_stop_steps(process) if time_budget else ())
+        runtime = time.perf_counter() - start_time
+        sampler.stop()
+        usage = dict(resource_usage.rusage_fields(rusage), **sampler.fields())
+        # Also stops processes the group left behind, they would keep the output pipes open
+        kill_process_group(process)
+        output.join()
+
+        # A run stopped at its time budget is scored on the last solution it emitted, whatever its exit code
+        output.stopped = timed_out and bool(time_budget)
+        if timed_out and not output.stopped:
+            raise subprocess.TimeoutExpired(process.args, timeout, stderr=output.stderr.tail_text())
+        if process.returncode != 0 and not output.stopped:
+            reason = limit_error(process.returncode, sampler, max_processes)
+            stderr = output.stderr.tail_text()
+            raise subprocess.CalledProcessError(process.returncode, process.args,
+                                                stderr=f"{reason}. {stderr}" if reason else stderr)
+
+        feasibility, profit, error, violations = evaluate_output(output, instance, instance_cache_dir)
+        return {"Instance": os.path.basename(instance), "Runtime (seconds)": f"{runtime:.2f}",
+                "Feasible": feasibility, "Profit": profit, "Error": error, "Violations": violations,
+                "Algorithm runtime (seconds)": "", "Startup overhead (seconds)": "", **usage, "Profile": output.profile,
+                "Curve": output.curve_json}
+
+    except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+        runtime = (time.perf_counter() - start_time)
+        error_details = e.stderr if e.stderr else "No error details available."
+        # Include both the default error message and the specific error details
+        error_message = f"[Error running script: {e}. Details: {error_details}]"
+        return {"Instance": os.path.basename(instance), "Runtime (seconds)": f"{runtime:.2f}",
+                "Feasible": "No", "Profit": '-inf', "Error": error_message, "Violations": "",
+                "Algorithm runtime (seconds)": "", "Startup overhead (seconds)": "", **usage, "Profile": output.profile,
+                "Curve": output.curve_json}
+
+
+class WorkerError(Exception):
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
 
-        except subprocess.CalledProcessError as e:
-            runtime = (time.time() - start_time)
-            error_details = e.stderr if e.stderr else "No error details available."
+class PersistentWorker:
+    """A worker.py process inside a group folder that imports the group's main module once and runs all instances."""
+
+    def __init__(self, group_folder_path, cpus=None, timeout=605, max_memory_mb=None, max_processes=None, profile=None):
+        read_fd, write_fd = os.pipe()
+        channel_read, channel_write = os.pipe()
+        env = profile_env(dict(os.environ, **{result_protocol.RESULT_FD_ENV: str(channel_write)}), profile)
+        self.stderr_file = tempfile.TemporaryFile(mode='w+')
+        start_time = time.perf_counter()
+        try:
+            self.process = subprocess.Popen(['python3', WORKER_SCRIPT, '--reply_fd', str(write_fd)],
+                                            cwd=group_folder_path, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                            stderr=self.stderr_file, env=env, pass_fds=(write_fd, channel_write),
+                                            text=True, start_new_session=True, preexec_fn=pin_to(cpus))
+        finally:
+            os.close(write_fd)
+            os.close(channel_write)
+        resource_usage.set_limits(self.process.pid, max_memory_mb)
+        self.sampler = resource_usage.ProcessTreeSampler(self.process.pid, max_processes=max_processes,
+                                                         on_limit=lambda: kill_process_group(self.process))
+        self.replies = os.fdopen(read_fd, 'r')
+
+        # Records on the result channel are streamed into a queue, worker.py ends every instance with an "end" record
+        self.records = queue.Queue()  # (arrival time, record)
+        self.channel = os.fdopen(channel_read, 'r')
+        self.channel_thread = threading.Thread(target=self.consume_channel, daemon=True)
+        self.channel_thread.start()
+
+        try:
+            ready = self.read_reply(timeout)
+        except (subprocess.TimeoutExpired, WorkerError):
+            self.close()
+            raise
+        if not ready["ready"]:
+            self.kill()
+            self.close()
+            raise WorkerError("Importing main.py failed", ready["error"])
+        # Interpreter startup plus importing main.py and its libraries, paid once per group in this harness
+        self.startup_time = time.perf_counter() - start_time
+
+    def consume_channel(self):
+        for record in result_protocol.read_records(self.channel):
+            self.records.put((time.perf_counter(), record))
+        self.records.put((time.perf_counter(), None))
+
+    def read_reply(self, timeout, stop_steps=()):
+        ready, _, _ = select.select([self.replies], [], [], timeout)
+        for stop, grace in stop_steps if not ready else ():
+            stop()
+            ready, _, _ = select.select([self.replies], [], [], grace)
+            if ready:
+                break
+        if not ready:
+            self.kill()
+            raise subprocess.TimeoutExpired(self.process.args, timeout, stderr=self.stderr_tail())
+        line = self.replies.readline()
+        if not line:
+            returncode = self.process.wait()
+            raise WorkerError(f"Worker exited with code {returncode}", self.stderr_tail())
+        return json.loads(line)
+
+    def run(self, instance, timeout=605, max_cpu_seconds=None, curve=None, time_budget=None):
+        # Every instance gets the full CPU budget on top of what the worker used so far
+        resource_usage.set_limits(self.process.pid, max_cpu_seconds=max_cpu_seconds,
+                                  cpu_seconds_used=resource_usage.process_cpu_seconds(self.process.pid))
+        self.sampler.reset()
+        request = {"instance": instance}
+        if time_budget:
+            request.update(time_budget=time_budget, deadline=time.time() + time_budget)
+        start_time = time.perf_counter()
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            returncode = self.process.wait()
+            raise WorkerError(f"Worker exited with code {returncode}", self.stderr_tail())
+
+        output = RunOutput(curve)
+        if not time_budget:
+            reply = self.read_reply(timeout)
+        else:
+            try:
+                reply = self.read_reply(time_budget, [(lambda signum=signum: signal_process_group(self.process, signum),
+                                                       grace) for signum, grace in BUDGET_STOP_SIGNALS])
+            except (subprocess.TimeoutExpired, WorkerError):
+                # Killed (or ended by a stop signal) before it answered, it is scored on the solutions it emitted and
+                # replaced for the next instance
+                reply = {"protocol_lines": {}, "stdout_tail": [], "usage": {}, "error": None,
+                         "algorithm_runtime": time.perf_counter() - start_time}
+            output.stopped = time.perf_counter() - start_time >= time_budget
+        output.stdout.protocol_lines = reply["protocol_lines"]
+        output.stdout.tail.extend(reply["stdout_tail"])
+        while True:
+            try:
+                arrival_time, record = self.records.get(timeout=10)
+            except queue.Empty:
+                break
+            if record is None or (isinstance(record, dict) and record.get("type") == "end"):
+                break
+            output.add_record(record, arrival_time)
+        if curve is not None:
+            curve.finish()
+        reply["usage"].update(self.sampler.fields())
+        return reply, output
+
+    def stderr_tail(self, size=10000):
+        self.stderr_file.flush()
+        self.stderr_file.seek(0)
+        return self.stderr_file.read()[-size:]
+
+    def kill(self):
+        kill_process_group(self.process)
+        self.process.wait()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        kill_process_group(self.process)
+        self.process.wait()
+        self.sampler.stop()
+        self.channel_thread.join(5)
+        self.channel.close()
+        self.replies.close()
+        self.stderr_file.close()
+
+
+def run_group_persistent(group_folder_path, instances, cpus=None, timeout=605, instance_cache_dir=None,
+                         max_memory_mb=None, max_cpu_seconds=None, max_processes=None, profile=None, time_budget=None):
+    # Runs all instances of a group in one persistent worker, a new worker is started after a crash or timeout
+    instance_results = []
+    worker = None
+
+    for instance in instances:
+        start_time = time.perf_counter()
+        startup_time = 0.0
+        usage = {}
+        curve = None
+        try:
+            if worker is None:
+                worker = PersistentWorker(group_folder_path, cpus, timeout, max_memory_mb, max_processes, profile)
+                startup_time = worker.startup_time
+                start_time = time.perf_counter()
+            # The curve runs on the clock of the Runtime column, including the startup overhead of a new worker
+            curve = instance_curve(instance, instance_cache_dir, start_time, startup_time)
+            reply, output = worker.run(instance, timeout, max_cpu_seconds, curve, time_budget)
+            runtime = time.perf_counter() - start_time
+            usage = reply["usage"]
+
+            if reply["error"]:
+                raise WorkerError(reply["error"].strip().splitlines()[-1], reply["error"])
+
+            feasibility, profit, error, violations = evaluate_output(output, instance, instance_cache_dir)
+            # Like with a python3 process per instance the runtime is the wall-clock time of the run, the startup
+            # overhead of a worker counts once, towards the first instance it runs
+            instance_results.append({"Instance": os.path.basename(instance),
+                                     "Runtime (seconds)": f"{runtime + startup_time:.2f}",
+                                     "Feasible": feasibility, "Profit": profit, "Error": error, "Violations": violations,
+                                     "Algorithm runtime (seconds)": f"{reply['algorithm_runtime']:.2f}",
+                                     "Startup overhead (seconds)": f"{startup_time:.2f}", **usage,
+                                     "Profile": output.profile, "Curve": output.curve_json})
+            # A worker that did not survive the stop signals of its time budget is replaced
+            if worker.process.poll() is not None:
+                worker.close()
+                worker = None
+
+        except (subprocess.TimeoutExpired, WorkerError) as e:
+            runtime = time.perf_counter() - start_time + startup_time
+            error_details = e.details if isinstance(e, WorkerError) else e.stderr
+            if worker is not None and worker.process.poll() is not None:
+                reason = limit_error(worker.process.returncode, worker.sampler, max_processes)
+                if reason:
+                    error_details = f"{reason}. {error_details or ''}"
             # Include both the default error message and the specific error details
-            error_message = f"[Error running script: {e}. Details: {error_details}]"
-            instance_results.append((os.path.basename(instance), f"{runtime:.2f}", "No", '-inf', error_message))
+            error_message = f"[Error running script: {e}. Details: {error_details or 'No error details available.'}]"
+            instance_results.append({"Instance": os.path.basename(instance), "Runtime (seconds)": f"{runtime:.2f}",
+                                     "Feasible": "No", "Profit": '-inf', "Error": error_message, "Violations": "",
+                                     "Algorithm runtime (seconds)": "", "Startup overhead (seconds)": "", **usage,
+                                     "Profile": "", "Curve": curve.to_json() if curve is not None else ""})
+
+            # A worker that timed out or crashed is replaced for the next instance, after an exception in main() the
+            # same worker continues
+            if worker is not None and worker.process.poll() is not None:
+                worker.close()
+                worker = None
 
-            #runtime = time.time() - start_time
-            #error_message = str(e)
-            #instance_results.append((os.path.basename(instance), f"{runtime:.2f}", "No", '-inf', f"[Error running script: {error_message}]"))
+    if worker is not None:
+        worker.close()
+    return instance_results
 
+
+def write_group_results(group_name, instance_results, original_dir, store=None, run_id=None, repo=None, reused=None,
+                        score_mode="final", score_budgets=curves.DEFAULT_BUDGETS, timeout=605):
     # Write group-specific CSV
     current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M")
     csv_file_path = os.path.join(original_dir, "run_output", f"{group_name}_{current_datetime}.csv")
     with open(csv_file_path, mode='w', newline='') as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow(["Instance", "Runtime (seconds)", "Feasible", "Profit", "Error"])
+        writer = csv.DictWriter(csv_file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
         for result in instance_results:
             writer.writerow(result)
 
-    # Append to central results CSV
+    # Central results row, the central CSV is exported from the results store or appended to without one
     current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     central_results_file_path = os.path.join(original_dir, "run_output", "central_results.csv")
-    with open(central_results_file_path, mode='a', newline='') as central_file:
+    # Convert total runtime to minutes for score calculation. Both harnesses are scored on the wall-clock runtime, so
+    # the harness does not change the ranking (the persistent harness counts its startup overhead once per worker)
+    total_runtime = sum(float(result["Runtime (seconds)"]) for result in instance_results)
+    overall_feasible = "Yes" if all(result["Feasible"] == "Yes" for result in instance_results) else "No"
+    total_runtime_minutes = total_runtime / 60
+
+    # Ensure cumulative profits and runtime are in the correct format and calculate the score
+    cumulative_profits = sum(float(result["Profit"]) for result in instance_results if result["Profit"] != '-inf')
+    if overall_feasible == "Yes" and score_mode != "final":
+        # Anytime scores on the profit-vs-time curves, the horizon of the area under the curve is the time limit
+        score = curves.curve_score(instance_results, score_mode, timeout, score_budgets)
+    elif overall_feasible == "Yes":
+        score = calculate_score(cumulative_profits, total_runtime_minutes)
+    else:
+        score = "N/A"  # or set to a default value indicating infeasibility
+
+    total_cpu = sum(float(result.get(column) or 0) for result in instance_results
+                    for column in ("User CPU (seconds)", "System CPU (seconds)"))
+    peak_rss = max((float(result.get("Peak RSS (MB)") or 0) for result in instance_results), default=0)
+    central_row = {
+        "Group": group_name, "Cumulative Profits": f"{cumulative_profits:.2f}", "Total Runtime (seconds)": f"{total_runtime:.2f}",
+        "Overall Feasible": overall_feasible, "Score": score, "Date Time": current_datetime,
+        "Total CPU (seconds)": f"{total_cpu:.2f}", "Peak RSS (MB)": f"{peak_rss:.1f}"}
+    # The SQLite results store (see results_store.py) keeps the row together with the instance results
+    if store is not None:
+        store.add_group_result(run_id, central_row, instance_results, repo, reused)
+        store.export_central_csv(central_results_file_path)
+    else:
+        append_central_row(central_results_file_path, central_row)
+
+
+def append_central_row(path, row):
+    # A central CSV written before columns were added is rewritten once with the new columns appended to its header,
+    # old rows keep their values and get empty cells for the new columns
+    columns = CENTRAL_COLUMNS
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, newline='') as central_file:
+            header = next(csv.reader(central_file), [])
+        columns = header + [column for column in CENTRAL_COLUMNS if column not in header]
+        if columns != header:
+            with open(path, newline='') as central_file:
+                rows = list(csv.DictReader(central_file))
+            with open(path, mode='w', newline='') as central_file:
+                writer = csv.DictWriter(central_file, fieldnames=columns, restval="")
+                writer.writeheader()
+                writer.writerows(rows)
+
+    with open(path, mode='a', newline='') as central_file:
         central_writer = csv.writer(central_file)
         # If this is the first entry, write the header with an additional "Date Time" column
         if central_file.tell() == 0:
-            central_writer.writerow(["Group", "Cumulative Profits", "Total Runtime (seconds)", "Overall Feasible", "Score", "Date Time"])
-        # Convert total runtime to minutes for score calculation
-        total_runtime = sum(float(runtime) for _, runtime, _, _, _ in instance_results)
-        overall_feasible = "Yes" if all(fea == "Yes" for _, _, fea, _, _ in instance_results) else "No"
-        total_runtime_minutes = total_runtime / 60
-        
-        # Ensure cumulative profits and runtime are in the correct format and calculate the score
-        if overall_feasible == "Yes":
-            cumulative_profits = sum(float(profit) for _, _, _, profit, _ in instance_results if profit != '-inf')
-            score = calculate_score(cumulative_profits, total_runtime_minutes)
+            central_writer.writerow(columns)
+        central_writer.writerow([row.get(column, "") for column in columns])
+
+
+def reference_results(instance_paths, instance_cache_dir=None):
+    # The regret insertion constructor of helper.py as a reference group on the leaderboard, it also shows instances
+    # that cannot be parsed or have no feasible solution
+    instance_results = []
+    for instance in instance_paths:
+        instance_arrays = instance_cache.load_instance_arrays(instance, instance_cache_dir)
+        start_time = time.perf_counter()
+        solution = helper.regret_insertion(instance_arrays)
+        runtime = time.perf_counter() - start_time
+
+        report = helper.validate_solution(solution, instance_arrays)
+        feasibility_checks = helper.feasibility_messages(report)
+        if not report['feasible'] or not solution['routes']:
+            print(f"Warning: no feasible reference solution for {instance}, check the instance!")
+        instance_results.append({"Instance": os.path.basename(instance), "Runtime (seconds)": f"{runtime:.2f}",
+                                 "Feasible": "Yes" if report['feasible'] else "No",
+                                 "Profit": helper.total_profit_fast(solution, instance_arrays),
+                                 "Error": "; ".join([f"[{msg}]" for msg in feasibility_checks]) if feasibility_checks else "[]",
+                                 "Violations": len(report['violations']), "Algorithm runtime (seconds)": f"{runtime:.2f}",
+                                 "Startup overhead (seconds)": ""})
+    return instance_results
+
+
+def run_in_repo(repo_path, original_dir, instances):
+    # Sequential evaluation of a single repo, process_assignments_in_folder schedules jobs across all repos instead
+    group_folder_path = find_group_folder(repo_path)
+
+    if not group_folder_path:
+        print(f"No group folder found in {repo_path}. Skipping...")
+        return
+
+    group_name = os.path.basename(group_folder_path)
+    instance_results = [run_instance(group_folder_path, instance) for instance in instances]
+    write_group_results(group_name, instance_results, original_dir)
+
+
+def process_assignments_in_folder(root_folder, instances_folder, workers=1, cpus_per_job=None, harness="subprocess", force=False,
+                                  reference=False, score_mode="final", score_budgets=curves.DEFAULT_BUDGETS, **options):
+    # List all instance paths in the specified folder, absolute since every job runs inside its own group folder
+    instance_paths = [os.path.abspath(pathlib.Path(instances_folder) / f) for f in sorted(os.listdir(instances_folder)) if os.path.isfile(os.path.join(instances_folder, f))]
+
+    # Compile (or load) every instance once up front, all jobs share the same memory-mapped arrays. All groups are
+    # ranked on the sum over the same instances, so a malformed instance fails the run before anything is evaluated,
+    # after all of them are reported
+    malformed = []
+    for instance in instance_paths:
+        try:
+            instance_cache.load_instance_arrays(instance, options.get('instance_cache_dir'))
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"Malformed instance {os.path.basename(instance)}: {e}")
+            malformed.append(os.path.basename(instance))
+    if malformed:
+        raise ValueError(f"Malformed instances, fix or remove them before evaluating: {', '.join(malformed)}")
+
+    # Every group result is committed to the store as soon as it is written, an interrupted run has no finish time
+    config = results_cache.config_fingerprint(harness, options)
+    store = results_store.ResultsStore(os.path.join(root_folder, "run_output", "results.sqlite"))
+    try:
+        # central_results.csv is exported from the store, rows of a CSV written before the store are moved into it
+        central_results_file_path = os.path.join(root_folder, "run_output", "central_results.csv")
+        if os.path.exists(central_results_file_path):
+            store.import_missing_central_rows(central_results_file_path)
+        # The score mode only changes how the group results are scored, the instance results do not depend on it
+        scoring = {"score_mode": score_mode, "score_budgets": score_budgets,
+                   "timeout": options.get("time_budget") or options.get("timeout", 605)}
+        run_id = store.start_run(harness, config, dict(options, score_mode=score_mode, score_budgets=score_budgets))
+
+        if reference:
+            write_group_results(entry_group_name("Reference", options.get("time_budget"), score_mode), reference_results(instance_paths, options.get('instance_cache_dir')), root_folder,
+                                store, run_id, **scoring)
+
+        group_folders = []
+        for assignment_folder in os.listdir(root_folder):
+            a_folder = os.path.join(root_folder, assignment_folder)
+
+            if not os.path.isdir(a_folder):
+                continue
+
+            print("#### ASSIGNMENT repo name:", assignment_folder)
+
+            for repo in os.listdir(a_folder):
+                dir_repo = pathlib.Path(root_folder) / assignment_folder / repo
+
+                if os.path.isdir(dir_repo):
+                    group_folder_path = find_group_folder(dir_repo)
+                    if not group_folder_path:
+                        print(f"No group folder found in {dir_repo}. Skipping...")
+                        continue
+                    print("Queueing repo:", dir_repo)
+                    group_folders.append(group_folder_path)
+
+        # Results of groups whose code, the instances and the evaluation settings did not change since the last run are
+        # reused, only the missing group x instance pairs are run (all of them with force)
+        cache = results_cache.ResultsCache(os.path.join(root_folder, "run_output", "results_cache.json"))
+        instance_hashes = [instance_cache.file_hash(instance) for instance in instance_paths]
+        fingerprints = {group_folder_path: results_cache.group_fingerprint(group_folder_path) for group_folder_path in group_folders}
+
+        results = {group_folder_path: [None] * len(instance_paths) for group_folder_path in group_folders}
+        todo = {}
+        for group_folder_path in group_folders:
+            group_key = os.path.relpath(group_folder_path, root_folder)
+            for i, instance_hash in enumerate(instance_hashes):
+                if not force:
+                    results[group_folder_path][i] = cache.lookup(group_key, fingerprints[group_folder_path], config, instance_hash)
+                if results[group_folder_path][i] is None:
+                    todo.setdefault(group_folder_path, []).append(i)
+            if group_folder_path not in todo:
+                print("Reusing results of unchanged group:", entry_group_name(os.path.basename(group_folder_path), options.get("time_budget"), score_mode))
+
+        def finish_group(group_folder_path):
+            group_name = entry_group_name(os.path.basename(group_folder_path), options.get("time_budget"), score_mode)
+            print("Finished group:", group_name)
+            group_results = results.pop(group_folder_path)
+            cache.store(os.path.relpath(group_folder_path, root_folder), fingerprints[group_folder_path], config,
+                        dict(zip(instance_hashes, group_results)))
+            cache.save()
+            group_key = os.path.relpath(group_folder_path, root_folder)
+            reused = [i not in todo.get(group_folder_path, ()) for i in range(len(instance_paths))]
+            write_group_results(group_name, group_results, root_folder, store, run_id, group_key, reused, **scoring)
+
+        # With the subprocess harness every group x instance pair is an independent job, with the persistent harness a
+        # job is a group with all its instances. A job waits for a free CPU slot before its clock starts
+        slots = make_cpu_slots(workers, cpus_per_job)
+        if harness == "persistent":
+            jobs = [(group_folder_path, indices) for group_folder_path, indices in todo.items()]
         else:
-            score = "N/A"  # or set to a default value indicating infeasibility
-            cumulative_profits = sum(float(profit) for _, _, _, profit, _ in instance_results if profit != '-inf')
-        # Then append the calculated score to your central_writer.writerow call
-        central_writer.writerow([group_name, f"{cumulative_profits:.2f}", f"{total_runtime:.2f}", overall_feasible, score, current_datetime])
-    
-        os.chdir(original_dir)
+            jobs = [(group_folder_path, [i]) for group_folder_path, indices in todo.items() for i in indices]
+
+        def job(group_folder_path, indices):
+            cpus = slots.get()
+            try:
+                if harness == "persistent":
+                    return run_group_persistent(group_folder_path, [instance_paths[i] for i in indices], cpus=cpus, **options)
+                return [run_instance(group_folder_path, instance_paths[i], cpus=cpus, **options) for i in indices]
+            finally:
+                slots.put(cpus)
+
+        remaining = {group_folder_path: len(indices) for group_folder_path, indices in todo.items()}
+        for group_folder_path in group_folders:
+            if group_folder_path not in todo:
+                finish_group(group_folder_path)
 
-def process_assignments_in_folder(root_folder, instances_folder):
-    # List all instance paths in the specified folder
-    instance_paths = [str(pathlib.Path(instances_folder) / f) for f in os.listdir(instances_folder) if os.path.isfile(os.path.join(instances_folder, f))]
-    
-    for assignment_folder in os.listdir(root_folder):
-        a_folder = os.path.join(root_folder, assignment_folder)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(job, group_folder_path, indices): (group_folder_path, indices)
+                       for group_folder_path, indices in jobs}
 
-        if not os.path.isdir(a_folder):
-            continue
+            # Results are written from this thread only, as soon as all instances of a group are done
+            for future in as_completed(futures):
+                group_folder_path, indices = futures[future]
+                for i, result in zip(indices, future.result()):
+                    results[group_folder_path][i] = result
+                remaining[group_folder_path] -= len(indices)
 
-        print("#### ASSIGNMENT repo name:", assignment_folder)
+                if remaining[group_folder_path] == 0:
+                    finish_group(group_folder_path)
 
-        for repo in os.listdir(a_folder):
-            dir_repo = pathlib.Path(root_folder) / assignment_folder / repo
+        store.finish_run(run_id)
+    finally:
+        store.close()
 
-            if os.path.isdir(dir_repo):
-                print("Processing repo:", dir_repo)
-                run_in_repo(dir_repo, root_folder, instance_paths)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process assignments with multiple instances in specific group folders.")
     parser.add_argument("--repos_dir", default='home_path/repos/', type=str, help="Directory with the repositories")
     parser.add_argument("--instances_folder", default='home_path/competition_master/Instances/', type=str, help="Folder containing instance files")
+    parser.add_argument("--workers", default=1, type=int, help="Number of group x instance jobs to run concurrently")
+    parser.add_argument("--cpus_per_job", default=None, type=int, help="Number of CPUs each job is pinned to, 1 with --workers > 1, jobs of a single worker are not pinned by default")
+    parser.add_argument("--instance_cache_dir", default=None, type=str, help="Folder for compiled instances, defaults to Instances/.cache")
+    parser.add_argument("--timeout", default=605, type=float, help="Time limit in seconds per instance run")
+    parser.add_argument("--max_memory_mb", default=None, type=float, help="Address space limit in MB per run (RLIMIT_AS)")
+    parser.add_argument("--max_cpu_seconds", default=None, type=float, help="CPU time limit in seconds per instance run (RLIMIT_CPU)")
+    parser.add_argument("--max_processes", default=None, type=int, help="Maximum number of processes per run, the run is killed when it starts more")
+    parser.add_argument("--force", action="store_true", help="Evaluate all groups, also those whose results can be reused")
+    parser.add_argument("--reference", action="store_true", help="Also score the regret insertion constructor of helper.py as group 'Reference'")
+    parser.add_argument("--profile", default="off", choices=list(PROFILE_MODES), help="Profile the runs (timers and counters of helper.profiler, optionally cProfile) into the Profile column")
+    parser.add_argument("--score_mode", default="final", choices=curves.SCORE_MODES, help="Score on the final profit and runtime, the area under the profit-vs-time curve or the profit at fixed time budgets")
+    parser.add_argument("--score_budgets", default=list(curves.DEFAULT_BUDGETS), type=float, nargs="+", help="Time budgets in seconds for --score_mode budgets")
+    parser.add_argument("--budgets", default=None, type=float, nargs="+", help="Time budgets in seconds, every group is evaluated once per budget (as GroupX@<budget>s) and asked to stop at the deadline instead of being killed at --timeout")
+    parser.add_argument("--harness", default="subprocess", choices=["subprocess", "persistent"], help="Run main.py as a fresh python3 process per instance, or import it once per group in a persistent worker")
 
     args = parser.parse_args()
 
     if args.repos_dir:
         os.makedirs(args.repos_dir, exist_ok=True)
-        process_assignments_in_folder(args.repos_dir, args.instances_folder)
+        for time_budget in args.budgets or [None]:
+            process_assignments_in_folder(args.repos_dir, args.instances_folder, args.workers, args.cpus_per_job, args.harness, args.force, args.reference,
+                                          args.score_mode, args.score_budgets,
+                                          timeout=args.timeout, instance_cache_dir=args.instance_cache_dir,
+                                          max_memory_mb=args.max_memory_mb, max_cpu_seconds=args.max_cpu_seconds,
+                                          max_processes=args.max_processes, profile=args.profile, time_budget=time_budget)
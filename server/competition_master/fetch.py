@@ -5,6 +5,8 @@ import argparse
 import os
 import pathlib
 
+import repo_sync
+
 
 def run_command(command):
     """Run a command in the shell and return its output."""
@@ -51,17 +53,22 @@ def view_assignment_info(assignment_id):
     )
 
 
-def clone_all_assignments_from_classroom_to_folder(classroom_id, folder):
+def clone_all_assignments_from_classroom_to_folder(classroom_id, folder, assignment_ids=None, workers=8, timeout=300, retries=2):
     print(view_classroom_info(classroom_id))
-    df = list_assignments_from_classroom(classroom_id)
-    assignment_ids = list(df.iloc[:, 0])
-    
+    if not assignment_ids:
+        df = list_assignments_from_classroom(classroom_id)
+        assignment_ids = list(df.iloc[:, 0])
+
     print(assignment_ids)
 
-   
-    print(view_assignment_info(582369))
-        
-    print(clone_assignment_submissions_to_folder(582369, folder))
+    # gh classroom only clones repos that are not there yet, the existing clones are updated in parallel afterwards
+    existing = repo_sync.existing_clones(folder)
+    for assignment_id in assignment_ids:
+        print(view_assignment_info(assignment_id))
+        print(clone_assignment_submissions_to_folder(assignment_id, folder))
+
+    results = repo_sync.sync_repos(existing, workers, timeout, retries)
+    return repo_sync.print_report(results)
 
 
 def parse_assignment_info(assignment_id):
@@ -154,10 +161,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Clone student repos.")
     parser.add_argument("--classroom_id", default=12345, type=int, help="The GitHub Classroom ID")
     parser.add_argument("--repos_dir", default='home_path/repos/', type=str,help="Directory to clone the repositories into")
+    parser.add_argument("--assignment_id", nargs='*', type=int, help="The assignment ID(s) to clone, defaults to all assignments of the classroom")
+    parser.add_argument("--workers", default=8, type=int, help="Number of existing clones to update concurrently")
+    parser.add_argument("--timeout", default=300, type=float, help="Time limit in seconds per git command")
+    parser.add_argument("--retries", default=2, type=int, help="Number of retries for a repository that fails")
     args = parser.parse_args()
 
     if args.classroom_id and args.repos_dir:
         
         clone_all_assignments_from_classroom_to_folder(
-            args.classroom_id, args.repos_dir
+            args.classroom_id, args.repos_dir, args.assignment_id, args.workers, args.timeout, args.retries
         )
\ No newline at end of file
@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+
+# Seeded generator for synthetic instances in the same (Li & Lim based) text format as the competition instances:
+# multiple depots with ids 1..d, pickups d+1..d+n and their deliveries at pickup id + n with the negative demand.
+# Half of the pickups are placed in clusters and half uniformly at random, like the lrc instances.
+
+
+def generate_instance(number_of_nodes, number_of_depots=3, seed=0, grid_size=200, capacity=200, max_working_hours=8,
+                      revenue=50, clusters=8):
+    """Generate an instance with `number_of_nodes` pickup and delivery locations (half of each), returns its lines."""
+    rng = random.Random(seed)
+    n = number_of_nodes // 2
+
+    centers = [(rng.uniform(0.1, 0.9) * grid_size, rng.uniform(0.1, 0.9) * grid_size) for _ in range(clusters)]
+
+    def location():
+        if rng.random() < 0.5:
+            cx, cy = rng.choice(centers)
+            x, y = rng.gauss(cx, grid_size / 20), rng.gauss(cy, grid_size / 20)
+        else:
+            x, y = rng.uniform(0, grid_size), rng.uniform(0, grid_size)
+        return min(max(int(x), 0), grid_size), min(max(int(y), 0), grid_size)
+
+    depots = []
+    for depot_id in range(1, number_of_depots + 1):
+        x, y = location()
+        depots.append((depot_id, x, y, 0, 0, max_working_hours))
+
+    pickups, deliveries = [], []
+    for i in range(n):
+        pickup_id = number_of_depots + 1 + i
+        demand = rng.randint(1, 50)
+        start = rng.randint(0, max_working_hours - 2)
+        x, y = location()
+        pickups.append((pickup_id, x, y, demand, start, start + max_working_hours))
+
+        delivery_start = start + rng.randint(0, 4)
+        x, y = location()
+        deliveries.append((pickup_id + n, x, y, -demand, delivery_start, delivery_start + max_working_hours))
+
+    header = [("Cardinality of the grid", number_of_depots + 2 * n), ("Cardinality of pick-up locations", n),
+              ("Cardinality of delivery locations", n), ("Cardinality of depots", number_of_depots),
+              ("Total number of trucks", f"{n}\t"), ("Capacity of trucks", capacity),
+              ("Maximum working hours", max_working_hours), ("Revenue of selling an order [e/kg]", revenue)]
+
+    lines = []
+    for title, value in header:
+        lines += [f"/* {title} */", str(value)]
+    lines.append("/* Depots */")
+    lines += ["\t".join(map(str, node)) for node in depots]
+    lines.append("/* Pick up locations */\t\t\t\t\t")
+    lines += ["\t".join(map(str, node)) for node in pickups]
+    lines.append("/* Delivery locations */\t\t\t\t\t")
+    lines += ["\t".join(map(str, node)) for node in deliveries]
+    return lines
+
+
+def write_instance(path, number_of_nodes, number_of_depots=3, seed=0, **kwargs):
+    lines = generate_instance(number_of_nodes, number_of_depots, seed, **kwargs)
+    # The competition instances have no newline at the end of the file
+    with open(path, 'w') as file:
+        file.write("\n".join(lines))
+    return path
+
+
+def instance_name(number_of_nodes, number_of_depots=3, seed=0):
+    return f"synthetic_n{number_of_nodes}_d{number_of_depots}_s{seed}.txt"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic multi-depot pickup and delivery instances.")
+    parser.add_argument("--sizes", nargs='+', default=[100, 1000, 10000], type=int, help="Number of pickup and delivery nodes per instance")
+    parser.add_argument("--depots", default=3, type=int, help="Number of depots")
+    parser.add_argument("--seed", default=0, type=int, help="Random seed")
+    parser.add_argument("--output_folder", default='synthetic_instances', type=str, help="Folder to write the instances to")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    for size in args.sizes:
+        path = write_instance(os.path.join(args.output_folder, instance_name(size, args.depots, args.seed)), size, args.depots, args.seed)
+        print("Written:", path)
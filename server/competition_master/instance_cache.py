@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+import helper
+
+# Compiled instance cache: the arrays of helper.build_instance_arrays are stored as plain .npy files in a folder named
+# after the instance and the hash of its text file. The .npy files are loaded memory-mapped, so all evaluation jobs
+# (threads, and worker processes via the page cache) share a single read-only copy instead of re-reading and
+# re-parsing the text file for every group. The distance matrix is not stored, it is a helper.DistanceMatrix over the
+# coordinates that is built once per process and instance.
+
+CACHE_VERSION = 3
+ARRAY_KEYS = ('x_coord', 'y_coord', 'demand', 'time_window_start', 'time_window_end', 'node_type')
+SCALAR_KEYS = ('number_of_customers', 'number_of_trucks', 'vehicle_capacity', 'maximum_working_hours', 'revenue')
+
+_loaded = {}
+_lock = threading.Lock()
+# (absolute path, mtime in ns, size) -> digest, a file is only hashed again after it changed
+_digests = {}
+
+
+def file_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        _digests[key] = digest.hexdigest()
+    return _digests[key]
+
+
+def cache_folder(instance_path, cache_dir, digest):
+    name = os.path.splitext(os.path.basename(instance_path))[0]
+    return os.path.join(cache_dir, f"{name}-v{CACHE_VERSION}-{digest[:16]}")
+
+
+def compile_instance(instance_path, folder):
+    """Parse the text instance and write its arrays to `folder`, the folder appears atomically when complete."""
+    arrays = helper.parse_instance_arrays(helper.read_instance(instance_path))
+
+    os.makedirs(os.path.dirname(folder), exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(folder))
+    try:
+        for key in ARRAY_KEYS:
+            np.save(os.path.join(tmp_folder, f"{key}.npy"), arrays[key])
+        with open(os.path.join(tmp_folder, 'meta.json'), 'w') as file:
+            json.dump({key: int(arrays[key]) for key in SCALAR_KEYS}, file)
+        os.rename(tmp_folder, folder)
+    except OSError:
+        # another process may have compiled the same instance in the meantime
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        if not os.path.isdir(folder):
+            raise
+    return arrays
+
+
+def read_compiled_instance(folder):
+    arrays = {key: np.load(os.path.join(folder, f"{key}.npy"), mmap_mode='r') for key in ARRAY_KEYS}
+    arrays['distance'] = helper.DistanceMatrix(arrays['x_coord'], arrays['y_coord'])
+    with open(os.path.join(folder, 'meta.json')) as file:
+        arrays.update(json.load(file))
+    return arrays
+
+
+def load_instance_arrays(instance_path, cache_dir=None):
+    """Arrays of an instance, from the compiled cache if possible, compiled on first use.
+
+    Falls back to parsing the text file if the cache cannot be read or written. Within a process every instance is
+    loaded once and the same (read-only) arrays are returned to all callers.
+
+    Args:
+        instance_path: path to the instance text file
+        cache_dir: folder for the compiled instances, defaults to a .cache folder next to the instance
+    """
+    digest = file_hash(instance_path)
+    key = (os.path.abspath(instance_path), digest)
+
+    with _lock:
+        if key in _loaded:
+            return _loaded[key]
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(instance_path)), '.cache')
+        folder = cache_folder(instance_path, cache_dir, digest)
+
+        try:
+            if not os.path.isdir(folder):
+                compile_instance(instance_path, folder)
+            arrays = read_compiled_instance(folder)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: could not use compiled instance cache for {instance_path} ({e}), parsing text file")
+            arrays = helper.parse_instance_arrays(helper.read_instance(instance_path))
+
+        _loaded[key] = arrays
+        return arrays
@@ -0,0 +1,128 @@
+import os
+import shutil
+import signal
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Incremental cloning of the student repos, used by fetch.py and repos/clone_assignment_repos.py. Existing clones are
+# kept and updated with a shallow fetch of the remote HEAD followed by a hard reset, new repos are cloned shallowly.
+# Repos are synced concurrently in a bounded pool, every git command has a timeout and failed repos are retried.
+
+# Never wait for credentials on a terminal, a repo without access fails instead of blocking the nightly run
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT="0", GIT_SSH_COMMAND="ssh -o BatchMode=yes")
+
+
+def git(args, cwd=None, timeout=300):
+    """Run a git command and return its stdout, raises subprocess.CalledProcessError or TimeoutExpired."""
+    # In its own session, so ssh processes started by git are killed as well on a timeout
+    process = subprocess.Popen(['git'] + args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True, env=GIT_ENV, start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ['git'] + args, stdout, stderr)
+    return stdout.strip()
+
+
+def head(path):
+    try:
+        return git(['rev-parse', 'HEAD'], cwd=path, timeout=30)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+
+
+def is_clone(path):
+    return os.path.isdir(os.path.join(path, '.git'))
+
+
+def clone(repo_url, path, timeout=300):
+    # Cloned next to the target first, so an interrupted clone never leaves a broken repo at `path`
+    tmp_path = path.rstrip(os.sep) + '.tmp-clone'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        git(['clone', '--quiet', '--depth', '1', repo_url, tmp_path], timeout=timeout)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def update(path, repo_url=None, timeout=300):
+    # The remote HEAD (default branch) is fetched, local changes and untracked files (e.g., output of earlier runs)
+    # are discarded
+    git(['fetch', '--quiet', '--depth', '1', repo_url or 'origin', 'HEAD'], cwd=path, timeout=timeout)
+    git(['reset', '--quiet', '--hard', 'FETCH_HEAD'], cwd=path, timeout=timeout)
+    git(['clean', '--quiet', '-ffdx'], cwd=path, timeout=timeout)
+
+
+def sync_repo(repo_url, path, timeout=300, retries=2, backoff=5):
+    """Clone a repo or update an existing clone.
+
+    Returns a dict with the path, the status ("cloned", "updated", "unchanged" or "failed"), the HEAD commit before
+    and after and the error of the last attempt if it failed.
+    """
+    old_head = head(path) if is_clone(path) else None
+    result = {"path": path, "status": "failed", "old_head": old_head, "new_head": None, "error": None}
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            if is_clone(path):
+                update(path, repo_url, timeout)
+            else:
+                clone(repo_url, path, timeout)
+        except subprocess.TimeoutExpired as e:
+            result["error"] = f"timed out after {e.timeout} seconds"
+            continue
+        except subprocess.CalledProcessError as e:
+            result["error"] = ((e.stderr or "").strip() or str(e)).splitlines()[0]
+            continue
+
+        result["new_head"] = head(path)
+        if old_head is None:
+            result["status"] = "cloned"
+        else:
+            result["status"] = "updated" if result["new_head"] != old_head else "unchanged"
+        result["error"] = None
+        break
+
+    return result
+
+
+def sync_repos(repos, workers=8, timeout=300, retries=2):
+    """Sync (repo_url, path) pairs concurrently, a repo_url of None updates an existing clone from its origin."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda repo: sync_repo(repo[0], repo[1], timeout, retries), repos))
+
+
+def existing_clones(folder):
+    """(None, path) pairs for all clones directly below `folder` and one level deeper (assignment folders)."""
+    clones = []
+    if not os.path.isdir(folder):
+        return clones
+    for item in sorted(os.listdir(folder)):
+        path = os.path.join(folder, item)
+        if is_clone(path):
+            clones.append((None, path))
+        elif os.path.isdir(path):
+            clones.extend((None, os.path.join(path, repo)) for repo in sorted(os.listdir(path))
+                          if is_clone(os.path.join(path, repo)))
+    return clones
+
+
+def print_report(results):
+    changed = [result for result in results if result["status"] in ("cloned", "updated")]
+    failed = [result for result in results if result["status"] == "failed"]
+
+    print(f"Synced {len(results)} repositories: {len(changed)} changed, {len(failed)} failed.")
+    for result in changed:
+        print(f"  {result['status']}: {result['path']} ({result['old_head'] or '-'} -> {result['new_head']})")
+    for result in failed:
+        print(f"  failed: {result['path']}: {result['error']}")
+    return changed
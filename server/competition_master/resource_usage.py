@@ -0,0 +1,140 @@
+import os
+import resource
+import signal
+import threading
+
+# Resource accounting and limits for evaluation runs (Linux). CPU time and peak memory come from the rusage that
+# os.wait4 returns for the finished process (including the helper processes it waited for), the number of processes
+# and threads is sampled from /proc while the run is in progress.
+
+
+def set_limits(pid, max_memory_mb=None, max_cpu_seconds=None, cpu_seconds_used=0.0):
+    """Limit the address space and CPU time of a running process.
+
+    The CPU limit is on top of the `cpu_seconds_used` by the process so far, this way a persistent worker gets the
+    same budget for every instance. A process over its CPU limit gets SIGXCPU, one over its memory limit gets a
+    MemoryError on allocation.
+    """
+    try:
+        if max_memory_mb:
+            limit = int(max_memory_mb * 1024 * 1024)
+            resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        if max_cpu_seconds:
+            limit = int(cpu_seconds_used + max_cpu_seconds + 1)
+            resource.prlimit(pid, resource.RLIMIT_CPU, (limit, limit + 5))
+    except (ProcessLookupError, PermissionError, ValueError):
+        pass  # the process may already have exited
+
+
+def process_cpu_seconds(pid):
+    # utime + stime of a running process from /proc/<pid>/stat, in seconds
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def wait_with_rusage(process, timeout, on_timeout, stop_steps=()):
+    """Wait for a subprocess.Popen with os.wait4, so its resource usage can be reported.
+
+    Calls on_timeout() (which should kill the process) if it does not finish within `timeout` seconds. With
+    stop_steps, (function, grace seconds) pairs, the functions (e.g. sending a signal) are called first one after the
+    other, each followed by up to its grace period for the process to exit. Sets the returncode of the process and
+    returns (timed_out, rusage).
+    """
+    result = {}
+
+    def wait():
+        _, status, rusage = os.wait4(process.pid, 0)
+        result['status'], result['rusage'] = status, rusage
+
+    thread = threading.Thread(target=wait, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    timed_out = thread.is_alive()
+    if timed_out:
+        for stop, grace in stop_steps:
+            stop()
+            thread.join(grace)
+            if not thread.is_alive():
+                break
+        else:
+            on_timeout()
+        thread.join()
+
+    process.returncode = os.waitstatus_to_exitcode(result['status'])
+    return timed_out, result['rusage']
+
+
+def rusage_fields(rusage):
+    return {"User CPU (seconds)": f"{rusage.ru_utime:.2f}", "System CPU (seconds)": f"{rusage.ru_stime:.2f}",
+            "Peak RSS (MB)": f"{rusage.ru_maxrss / 1024:.1f}"}
+
+
+def limit_message(returncode):
+    # Explain the signals sent by the limits in set_limits
+    if returncode == -signal.SIGXCPU:
+        return "CPU time limit exceeded"
+    return None
+
+
+class ProcessTreeSampler:
+    """Samples the number of processes and threads of a process and its descendants in a background thread.
+
+    If max_processes is given and the process tree grows beyond it, on_limit() is called once.
+    """
+
+    def __init__(self, pid, interval=0.1, max_processes=None, on_limit=None):
+        self.pid = pid
+        self.interval = interval
+        self.max_processes = max_processes
+        self.on_limit = on_limit
+        self.peak_processes = 0
+        self.peak_threads = 0
+        self.limit_exceeded = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def sample(self):
+        processes, threads = 0, 0
+        pending = [self.pid]
+        while pending:
+            pid = pending.pop()
+            try:
+                tasks = os.listdir(f"/proc/{pid}/task")
+            except OSError:
+                continue
+            processes += 1
+            threads += len(tasks)
+            for task in tasks:
+                try:
+                    with open(f"/proc/{pid}/task/{task}/children") as file:
+                        pending.extend(int(child) for child in file.read().split())
+                except OSError:
+                    pass
+        return processes, threads
+
+    def _run(self):
+        while not self._stop.is_set():
+            processes, threads = self.sample()
+            self.peak_processes = max(self.peak_processes, processes)
+            self.peak_threads = max(self.peak_threads, threads)
+            if self.max_processes and processes > self.max_processes and not self.limit_exceeded:
+                self.limit_exceeded = True
+                if self.on_limit:
+                    self.on_limit()
+            self._stop.wait(self.interval)
+
+    def reset(self):
+        # Start a new measurement from the current state of the process tree
+        self.peak_processes, self.peak_threads = self.sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def fields(self):
+        return {"Max processes": self.peak_processes, "Max threads": self.peak_threads}
@@ -0,0 +1,146 @@
+import ast
+import collections
+import json
+
+# Result protocol between the evaluation harness and the student code. Only the standard library is used, since
+# worker.py imports this module as well.
+#
+# The harness passes an open file descriptor in the VRP_RESULT_FD environment variable. helper.emit_result writes one
+# JSON record per line to it:
+#     {"v": 1, "type": "result", "routes": [[1, 4, 154, 1], ...], "waiting": [[0, 0, 12.5, 0], ...]}
+# "routes" holds the node ids per route, "waiting" the waiting times in minutes and may be left out if they are all
+# zero. When the variable is not set (e.g., when running main.py locally) helper.emit_result prints the legacy
+# "RESULT: {...}" line instead, which the harness still accepts as a fallback.
+#
+# With profiling on (evaluate.py --profile sets VRP_PROFILE) helper.emit_result also writes a "profile" record with
+# the timers and counters of the run, {"v": 1, "type": "profile", "wall_seconds": ..., "timers": ..., "counters": ...},
+# or prints it as a "PROFILE: {...}" line without the channel.
+#
+# Solutions a solver finds on its way can be streamed with helper.emit_incumbent, as "incumbent" records (same fields
+# as "result") or "INCUMBENT: {...}" lines. They are only used for the anytime curve of the run (see curves.py), the
+# last "result" record (or the last RESULT line) is the solution that is evaluated.
+
+PROTOCOL_VERSION = 1
+# The environment variables of the protocol, the harness (evaluate.py, worker.py) takes all of them from here. helper.py
+# is handed out to the groups on its own and has its own copy of these names.
+RESULT_FD_ENV = "VRP_RESULT_FD"
+PROFILE_ENV = "VRP_PROFILE"
+PROFILE_DUMP_ENV = "VRP_PROFILE_DUMP"
+# Time-budgeted runs (evaluate.py --budgets) get the budget in seconds and its end as a time.time() value
+TIME_BUDGET_ENV = "VRP_TIME_BUDGET"
+DEADLINE_ENV = "VRP_DEADLINE"
+PROTOCOL_PREFIXES = ("RESULT:", "PROFILE:", "INCUMBENT:")
+# A solver may print a RESULT line for every new best solution, the last one is evaluated like the last result record
+LAST_LINE_PREFIXES = ("RESULT:",)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class OutputScanner:
+    """Consumes output line by line without buffering all of it.
+
+    Keeps the last RESULT line and the first line for every other protocol prefix, and a bounded tail of the other lines for error reports, so a
+    chatty program cannot make the harness run out of memory. `handlers` maps protocol prefixes to functions that are
+    called with every such line as it arrives. Can be used as a file object (write/flush), e.g., with
+    contextlib.redirect_stdout.
+    """
+
+    def __init__(self, prefixes=PROTOCOL_PREFIXES, tail_lines=20, max_line_length=1000, handlers=None):
+        self.prefixes = prefixes
+        self.handlers = handlers or {}
+        self.protocol_lines = {}
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.max_line_length = max_line_length
+        self._partial = ""
+
+    def feed(self, line):
+        line = line.rstrip('\n')
+        for prefix in self.prefixes:
+            if line.startswith(prefix):
+                if prefix in LAST_LINE_PREFIXES:
+                    self.protocol_lines[prefix] = line
+                else:
+                    self.protocol_lines.setdefault(prefix, line)
+                if prefix in self.handlers:
+                    self.handlers[prefix](line)
+                return
+        self.tail.append(line[:self.max_line_length])
+
+    def consume(self, stream):
+        for line in stream:
+            self.feed(line)
+
+    def write(self, text):
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.feed(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._partial:
+            self.feed(self._partial)
+            self._partial = ""
+
+    def tail_text(self):
+        return "\n".join(self.tail)
+
+
+def encode_record(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def parse_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ProtocolError(f"Malformed result record: {e}")
+    if not isinstance(record, dict) or record.get("v") != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported result record version: {record.get('v') if isinstance(record, dict) else None}")
+    return record
+
+
+def read_records(stream):
+    """Yield the records of a result channel, malformed lines are yielded as ProtocolError instances."""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield parse_record(line)
+        except ProtocolError as e:
+            yield e
+
+
+def parse_solution_line(line):
+    """The solution dict of a RESULT or INCUMBENT line."""
+    return ast.literal_eval(line.split(":", 1)[1].strip())
+
+
+def encode_solution(solution, record_type="result"):
+    """Convert a solution dict in the format of the RESULT line into a record, the inverse of decode_solution."""
+    routes = [[stop['node_id'] for stop in route] for route in solution['routes']]
+    waiting = [[stop.get('waiting_time', 0) for stop in route] for route in solution['routes']]
+    record = {"v": PROTOCOL_VERSION, "type": record_type, "routes": routes}
+    if any(waiting_time for route in waiting for waiting_time in route):
+        record["waiting"] = waiting
+    return record
+
+
+def decode_solution(record):
+    """Convert a result record into the solution dict format of the RESULT line."""
+    routes = record.get("routes")
+    waiting = record.get("waiting")
+    if not isinstance(routes, list) or not all(isinstance(route, list) for route in routes):
+        raise ProtocolError("Result record has no valid 'routes'")
+    if waiting is None:
+        waiting = [[0] * len(route) for route in routes]
+    if len(waiting) != len(routes) or any(len(w) != len(route) for w, route in zip(waiting, routes)):
+        raise ProtocolError("Result record 'waiting' does not match 'routes'")
+
+    return {'routes': [[{'node_id': node_id, 'waiting_time': waiting_time} for node_id, waiting_time in zip(route, w)]
+                       for route, w in zip(routes, waiting)]}
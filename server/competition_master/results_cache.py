@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+
+import instance_cache
+
+# Results of unchanged groups are reused between nightly runs. A result is stored per group and fingerprint of the
+# evaluation settings (one entry per time budget with --budgets) together with the fingerprint of the group's code,
+# and per instance under the hash of the instance file. It is reused only if all three still match.
+
+EVALUATOR_FILES = ("evaluate.py", "helper.py", "worker.py", "result_protocol.py", "curves.py", "resource_usage.py",
+                   "instance_cache.py")
+# Settings that do not change the outcome of a run
+IGNORED_OPTIONS = ("instance_cache_dir",)
+# Evaluation settings kept per group, the least recently stored ones are dropped
+MAX_CONFIGS_PER_GROUP = 8
+
+
+def folder_hash(folder):
+    # Content hash of all files in a folder, skipping caches and hidden files
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+        for name in sorted(files):
+            if name.startswith('.') or name.endswith('.pyc'):
+                continue
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, folder).encode() + b'\0')
+            digest.update(instance_cache.file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def group_fingerprint(group_folder_path):
+    """Fingerprint of the code in a group folder.
+
+    Uses the git tree hash of the folder at HEAD, so files written by the group's code while running do not count
+    as changes. Outside a git repository the content of the folder is hashed.
+    """
+    repo_path, group_name = os.path.split(os.path.abspath(group_folder_path))
+    try:
+        tree = subprocess.run(['git', 'rev-parse', f'HEAD:./{group_name}'], cwd=repo_path, capture_output=True,
+                              text=True, timeout=30, check=True).stdout.strip()
+        return f"git:{tree}"
+    except (OSError, subprocess.SubprocessError):
+        return f"sha256:{folder_hash(group_folder_path)}"
+
+
+def config_fingerprint(harness, options):
+    """Fingerprint of the evaluation settings and the evaluator code, a change in either invalidates all results."""
+    server_folder = os.path.dirname(os.path.abspath(__file__))
+    config = {"harness": harness, "options": {key: value for key, value in sorted(options.items()) if key not in IGNORED_OPTIONS},
+              "code": [instance_cache.file_hash(os.path.join(server_folder, name)) for name in EVALUATOR_FILES]}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def cacheable(result):
+    # A timeout may be caused by load on the server, those runs are repeated the next night
+    return "timed out after" not in str(result.get("Error", ""))
+
+
+class ResultsCache:
+    """Results per group, evaluation settings and instance, stored as JSON (results_cache.json in run_output)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.groups = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.groups = json.load(file)
+            except ValueError:
+                print(f"Warning: results cache {path} is corrupt, all groups will be evaluated")
+        # Caches written before the entries were kept per config have a single entry per group
+        for group_key, entry in self.groups.items():
+            if "fingerprint" in entry:
+                self.groups[group_key] = {entry["config"]: {"fingerprint": entry["fingerprint"], "results": entry["results"]}}
+
+    def lookup(self, group_key, fingerprint, config, instance_hash):
+        entry = self.groups.get(group_key, {}).get(config)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        return entry["results"].get(instance_hash)
+
+    def store(self, group_key, fingerprint, config, results):
+        """Add results of a group, `results` maps instance hashes to result rows. Results of older code are dropped."""
+        configs = self.groups.setdefault(group_key, {})
+        for other in [other for other, entry in configs.items() if entry["fingerprint"] != fingerprint]:
+            del configs[other]
+        entry = configs.pop(config, None) or {"fingerprint": fingerprint, "results": {}}
+        entry["results"].update({instance_hash: result for instance_hash, result in results.items() if cacheable(result)})
+        configs[config] = entry
+        while len(configs) > MAX_CONFIGS_PER_GROUP:
+            del configs[next(iter(configs))]
+
+    def save(self):
+        # Written to a temporary file first, so an interrupted run does not leave a truncated cache behind
+        folder = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=folder, delete=False, suffix='.tmp') as file:
+            json.dump(self.groups, file)
+        os.replace(file.name, self.path)
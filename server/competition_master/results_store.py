@@ -0,0 +1,302 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sqlite3
+from datetime import datetime
+
+# Results store: every evaluation run, the group results (the rows of central_results.csv), the result of every
+# group x instance and their errors in an indexed SQLite database (run_output/results.sqlite). The best result of
+# every group is kept in the `best` table, which is updated when a group result is added, so the leaderboard query
+# does not read the history. evaluate.py exports central_results.csv from the store after every group result (the rows
+# of a CSV written before the store are imported first), the scores are the ones evaluate.py computed, the store does
+# not recompute them. The per-group CSVs are still written by evaluate.py, the leaderboard reads those.
+
+CENTRAL_COLUMNS = ["Group", "Cumulative Profits", "Total Runtime (seconds)", "Overall Feasible", "Score", "Date Time",
+                   "Total CPU (seconds)", "Peak RSS (MB)"]
+
+# Instance result column -> (store column, type), see evaluate.RESULT_COLUMNS
+INSTANCE_COLUMNS = {
+    "Instance": ("instance", str),
+    "Runtime (seconds)": ("runtime", float),
+    "Feasible": ("feasible", bool),
+    "Profit": ("profit", float),
+    "Violations": ("violations", int),
+    "Algorithm runtime (seconds)": ("algorithm_runtime", float),
+    "Startup overhead (seconds)": ("startup_overhead", float),
+    "User CPU (seconds)": ("user_cpu", float),
+    "System CPU (seconds)": ("system_cpu", float),
+    "Peak RSS (MB)": ("peak_rss_mb", float),
+    "Max processes": ("max_processes", int),
+    "Max threads": ("max_threads", int),
+    "Profile": ("profile", str),
+    "Curve": ("curve", str),
+}
+# Columns added to instance_results after the first version of the schema, existing stores get them on open
+ADDED_INSTANCE_COLUMNS = {"profile": "TEXT", "curve": "TEXT"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    finished TEXT,
+    harness TEXT,
+    config TEXT,
+    options TEXT
+);
+CREATE TABLE IF NOT EXISTS group_results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    group_name TEXT NOT NULL,
+    repo TEXT,
+    date_time TEXT NOT NULL,
+    cumulative_profit REAL,
+    total_runtime REAL,
+    feasible INTEGER NOT NULL,
+    score REAL,
+    total_cpu REAL,
+    peak_rss_mb REAL
+);
+CREATE INDEX IF NOT EXISTS group_results_group ON group_results (group_name, date_time);
+CREATE INDEX IF NOT EXISTS group_results_run ON group_results (run_id);
+CREATE TABLE IF NOT EXISTS instance_results (
+    id INTEGER PRIMARY KEY,
+    group_result_id INTEGER NOT NULL REFERENCES group_results(id),
+    instance TEXT NOT NULL,
+    runtime REAL,
+    feasible INTEGER,
+    profit REAL,
+    violations INTEGER,
+    algorithm_runtime REAL,
+    startup_overhead REAL,
+    user_cpu REAL,
+    system_cpu REAL,
+    peak_rss_mb REAL,
+    max_processes INTEGER,
+    max_threads INTEGER,
+    reused INTEGER NOT NULL DEFAULT 0,
+    profile TEXT,
+    curve TEXT
+);
+CREATE INDEX IF NOT EXISTS instance_results_group_result ON instance_results (group_result_id);
+CREATE INDEX IF NOT EXISTS instance_results_instance ON instance_results (instance);
+CREATE TABLE IF NOT EXISTS errors (
+    id INTEGER PRIMARY KEY,
+    instance_result_id INTEGER NOT NULL REFERENCES instance_results(id),
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS errors_instance_result ON errors (instance_result_id);
+CREATE TABLE IF NOT EXISTS best (
+    group_name TEXT PRIMARY KEY,
+    group_result_id INTEGER NOT NULL REFERENCES group_results(id)
+);
+"""
+
+GROUP_RESULT_FIELDS = ("group_name", "repo", "date_time", "cumulative_profit", "total_runtime", "feasible", "score",
+                       "total_cpu", "peak_rss_mb")
+
+
+def number(value, kind=float):
+    # None for empty cells and "N/A", the CSV rows hold strings
+    if value is None or value == "" or value == "N/A":
+        return None
+    if kind is bool:
+        return int(value == "Yes" or value is True)
+    return kind(value)
+
+
+def format_number(value, digits):
+    return "" if value is None else f"{value:.{digits}f}"
+
+
+def rank_key(row):
+    """Leaderboard order of group results: feasible first, then the highest score, then the most recent."""
+    score = row["score"] if row["score"] is not None else -math.inf
+    return row["feasible"], score, row["date_time"]
+
+
+class ResultsStore:
+    """SQLite results store (results.sqlite in run_output), see the module comment.
+
+    Use it from a single thread (evaluate.py writes all results from the main thread).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        # WAL lets readers (e.g. an export while evaluate.py runs) work next to the writer
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(instance_results)")}
+            for name, kind in ADDED_INSTANCE_COLUMNS.items():
+                if name not in columns:
+                    self.connection.execute(f"ALTER TABLE instance_results ADD COLUMN {name} {kind}")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def start_run(self, harness=None, config=None, options=None):
+        """Record the start of an evaluation run, returns its id."""
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (started, harness, config, options) VALUES (?, ?, ?, ?)",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), harness, config,
+                 json.dumps(options, sort_keys=True, default=str) if options is not None else None))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET finished = ? WHERE id = ?",
+                                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id))
+
+    def add_group_result(self, run_id, central_row, instance_results=(), repo=None, reused=None):
+        """Store the result of a group and its instance results in one transaction, returns its id.
+
+        Args:
+            run_id: id of start_run
+            central_row: the row of central_results.csv, a dict with the CENTRAL_COLUMNS
+            instance_results: the rows of the per-group CSV, dicts with the evaluate.RESULT_COLUMNS
+            repo: path of the group folder relative to the repos folder
+            reused: per instance result, whether it was taken from the results cache
+        """
+        values = {
+            "group_name": central_row["Group"],
+            "repo": repo,
+            "date_time": central_row["Date Time"],
+            "cumulative_profit": number(central_row.get("Cumulative Profits")),
+            "total_runtime": number(central_row.get("Total Runtime (seconds)")),
+            "feasible": number(central_row.get("Overall Feasible"), bool),
+            "score": number(central_row.get("Score")),
+            "total_cpu": number(central_row.get("Total CPU (seconds)")),
+            "peak_rss_mb": number(central_row.get("Peak RSS (MB)")),
+        }
+        with self.connection:
+            cursor = self.connection.execute(
+                f"INSERT INTO group_results (run_id, {', '.join(GROUP_RESULT_FIELDS)}) "
+                f"VALUES (?, {', '.join('?' * len(GROUP_RESULT_FIELDS))})",
+                (run_id, *(values[field] for field in GROUP_RESULT_FIELDS)))
+            group_result_id = cursor.lastrowid
+            for i, result in enumerate(instance_results):
+                self.add_instance_result(group_result_id, result, bool(reused and reused[i]))
+            self.update_best(group_result_id, values)
+        return group_result_id
+
+    def add_instance_result(self, group_result_id, result, reused=False):
+        columns = ["group_result_id", "reused"]
+        row = [group_result_id, int(reused)]
+        for column, (name, kind) in INSTANCE_COLUMNS.items():
+            columns.append(name)
+            row.append(result.get(column) if kind is str else number(result.get(column), kind))
+        cursor = self.connection.execute(
+            f"INSERT INTO instance_results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", row)
+        error = str(result.get("Error") or "")
+        if error and error != "[]":
+            self.connection.execute("INSERT INTO errors (instance_result_id, message) VALUES (?, ?)",
+                                    (cursor.lastrowid, error))
+
+    def update_best(self, group_result_id, values):
+        # Incremental best per group: only the new result is compared with the current best
+        current = self.connection.execute(
+            "SELECT g.feasible, g.score, g.date_time FROM best b JOIN group_results g ON g.id = b.group_result_id "
+            "WHERE b.group_name = ?", (values["group_name"],)).fetchone()
+        if current is None or rank_key(values) >= rank_key(current):
+            self.connection.execute("INSERT OR REPLACE INTO best (group_name, group_result_id) VALUES (?, ?)",
+                                    (values["group_name"], group_result_id))
+
+    def best_results(self):
+        """The best result of every group (dicts with the group_results columns), in leaderboard order."""
+        rows = [dict(row) for row in self.connection.execute(
+            "SELECT g.* FROM best b JOIN group_results g ON g.id = b.group_result_id")]
+        return sorted(rows, key=rank_key, reverse=True)
+
+    def group_history(self, group_name):
+        """All results of a group, oldest first."""
+        return [dict(row) for row in self.connection.execute(
+            "SELECT * FROM group_results WHERE group_name = ? ORDER BY date_time, id", (group_name,))]
+
+    def instance_results(self, group_result_id):
+        """The instance results of a group result, with their error messages."""
+        return [dict(row) for row in self.connection.execute(
+            "SELECT r.*, group_concat(e.message, '; ') AS error FROM instance_results r "
+            "LEFT JOIN errors e ON e.instance_result_id = r.id WHERE r.group_result_id = ? GROUP BY r.id ORDER BY r.id",
+            (group_result_id,))]
+
+    def export_central_csv(self, path, best_only=False):
+        """Write central_results.csv (the CENTRAL_COLUMNS, one row per group result in the order they were added)."""
+        rows = self.best_results() if best_only else [dict(row) for row in self.connection.execute(
+            "SELECT * FROM group_results ORDER BY id")]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, mode='w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CENTRAL_COLUMNS)
+            for row in rows:
+                writer.writerow(central_row(row))
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    def import_central_csv(self, path):
+        """Add the rows of an existing central_results.csv as one run (harness 'import'), returns the number of rows."""
+        with open(path, newline='') as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        run_id = self.start_run(harness="import", options={"path": os.path.abspath(path)})
+        for row in rows:
+            self.add_group_result(run_id, row)
+        self.finish_run(run_id)
+        return len(rows)
+
+    def import_missing_central_rows(self, path):
+        """Import the rows of a central_results.csv that are not in the store yet (by group and date), returns their number.
+
+        The central CSV is exported from the store, so only the rows of a CSV written before the store are imported.
+        """
+        with open(path, newline='') as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        known = {(row["group_name"], row["date_time"]) for row in self.connection.execute(
+            "SELECT group_name, date_time FROM group_results")}
+        missing = [row for row in rows if (row.get("Group"), row.get("Date Time")) not in known]
+        if missing:
+            run_id = self.start_run(harness="import", options={"path": os.path.abspath(path)})
+            for row in missing:
+                self.add_group_result(run_id, row)
+            self.finish_run(run_id)
+        return len(missing)
+
+
+def central_row(row):
+    # A group_results row as the cells of central_results.csv, formatted like evaluate.write_group_results
+    return [row["group_name"], format_number(row["cumulative_profit"], 2), format_number(row["total_runtime"], 2),
+            "Yes" if row["feasible"] else "No", "N/A" if row["score"] is None else row["score"], row["date_time"],
+            format_number(row["total_cpu"], 2), format_number(row["peak_rss_mb"], 1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query, import and export the SQLite results store of evaluate.py.")
+    parser.add_argument("--store", default='home_path/repos/run_output/results.sqlite', type=str, help="Path of results.sqlite")
+    parser.add_argument("--import_csv", default=None, type=str, help="Add the rows of an existing central_results.csv")
+    parser.add_argument("--export_csv", default=None, type=str, help="Write all group results as central_results.csv")
+    parser.add_argument("--best_only", action="store_true", help="Export only the best result of every group")
+    parser.add_argument("--group", default=None, type=str, help="Print the history of this group")
+    args = parser.parse_args()
+
+    with ResultsStore(args.store) as store:
+        if args.import_csv:
+            print(f"Imported {store.import_central_csv(args.import_csv)} rows from {args.import_csv}")
+        if args.export_csv:
+            print(f"Exported {store.export_central_csv(args.export_csv, args.best_only)} rows to {args.export_csv}")
+        if args.group:
+            for row in store.group_history(args.group):
+                print(*central_row(row), sep=" | ")
+        elif not args.import_csv and not args.export_csv:
+            for rank, row in enumerate(store.best_results(), 1):
+                print(rank, *central_row(row), sep=" | ")
@@ -0,0 +1,142 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import resource
+import sys
+import time
+import traceback
+
+import result_protocol
+
+# Persistent evaluation worker, started by evaluate.py (--harness persistent) inside a group folder. It imports the
+# group's main module once and then runs main() for every instance path it receives on stdin, so interpreter startup
+# and library imports are paid once per group instead of once per instance.
+#
+# Protocol: one JSON object per line. evaluate.py sends {"instance": path}, the worker answers on the reply fd with
+# {"ready": ..., "import_time": ...} once after importing, and with the RESULT line, a tail of stdout, the algorithm
+# runtime, the resource usage and the error (if any) for every instance. Solutions written to the result channel by helper.emit_result go
+# straight to evaluate.py, the worker closes every instance with an "end" record on that channel. Only the standard
+# library is used here, the group's own helper.py is imported by its main.py. With VRP_PROFILE set the profiler of that
+# helper is reset before every instance and its summary written to the channel before the "end" record. INCUMBENT
+# lines on stdout are passed on to the channel as "incumbent" records as they are printed. A request may carry a
+# "time_budget" and "deadline", which main() gets in the environment like in a fresh process (see result_protocol.py).
+
+
+def run_main(student, instance_path):
+    # Mirrors the __main__ block of the starter main.py: read the instance, then call main(instance)
+    sys.argv = ['main.py', '--instance_path', instance_path]
+    read_instance = getattr(getattr(student, 'helper', None), 'read_instance', None)
+    if read_instance is None:
+        with open(instance_path, 'r') as file:
+            instance = file.readlines()
+    else:
+        instance = read_instance(instance_path)
+    student.main(instance)
+
+
+def forward_incumbent(line):
+    # The subprocess harness reads INCUMBENT lines as they are printed, here they only reach evaluate.py via the channel
+    channel_fd = os.environ.get(result_protocol.RESULT_FD_ENV)
+    try:
+        record = result_protocol.encode_solution(result_protocol.parse_solution_line(line), "incumbent")
+    except (ValueError, SyntaxError, TypeError, KeyError, AttributeError):
+        return
+    if channel_fd is not None:
+        os.write(int(channel_fd), result_protocol.encode_record(record).encode())
+
+
+def reset_peak_rss():
+    # Resets VmHWM of this process (Linux 4.0+), so the peak memory is measured per instance
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_times():
+    # User and system CPU time of this process and the child processes it waited for
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime, children.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent evaluation worker.")
+    parser.add_argument("--reply_fd", type=int, required=True, help="File descriptor to write replies to")
+    args = parser.parse_args()
+
+    replies = os.fdopen(args.reply_fd, 'w', buffering=1)
+
+    def reply(message):
+        replies.write(json.dumps(message) + '\n')
+
+    # Import the group's code instead of the server files next to this script
+    sys.path[0] = os.getcwd()
+
+    start_time = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            student = importlib.import_module('main')
+    except BaseException:
+        reply({"ready": False, "error": traceback.format_exc()})
+        return
+    reply({"ready": True, "import_time": time.perf_counter() - start_time})
+
+    profiler = getattr(getattr(student, 'helper', None), 'profiler', None)
+    for line in sys.stdin:
+        request = json.loads(line)
+        stdout, error = result_protocol.OutputScanner(handlers={"INCUMBENT:": forward_incumbent}), None
+        if profiler is not None:
+            profiler.reset()
+        for name, key in ((result_protocol.TIME_BUDGET_ENV, "time_budget"), (result_protocol.DEADLINE_ENV, "deadline")):
+            if request.get(key) is not None:
+                os.environ[name] = str(request[key])
+            else:
+                os.environ.pop(name, None)
+
+        reset_peak_rss()
+        start_cpu = cpu_times()
+        start_time = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                run_main(student, request['instance'])
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = f"SystemExit: {e.code}"
+        except BaseException:
+            error = traceback.format_exc()
+        algorithm_runtime = time.perf_counter() - start_time
+        end_cpu = cpu_times()
+        if profiler is not None and profiler.enabled and not profiler.emitted:
+            with contextlib.redirect_stdout(stdout):
+                profiler.emit()
+        stdout.close()
+
+        # Child processes only count towards the peak memory if they reached a new maximum during this instance
+        peak_rss = max(peak_rss_mb(), end_cpu[2] if end_cpu[2] > start_cpu[2] else 0)
+        usage = {"User CPU (seconds)": f"{end_cpu[0] - start_cpu[0]:.2f}",
+                 "System CPU (seconds)": f"{end_cpu[1] - start_cpu[1]:.2f}", "Peak RSS (MB)": f"{peak_rss:.1f}"}
+
+        channel_fd = os.environ.get(result_protocol.RESULT_FD_ENV)
+        if channel_fd is not None:
+            os.write(int(channel_fd), result_protocol.encode_record({"v": result_protocol.PROTOCOL_VERSION, "type": "end"}).encode())
+        reply({"protocol_lines": stdout.protocol_lines, "stdout_tail": list(stdout.tail),
+               "algorithm_runtime": algorithm_runtime, "usage": usage, "error": error})
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,42 @@
 import pandas as pd
 import os
-import subprocess
-
-import shutil
-
-def delete_folder_contents(folder_path):
-    # Check if the specified path is an existing directory
-    if not os.path.isdir(folder_path):
-        print(f"The path {folder_path} does not exist or is not a directory.")
-        return
-    
-    # Loop through each item in the folder
-    for item_name in os.listdir(folder_path):
-        # Create the full path to the item
-        item_path = os.path.join(folder_path, item_name)
-        
-        # Check if this item is a file or a directory
-        if os.path.isfile(item_path) or os.path.islink(item_path):
-            # If it's a file or a symlink, delete it
-            os.remove(item_path)
-        elif os.path.isdir(item_path):
-            # If it's a directory, delete it and all its contents
-            shutil.rmtree(item_path)
-    
-    print(f"All contents of the folder {folder_path} have been deleted.")
-
-# Save CSV data to a file (for this example, we'll directly read it from a string)
-csv_file_path = 'home_path/repos/github_classroom_id.csv'
-
-# Load the CSV data into a pandas DataFrame
-df = pd.read_csv(csv_file_path)
-
-# Create a folder where all repositories will be cloned
-clone_folder = 'home_path/repos/assignment_folder/'
-
-delete_folder_contents(clone_folder)
-
-os.makedirs(clone_folder, exist_ok=True)
-
-# Iterate through the DataFrame and clone each repository
-for index, row in df.iterrows():
-    # Original HTTPS URL from the CSV
-    https_repo_url = row['student_repository_url']
-    
+import sys
+import argparse
+
+# The git logic is shared with fetch.py and lives next to it in competition_master
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'competition_master'))
+import repo_sync
+
+
+def ssh_url(https_repo_url):
     # Convert HTTPS URL to SSH URL
-    repo_url = https_repo_url.replace("https://github.com/", "git@github.com:")
-    
-    clone_path = os.path.join(clone_folder, row['student_repository_name'])
-    #if not os.path.exists(clone_path):
-    print(f"Cloning repository: {repo_url}")
-    subprocess.run(['git', 'clone', repo_url, clone_path])
-    #else:
-     #   print(f"Repository already cloned: {repo_url}")
+    return https_repo_url.replace("https://github.com/", "git@github.com:")
+
+
+def read_gradelist(csv_file_path):
+    # The gradelist.csv downloaded from GitHub classroom, with one row per student repository
+    df = pd.read_csv(csv_file_path)
+    return [(ssh_url(row['student_repository_url']), row['student_repository_name']) for _, row in df.iterrows()]
+
+
+def clone_assignment_repos(csv_file_path, clone_folder, workers=8, timeout=300, retries=2):
+    """Clone the repos of the gradelist into clone_folder, existing clones are updated instead of cloned again."""
+    os.makedirs(clone_folder, exist_ok=True)
+
+    repos = [(repo_url, os.path.join(clone_folder, name)) for repo_url, name in read_gradelist(csv_file_path)]
+    print(f"Syncing {len(repos)} repositories into {clone_folder}")
+    results = repo_sync.sync_repos(repos, workers, timeout, retries)
+    return repo_sync.print_report(results)
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clone or update the student repos listed in a GitHub classroom gradelist.")
+    parser.add_argument("--csv_file_path", default='home_path/repos/github_classroom_id.csv', type=str, help="The gradelist CSV of the assignment")
+    parser.add_argument("--clone_folder", default='home_path/repos/assignment_folder/', type=str, help="Folder to clone the repositories into")
+    parser.add_argument("--workers", default=8, type=int, help="Number of repositories to sync concurrently")
+    parser.add_argument("--timeout", default=300, type=float, help="Time limit in seconds per git command")
+    parser.add_argument("--retries", default=2, type=int, help="Number of retries for a repository that fails")
+    args = parser.parse_args()
 
-print("Cloning complete.")
+    clone_assignment_repos(args.csv_file_path, args.clone_folder, args.workers, args.timeout, args.retries)
+    print("Cloning complete.")
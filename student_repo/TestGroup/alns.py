@@ -0,0 +1,399 @@
+import argparse
+import math
+import random
+import signal
+import time
+
+import numpy as np
+
+import helper
+from route_evaluator import RouteEvaluator
+
+
+# Reference adaptive large neighbourhood search (ALNS). Every iteration removes some pickup and delivery pairs from
+# the current solution (destroy) and inserts them again (repair), the operators are picked with adaptive weights that
+# reward operators that found improvements. New solutions are accepted with simulated annealing. The search starts
+# from helper.regret_insertion and stops at a hard wall-clock deadline, the best solution found is always kept and
+# written to the result channel whenever it improves, so the harness has a solution even if the run is stopped.
+#
+# Usage from main.py:
+#     import alns
+#     solution = alns.solve(instance_dict, time_limit=60)
+#     helper.emit_result(solution)
+#
+# In a time-budgeted round use the budget of the harness instead, time_limit=helper.time_budget(default=60).
+
+# Scores of an operator for a new best solution, an improvement of the current solution and an accepted worse one
+SCORE_BEST, SCORE_BETTER, SCORE_ACCEPTED = 33, 9, 13
+
+
+class ALNS:
+    """Adaptive large neighbourhood search for the pickup and delivery problem of the competition.
+
+    Args:
+        instance: parsed instance dict (or its arrays, see helper.build_instance_arrays)
+        time_limit: wall-clock budget in seconds, counted from the creation of the object
+        seed: random seed
+        solution: initial solution, helper.regret_insertion by default
+        neighbours: size of the nearest neighbour lists that restrict the insertion positions
+        segment: number of iterations after which the operator weights are updated
+        reaction: how fast the weights follow the operator scores (0..1)
+        emit_interval: minimum number of seconds between two best solutions written to the result channel (or printed
+            as RESULT lines without one), None to not emit them (islands.py emits for its islands)
+    """
+
+    def __init__(self, instance, time_limit=60, seed=None, solution=None, neighbours=10, segment=100, reaction=0.1,
+                 emit_interval=5.0):
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + time_limit
+        self.rng = random.Random(seed)
+        self.segment = segment
+        self.reaction = reaction
+        self.emit_interval = emit_interval
+        self.stopped = False
+
+        self.arrays = helper.get_instance_arrays(instance)
+        self.n = self.arrays['number_of_customers']
+        self.number_of_trucks = self.arrays['number_of_trucks']
+        node_type = self.arrays['node_type']
+        distance = self.arrays['distance']
+        depots = np.flatnonzero(node_type == helper.NODE_DEPOT)
+        self.pickups = [int(p) for p in np.flatnonzero(node_type == helper.NODE_PICKUP)]
+        self.pickup_set = set(self.pickups)
+        self.nearest_depot = depots[np.argmin(distance[depots], axis=0)].tolist()
+        self.nn = helper.nearest_neighbours(self.arrays, neighbours)
+        self.distance = distance
+
+        # The profit of a pair in a route of its own does not change, it is the alternative to an existing route
+        self.new_route_profit = dict(zip(self.pickups, helper.total_profit_batch(
+            [{'routes': [[{'node_id': node_id, 'waiting_time': 0} for node_id in
+                          (self.nearest_depot[p], p, p + self.n, self.nearest_depot[p + self.n])]]}
+             for p in self.pickups], self.arrays)))
+
+        self.best_profit, self.best_solution = -math.inf, None
+        self.trace = []  # (wall-clock time, best profit) for every new best solution
+        self.set_solution(helper.regret_insertion(self.arrays) if solution is None else solution)
+        self.last_emit = 0.0
+
+        self.destroy_operators = [self.random_removal, self.worst_removal, self.related_removal, self.route_removal]
+        self.repair_operators = [self.greedy_repair, self.regret2_repair, self.regret3_repair]
+        self.weights = {operator: 1.0 for operator in self.destroy_operators + self.repair_operators}
+        self.scores = {operator: 0.0 for operator in self.weights}
+        self.uses = {operator: 0 for operator in self.weights}
+        self.iterations = 0
+
+    def set_solution(self, solution):
+        """Continue the search from `solution`, e.g., a solution received from another search."""
+        self.evaluator = RouteEvaluator(solution, self.arrays)
+        self.route_of = {}
+        for r, state in enumerate(self.evaluator.routes):
+            for node_id in state.nodes[1:-1]:
+                self.route_of[node_id] = r
+        self.unserved = {p for p in self.pickups if p not in self.route_of}
+
+        self.current_profit = self.evaluator.profit()
+        if self.current_profit > self.best_profit:
+            self.best_profit = self.current_profit
+            self.best_solution = self.evaluator.to_compact()
+            self.trace.append((time.time(), self.best_profit))
+
+    # Bookkeeping of the routes changed in an iteration, so a rejected solution can be restored
+
+    def _touch(self, r):
+        if r not in self._saved:
+            state = self.evaluator.routes[r]
+            self._saved[r] = (state.nodes[:], state.waits[:])
+
+    def _restore(self):
+        for r in self._saved:
+            for node_id in self.evaluator.routes[r].nodes[1:-1]:
+                del self.route_of[node_id]
+        for r, (nodes, waits) in self._saved.items():
+            self.evaluator.set_route(r, nodes, waits)
+            for node_id in nodes[1:-1]:
+                self.route_of[node_id] = r
+
+    def served_pairs(self):
+        return [p for p in self.pickups if p in self.route_of]
+
+    def used_routes(self):
+        return sum(1 for state in self.evaluator.routes if len(state.nodes) > 2)
+
+    def remove(self, p):
+        r = self.route_of[p]
+        self._touch(r)
+        nodes = self.evaluator.routes[r].nodes
+        self.evaluator.remove_pair(r, nodes.index(p), nodes.index(p + self.n))
+        if len(nodes) == 2:
+            # An empty route is dropped from the solution, it should not cost anything here either
+            self.evaluator.set_route(r, nodes[:1] * 2)
+        del self.route_of[p], self.route_of[p + self.n]
+        self.unserved.add(p)
+
+    def removal_count(self):
+        served = len(self.route_of) // 2
+        return self.rng.randint(min(4, served), max(min(4, served), min(40, int(0.3 * served))))
+
+    # Destroy operators, they return the removed pickups
+
+    def random_removal(self, q):
+        removed = self.rng.sample(self.served_pairs(), q)
+        for p in removed:
+            self.remove(p)
+        return removed
+
+    def worst_removal(self, q):
+        # Pairs whose removal costs the least profit (or gains the most), ranked once and picked with some randomness
+        served = self.served_pairs()
+        gains = []
+        for p in served:
+            r = self.route_of[p]
+            nodes = self.evaluator.routes[r].nodes
+            gains.append(self.evaluator.remove_pair_delta(r, nodes.index(p), nodes.index(p + self.n)))
+        order = [served[i] for i in sorted(range(len(served)), key=lambda i: -gains[i])]
+        removed = []
+        while len(removed) < q:
+            p = order.pop(int(self.rng.random() ** 3 * len(order)))
+            self.remove(p)
+            removed.append(p)
+        return removed
+
+    def related_removal(self, q):
+        # Pairs close to a random pair (Shaw removal): pickups close to its pickup and deliveries close to its delivery
+        served = self.served_pairs()
+        seed = self.rng.choice(served)
+        pickups = np.array(served)
+        relatedness = self.distance[seed, pickups] + self.distance[seed + self.n, pickups + self.n]
+        order = pickups[np.argsort(relatedness, kind='stable')].tolist()
+        removed = []
+        while len(removed) < q:
+            p = order.pop(int(self.rng.random() ** 4 * len(order)))
+            self.remove(p)
+            removed.append(p)
+        return removed
+
+    def route_removal(self, q):
+        # Empties the smallest routes, so their pairs can be merged into other routes
+        routes = sorted((len(state.nodes), r) for r, state in enumerate(self.evaluator.routes) if len(state.nodes) > 2)
+        removed = []
+        for _, r in routes:
+            if len(removed) >= q:
+                break
+            pickups = [node_id for node_id in self.evaluator.routes[r].nodes[1:-1] if node_id in self.pickup_set]
+            for p in pickups:
+                self.remove(p)
+            removed.extend(pickups)
+        return removed
+
+    # Repair operators
+
+    def best_insertions(self, p):
+        # Best (delta, i, j) per route, trying the positions next to the nearest neighbours of the pickup and delivery
+        d = p + self.n
+        pickup_positions, delivery_positions = {}, {}
+        for node_id, positions in ((p, pickup_positions), (d, delivery_positions)):
+            for neighbour in self.nn[node_id]:
+                r = self.route_of.get(neighbour)
+                if r is not None:
+                    position = self.evaluator.routes[r].nodes.index(neighbour)
+                    positions.setdefault(r, set()).update((position, position + 1))
+
+        best = {}
+        for r, positions in pickup_positions.items():
+            for i in positions:
+                for j in {i} | {j for j in delivery_positions.get(r, ()) if j >= i}:
+                    if not self.evaluator.insert_pair_capacity_ok(r, i, j, p):
+                        continue
+                    delta = self.evaluator.insert_pair_delta(r, i, j, p, d)
+                    if r not in best or delta > best[r][0]:
+                        best[r] = (delta, i, j)
+        return best
+
+    def insert(self, p, option):
+        d = p + self.n
+        if option is None:
+            # A new route, an empty route is reused if there is one
+            r = next((r for r, state in enumerate(self.evaluator.routes) if len(state.nodes) <= 2), None)
+            if r is None:
+                r = self.evaluator.add_route(self.nearest_depot[p])
+                self._saved[r] = ([self.nearest_depot[p]] * 2, [0, 0])
+            self._touch(r)
+            self.evaluator.set_route(r, [self.nearest_depot[p], p, d, self.nearest_depot[d]])
+        else:
+            r, i, j = option
+            self._touch(r)
+            self.evaluator.insert_pair(r, i, j, p, d)
+        for node_id in self.evaluator.routes[r].nodes[1:-1]:
+            self.route_of[node_id] = r
+        self.unserved.discard(p)
+        return r
+
+    def regret_repair(self, pairs, k):
+        """Insert pairs in order of their regret over the k best routes, k=1 is greedy insertion."""
+        pairs = set(pairs)
+        options = {p: self.best_insertions(p) for p in pairs}
+        while pairs:
+            trucks_left = self.used_routes() < self.number_of_trucks
+            best_key, best_p, best_option = None, None, None
+            for p in pairs:
+                values = sorted([(option[0], (r,) + option[1:]) for r, option in options[p].items()],
+                                key=lambda value: -value[0])
+                if trucks_left:
+                    values.append((self.new_route_profit[p], None))
+                    values.sort(key=lambda value: -value[0])
+                if not values or values[0][0] <= 0:
+                    continue
+                # Leaving a pair out has a profit of 0
+                regret = sum(values[0][0] - (values[h][0] if h < len(values) else 0.0) for h in range(1, k))
+                key = (regret, values[0][0] + self.rng.random() * 1e-6)
+                if best_key is None or key > best_key:
+                    best_key, best_p, best_option = key, p, values[0][1]
+            if best_p is None:
+                break
+
+            r = self.insert(best_p, best_option)
+            pairs.discard(best_p)
+            d = best_p + self.n
+            for q in pairs:
+                if r in options[q] or best_p in self.nn[q] or d in self.nn[q] or best_p in self.nn[q + self.n] or d in self.nn[q + self.n]:
+                    options[q] = self.best_insertions(q)
+
+    def greedy_repair(self, pairs):
+        self.regret_repair(pairs, 1)
+
+    def regret2_repair(self, pairs):
+        self.regret_repair(pairs, 2)
+
+    def regret3_repair(self, pairs):
+        self.regret_repair(pairs, 3)
+
+    # Search
+
+    def select(self, operators):
+        return self.rng.choices(operators, weights=[self.weights[operator] for operator in operators])[0]
+
+    def update_weights(self):
+        for operator in self.weights:
+            if self.uses[operator]:
+                self.weights[operator] = (1 - self.reaction) * self.weights[operator] + \
+                    self.reaction * self.scores[operator] / self.uses[operator]
+            self.weights[operator] = max(self.weights[operator], 0.05)
+            self.scores[operator], self.uses[operator] = 0.0, 0
+
+    def temperature(self, start_temperature):
+        # Geometric cooling over the time budget, down to a thousandth of the start temperature
+        fraction = min(1.0, (time.perf_counter() - self.start_time) / max(self.deadline - self.start_time, 1e-9))
+        return start_temperature * 0.001 ** fraction
+
+    def emit_best(self, force=False):
+        # The best solution so far, the harness evaluates the last one if the run is stopped. The final solution is
+        # emitted by the caller
+        if self.emit_interval is None:
+            return
+        now = time.perf_counter()
+        if force or now - self.last_emit >= self.emit_interval:
+            solution = self.result()
+            if not helper.write_record(helper.solution_to_record(solution, 'result')):
+                print("RESULT:", solution, flush=True)
+            self.last_emit = now
+
+    def result(self):
+        """The best solution dict, with optimal waiting times (the search itself does not wait)."""
+        return helper.optimize_waiting_times(self.best_solution, self.arrays)
+
+    def stop(self, *_):
+        self.stopped = True
+
+    def run(self, until=None):
+        """Search until the deadline (or until stop() is called) and return the best solution.
+
+        With `until` (a time.perf_counter() value) the search pauses earlier, run can be called again to continue.
+        """
+        # A solution 1% worse than the start is accepted with probability 0.5 at the start temperature
+        start_temperature = max(abs(self.best_profit), 1.0) * 0.01 / math.log(2)
+        until = self.deadline if until is None else min(until, self.deadline)
+
+        while not self.stopped and time.perf_counter() < until and self.pickups:
+            self.iterations += 1
+            self._saved = {}
+            unserved = set(self.unserved)
+
+            destroy, repair = self.select(self.destroy_operators), self.select(self.repair_operators)
+            q = self.removal_count()
+            with helper.profiler.timer(destroy.__name__):
+                if q == 0:
+                    removed = []
+                else:
+                    removed = destroy(q)
+            with helper.profiler.timer(repair.__name__):
+                repair(set(removed) | self.unserved)
+            profit = self.evaluator.profit()
+            helper.profiler.count('moves_evaluated')
+
+            temperature = self.temperature(start_temperature)
+            delta = profit - self.current_profit
+            if delta > 1e-9:
+                score = SCORE_BETTER
+            elif self.rng.random() < math.exp(delta / temperature):
+                score = SCORE_ACCEPTED
+            else:
+                score = 0
+
+            if score:
+                helper.profiler.count('moves_accepted')
+                self.current_profit = profit
+                if profit > self.best_profit + 1e-9:
+                    helper.profiler.count('new_best')
+                    score = SCORE_BEST
+                    self.best_profit = profit
+                    self.best_solution = self.evaluator.to_compact()
+                    self.trace.append((time.time(), profit))
+                    self.emit_best()
+            else:
+                self._restore()
+                self.unserved = unserved
+
+            for operator in (destroy, repair):
+                self.scores[operator] += score
+                self.uses[operator] += 1
+            if self.iterations % self.segment == 0:
+                self.update_weights()
+
+        self.emit_best(force=True)
+        return self.result()
+
+
+def solve(instance, time_limit=60, seed=None, solution=None, verbose=False, **kwargs):
+    """Run the ALNS for `time_limit` seconds and return the best solution, stops early on helper.STOP_SIGNALS."""
+    search = ALNS(instance, time_limit, seed, solution, **kwargs)
+    try:
+        previous_handlers = {signum: signal.signal(signum, search.stop) for signum in helper.STOP_SIGNALS}
+    except ValueError:
+        previous_handlers = {}  # not in the main thread
+    try:
+        with helper.profiler.timer('alns'):
+            best = search.run()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    if verbose:
+        print(f"ALNS: {search.iterations} iterations in {time.perf_counter() - search.start_time:.1f}s, "
+              f"best profit {search.best_profit:.2f}")
+        for operator, weight in search.weights.items():
+            print(f"  {operator.__name__}: weight {weight:.2f}")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reference ALNS solver.")
+    parser.add_argument("--instance_path", type=str, required=True, help="Path to the instance file")
+    parser.add_argument("--time_limit", default=60, type=float, help="Wall-clock budget in seconds")
+    parser.add_argument("--seed", default=None, type=int, help="Random seed")
+    args = parser.parse_args()
+
+    instance_dict = helper.parse_instance(helper.read_instance(args.instance_path))
+    solution = solve(instance_dict, args.time_limit, args.seed, verbose=True)
+    helper.check_solution_feasibility(solution, instance_dict)
+    print("Profit:", helper.total_profit_with_penalties(solution, instance_dict))
+    helper.emit_result(solution)
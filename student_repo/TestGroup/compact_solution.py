@@ -0,0 +1,234 @@
+from array import array
+
+import numpy as np
+
+
+# Compact solution representation for metaheuristics. A solution dict stores every visit as a
+# {"node_id": .., "waiting_time": ..} dict (a few hundred bytes per visit), a Route stores the node ids in an int32
+# array and the waiting times in a float64 array (12 bytes per visit). Cloning a Solution is copy-on-write: the clone
+# shares the routes with the original, and a route is only copied when one of the two changes it. The helper.py
+# functions (feasibility checks, profits, emit_result) accept a Solution wherever they accept a solution dict.
+#
+# Usage:
+#     solution = Solution.from_dict(helper_solution_dict)
+#     candidate = solution.clone()
+#     r, position = candidate.locate(node_id)
+#     candidate.remove(r, position)
+#     helper.total_profit_fast(candidate, instance_dict)
+#     helper.emit_result(candidate)
+
+
+def _waiting_time(value):
+    # Integral waiting times are ints, like in the solution dicts of the result channel (see helper.solution_to_record)
+    return int(value) if value.is_integer() else value
+
+
+class Route:
+    """One route: node ids (int32) and waiting times in minutes (float64), the depots included."""
+
+    __slots__ = ('nodes', 'waiting')
+
+    def __init__(self, nodes=(), waiting=None):
+        self.nodes = array('i', nodes)
+        self.waiting = array('d', [0.0] * len(self.nodes) if waiting is None else waiting)
+        if len(self.waiting) != len(self.nodes):
+            raise ValueError("A route needs one waiting time per node")
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __eq__(self, other):
+        return isinstance(other, Route) and self.nodes == other.nodes and self.waiting == other.waiting
+
+    def __repr__(self):
+        return f"Route({self.nodes.tolist()}, {self.waiting.tolist()})"
+
+    def copy(self):
+        route = Route.__new__(Route)
+        route.nodes, route.waiting = self.nodes[:], self.waiting[:]
+        return route
+
+    def to_list(self):
+        """The route as a list of visit dicts, like in a solution dict."""
+        return [{'node_id': node_id, 'waiting_time': _waiting_time(waiting_time)}
+                for node_id, waiting_time in zip(self.nodes, self.waiting)]
+
+
+class Solution:
+    """A list of Routes with copy-on-write cloning and an O(1) node id -> (route, position) index.
+
+    Read routes with solution[r] (or by iterating), but only change them with the methods of the Solution, those keep
+    the index up to date and copy shared routes first. The index covers the nodes between the depots of every route,
+    insert and remove are meant for those nodes too, use set_route to change the depots of a route.
+
+    Args:
+        routes: Routes (they are not copied)
+    """
+
+    __slots__ = ('_routes', '_shared', '_route_of', '_position_of', '_index_shared')
+
+    def __init__(self, routes=()):
+        self._routes = list(routes)
+        self._shared = [False] * len(self._routes)
+        self._route_of, self._position_of = array('i'), array('i')
+        self._index_shared = False
+        for r in range(len(self._routes)):
+            self._index(r)
+
+    @classmethod
+    def from_dict(cls, solution):
+        """Solution of a solution dict with 'routes', as printed in the RESULT line."""
+        return cls(Route([visit['node_id'] for visit in route], [visit['waiting_time'] for visit in route])
+                   for route in solution['routes'])
+
+    @classmethod
+    def from_routes(cls, routes, waiting=None):
+        """Solution of lists of node ids (and lists of waiting times per route, all zero by default)."""
+        if waiting is None:
+            return cls(Route(nodes) for nodes in routes)
+        return cls(Route(nodes, waiting_times) for nodes, waiting_times in zip(routes, waiting))
+
+    def to_dict(self):
+        """The solution dict, from_dict(solution).to_dict() == solution."""
+        return {'routes': [route.to_list() for route in self._routes]}
+
+    def route_lists(self):
+        """(node ids, waiting times) lists of every route, see helper.solution_routes."""
+        return [(route.nodes.tolist(), route.waiting.tolist()) for route in self._routes]
+
+    def encode(self):
+        """Flat numpy encoding of the routes, like helper.encode_routes: node ids, waiting times and route offsets."""
+        route_offsets = np.zeros(len(self._routes) + 1, dtype=np.int64)
+        np.cumsum([len(route) for route in self._routes], out=route_offsets[1:])
+        if not self._routes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), route_offsets
+        nodes = np.concatenate([np.frombuffer(route.nodes, dtype=np.int32) for route in self._routes])
+        waiting = np.concatenate([np.frombuffer(route.waiting, dtype=np.float64) for route in self._routes])
+        return nodes.astype(np.int64), waiting, route_offsets
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __getitem__(self, r):
+        return self._routes[r]
+
+    def __iter__(self):
+        return iter(self._routes)
+
+    def __eq__(self, other):
+        return isinstance(other, Solution) and self._routes == other._routes
+
+    def __repr__(self):
+        return f"Solution({self._routes})"
+
+    def __getstate__(self):
+        # Only the routes, the index is rebuilt (a tuple, pickle skips __setstate__ for an empty state)
+        return (self._routes,)
+
+    def __setstate__(self, state):
+        Solution.__init__(self, state[0])
+
+    def clone(self):
+        """Copy of the solution in O(number of routes), routes are copied when either solution changes them."""
+        other = Solution.__new__(Solution)
+        other._routes = list(self._routes)
+        self._shared = [True] * len(self._routes)
+        other._shared = [True] * len(self._routes)
+        other._route_of, other._position_of = self._route_of, self._position_of
+        self._index_shared = other._index_shared = True
+        return other
+
+    # Lookup
+
+    def locate(self, node_id):
+        """(route, position) of a node, None if it is not in the solution."""
+        if node_id >= len(self._route_of) or self._route_of[node_id] < 0:
+            return None
+        return self._route_of[node_id], self._position_of[node_id]
+
+    def route_of(self, node_id):
+        """Index of the route of a node, None if it is not in the solution."""
+        location = self.locate(node_id)
+        return None if location is None else location[0]
+
+    def __contains__(self, node_id):
+        return self.locate(node_id) is not None
+
+    # Changes
+
+    def add_route(self, nodes, waiting=None):
+        """Append a route (node ids including the depots), returns its index."""
+        self._routes.append(Route(nodes, waiting))
+        self._shared.append(False)
+        self._index(len(self._routes) - 1)
+        return len(self._routes) - 1
+
+    def set_route(self, r, nodes, waiting=None):
+        """Replace route r by `nodes` (including the depots)."""
+        self._unindex(r)
+        self._routes[r] = Route(nodes, waiting)
+        self._shared[r] = False
+        self._index(r)
+
+    def remove_route(self, r):
+        """Remove route r, the routes after it move one index down."""
+        self._unindex(r)
+        del self._routes[r]
+        del self._shared[r]
+        for s in range(r, len(self._routes)):
+            self._index(s)
+
+    def insert(self, r, position, node_id, waiting_time=0.0):
+        """Insert a node before `position` of route r."""
+        route = self._writable(r)
+        route.nodes.insert(position, node_id)
+        route.waiting.insert(position, waiting_time)
+        self._index(r, position)
+
+    def remove(self, r, position):
+        """Remove the node at `position` of route r, returns its node id."""
+        route = self._writable(r)
+        node_id = route.nodes.pop(position)
+        route.waiting.pop(position)
+        self._clear(node_id, r, position)
+        self._index(r, position)
+        return node_id
+
+    def set_waiting_time(self, r, position, waiting_time):
+        self._writable(r).waiting[position] = waiting_time
+
+    def _writable(self, r):
+        if self._shared[r]:
+            self._routes[r] = self._routes[r].copy()
+            self._shared[r] = False
+        return self._routes[r]
+
+    # Node index, -1 for nodes that are not in the solution
+
+    def _writable_index(self):
+        if self._index_shared:
+            self._route_of, self._position_of = self._route_of[:], self._position_of[:]
+            self._index_shared = False
+        return self._route_of, self._position_of
+
+    def _index(self, r, start=1):
+        # (Re)index the nodes of route r from position `start` on
+        route_of, position_of = self._writable_index()
+        nodes = self._routes[r].nodes
+        if len(nodes) > 2:
+            size = max(nodes[1:-1]) + 1
+            if size > len(route_of):
+                route_of.extend([-1] * (size - len(route_of)))
+                position_of.extend([-1] * (size - len(position_of)))
+        for position in range(max(start, 1), len(nodes) - 1):
+            node_id = nodes[position]
+            route_of[node_id], position_of[node_id] = r, position
+
+    def _unindex(self, r):
+        for position, node_id in enumerate(self._routes[r].nodes):
+            self._clear(node_id, r, position)
+
+    def _clear(self, node_id, r, position):
+        if node_id < len(self._route_of) and self._route_of[node_id] == r and self._position_of[node_id] == position:
+            route_of, position_of = self._writable_index()
+            route_of[node_id] = position_of[node_id] = -1
@@ -1,79 +1,332 @@
+import atexit
+import contextlib
+import cProfile
+import functools
+import heapq
+import json
+import os
+import pstats
 import random
+import signal
+import threading
+import time
+from collections import OrderedDict
 from math import sqrt
 
+import numpy as np
+from scipy.spatial import cKDTree
+
 
 # a helper module, you can use more submodules like this to keep your code readable, but do import them in main.py
 
 
+# Opt-in profiling of the solver: timers, counters and optionally cProfile, see Profiler. Off unless the environment
+# variable VRP_PROFILE is set (evaluate.py --profile sets it on the server, locally run e.g. VRP_PROFILE=1 python
+# main.py), and when it is off the timers and counters do nothing. The summary is written as a 'profile' record to the
+# result channel, or printed as a "PROFILE: {...}" line, by emit_result (or at exit if emit_result is not called).
+#
+# Usage:
+#     with helper.profiler.timer('construction'):
+#         solution = helper.regret_insertion(instance_dict)
+#     helper.profiler.count('moves_evaluated')
+#
+#     @helper.profiler.timed()
+#     def local_search(solution): ...
+PROFILE_ENV = "VRP_PROFILE"
+# VRP_PROFILE=cprofile also runs cProfile, VRP_PROFILE_DUMP=path then writes the full statistics to a file
+PROFILE_DUMP_ENV = "VRP_PROFILE_DUMP"
+PROFILE_TOP_FUNCTIONS = 15
+
+
+class _Timer:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """Timers and counters of a run, use the module-level helper.profiler.
+
+    Args:
+        mode: None or '0' (off), 'cprofile' (timers, counters and cProfile), anything else (timers and counters)
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode
+        self.enabled = bool(mode) and mode != '0'
+        self._cprofile = cProfile.Profile() if self.enabled and mode == 'cprofile' else None
+        self.reset()
+        if self.enabled:
+            atexit.register(self._emit_at_exit)
+
+    def reset(self):
+        """Start a new run (the persistent harness runs several instances in one process)."""
+        self.timers, self.counters = {}, {}
+        self.start_time = time.perf_counter()
+        self.emitted = False
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def timer(self, name):
+        """Context manager that adds the time of its block to the timer `name`."""
+        return _Timer(self, name) if self.enabled else contextlib.nullcontext()
+
+    def timed(self, name=None):
+        """Decorator that times every call of a function (under its name by default), returns it as is when off."""
+        def decorate(function):
+            if not self.enabled:
+                return function
+            label = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with _Timer(self, label):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def add_time(self, name, seconds):
+        timer = self.timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += 1
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """The timers (seconds and calls), counters and, with cProfile, the functions with the most cumulative time."""
+        summary = {'wall_seconds': round(time.perf_counter() - self.start_time, 6),
+                   'timers': {name: {'seconds': round(seconds, 6), 'calls': calls}
+                              for name, (seconds, calls) in self.timers.items()},
+                   'counters': dict(self.counters)}
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            stats = pstats.Stats(self._cprofile)
+            top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+            summary['functions'] = [[f"{os.path.basename(filename)}:{line}({function})", calls, round(cumulative, 6)]
+                                    for (filename, line, function), (_, calls, _, cumulative, _) in top]
+            if os.environ.get(PROFILE_DUMP_ENV):
+                stats.dump_stats(os.environ[PROFILE_DUMP_ENV])
+            self._cprofile.enable()
+        return summary
+
+    def emit(self):
+        """Write the summary to the result channel (or print the PROFILE line), does nothing when profiling is off."""
+        if not self.enabled:
+            return
+        summary = self.summary()
+        if not write_record({'v': RESULT_PROTOCOL_VERSION, 'type': 'profile', **summary}):
+            print("PROFILE:", json.dumps(summary, separators=(',', ':')))
+        self.emitted = True
+
+    def _emit_at_exit(self):
+        if not self.emitted:
+            self.emit()
+
+
+profiler = Profiler(os.environ.get(PROFILE_ENV))
+
+
 def read_instance(filename):
     with open(filename, 'r') as file:
         lines = file.readlines()
     return lines
 
 
+# Sections of an instance file, found by the start of their /* ... */ header (compared in lower case, with '-' as a
+# space): the header fields with one integer each, and the node sections with one node per line
+INSTANCE_FIELDS = (
+    ('cardinality of the grid', 'grid_cardinality'),
+    ('cardinality of pick up locations', 'number_of_pick_up_locations'),
+    ('cardinality of delivery locations', 'number_of_delivery_locations'),
+    ('cardinality of depots', 'number_of_depots'),
+    ('total number of trucks', 'number_of_trucks'),
+    ('capacity of trucks', 'vehicle_capacity'),
+    ('maximum working hours', 'maximum_working_hours'),
+    ('revenue', 'revenue'),
+)
+INSTANCE_NODE_SECTIONS = (
+    ('depots', 'depots', 'number_of_depots'),
+    ('pick up locations', 'pick_up_locations', 'number_of_pick_up_locations'),
+    ('delivery locations', 'delivery_locations', 'number_of_delivery_locations'),
+)
+NODE_COLUMNS = ('id', 'x_coord', 'y_coord', 'demand', 'time_window_start', 'time_window_end')
+
+
+def _instance_error(line_index, message):
+    return ValueError(f"Malformed instance, line {line_index + 1}: {message}")
+
+
+def _split_instance_sections(instance):
+    """One pass over the lines of an instance, {section key: (index of the header line, indices of its data lines)}."""
+    headers = [(prefix, key) for prefix, key in INSTANCE_FIELDS] + [(prefix, key) for prefix, key, _ in
+                                                                    INSTANCE_NODE_SECTIONS]
+    sections, current = {}, None
+    for index, line in enumerate(instance):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('/*'):
+            if current is None:
+                raise _instance_error(index, "data before the first section header")
+            current.append(index)
+            continue
+        end = line.find('*/')
+        if end < 0:
+            raise _instance_error(index, "section header without '*/'")
+        if line[end + 2:].strip():
+            raise _instance_error(index, "data after the section header")
+        title = line[2:end].strip()
+        normalized = ' '.join(title.lower().replace('-', ' ').split())
+        key = next((key for prefix, key in headers if normalized.startswith(prefix)), None)
+        if key is None:
+            raise _instance_error(index, f"unknown section '{title}'")
+        if key in sections:
+            raise _instance_error(index, f"section '{title}' appears twice")
+        current = []
+        sections[key] = (index, current)
+    return sections
+
+
+def _parse_instance_field(instance, sections, key):
+    header_index, indices = sections[key]
+    if len(indices) != 1:
+        raise _instance_error(header_index, f"expected one value after the header, found {len(indices)} lines")
+    try:
+        return int(instance[indices[0]])
+    except ValueError:
+        raise _instance_error(indices[0], f"expected an integer, found '{instance[indices[0]].strip()}'") from None
+
+
+def _parse_node_table(instance, sections, key, count, first_id):
+    # (count, 6) int64 table of a node section, with the columns of NODE_COLUMNS and node ids first_id, first_id + 1, ..
+    header_index, indices = sections[key]
+    if len(indices) != count:
+        raise _instance_error(header_index, f"expected {count} nodes after the header, found {len(indices)} lines")
+    try:
+        table = np.fromstring(' '.join([instance[index] for index in indices]), dtype=np.int64, sep=' ')
+    except ValueError:
+        table = None
+    if table is not None and table.size == count * len(NODE_COLUMNS):
+        table = table.reshape(count, len(NODE_COLUMNS))
+        if np.array_equal(table[:, 0], np.arange(first_id, first_id + count)):
+            return table
+
+    # Slow path, only to point at the offending line
+    for position, index in enumerate(indices):
+        fields = instance[index].split()
+        if len(fields) != len(NODE_COLUMNS):
+            raise _instance_error(index, f"expected {len(NODE_COLUMNS)} values, found {len(fields)}")
+        for field in fields:
+            try:
+                int(field)
+            except ValueError:
+                raise _instance_error(index, f"expected integers, found '{field}'") from None
+        if int(fields[0]) != first_id + position:
+            raise _instance_error(index, f"expected node id {first_id + position}, found {fields[0]}")
+    raise _instance_error(header_index, "could not read the node section")
+
+
+def parse_instance_tables(instance):
+    """Parse and validate the lines of an instance file (see read_instance).
+
+    Sections are found by their /* ... */ headers, so blank lines and trailing whitespace do not matter. Node ids must
+    be numbered 1, 2, ... in the order depots, pick-up locations, delivery locations, with as many deliveries as
+    pick-ups (the delivery of pick-up i is i + number of pick-ups).
+
+    Returns:
+        (header fields dict, list of the (count, 6) int64 node tables of the depots, pick-ups and deliveries)
+
+    Raises:
+        ValueError: with the line number, for missing, unknown or malformed sections and inconsistent counts or ids
+    """
+    sections = _split_instance_sections(instance)
+    for prefix, key in INSTANCE_FIELDS:
+        if key not in sections:
+            raise ValueError(f"Malformed instance: no '/* {prefix} */' section")
+    for prefix, key, _ in INSTANCE_NODE_SECTIONS:
+        if key not in sections:
+            raise ValueError(f"Malformed instance: no '/* {prefix} */' section")
+
+    fields = {key: _parse_instance_field(instance, sections, key) for _, key in INSTANCE_FIELDS}
+    for _, key, count_key in INSTANCE_NODE_SECTIONS:
+        if fields[count_key] < 0:
+            raise _instance_error(sections[count_key][1][0], f"negative number of nodes {fields[count_key]}")
+    if fields['number_of_delivery_locations'] != fields['number_of_pick_up_locations']:
+        raise _instance_error(sections['number_of_delivery_locations'][1][0],
+                             "the number of delivery locations differs from the number of pick-up locations")
+    total = sum(fields[count_key] for _, _, count_key in INSTANCE_NODE_SECTIONS)
+    if fields['grid_cardinality'] != total:
+        raise _instance_error(sections['grid_cardinality'][1][0],
+                             f"grid cardinality {fields['grid_cardinality']} but {total} nodes")
+
+    tables, first_id = [], 1
+    for _, key, count_key in INSTANCE_NODE_SECTIONS:
+        table = _parse_node_table(instance, sections, key, fields[count_key], first_id)
+        tables.append(table)
+        first_id += len(table)
+    return fields, tables
+
+
+@profiler.timed()
 def parse_instance(instance):
-    # Function to extract section data dynamically
-    def extract_section_data(start_idx, count):
-        section_data = {}
-        actual_count = 0
-        for i in range(count):
-            line = instance[start_idx + i].strip().split()
-            if len(line) == 6:
-                actual_count += 1
-                node_id = int(line[0])
-                section_data[node_id] = {
-                    'id': int(line[0]),
-                    'x_coord': int(line[1]),
-                    'y_coord': int(line[2]),
-                    'demand': int(line[3]),
-                    'time_window_start': int(line[4]),
-                    'time_window_end': int(line[5]),
-                }
-            else:
-                print("Warning, mismatch while parsing instance!")
-        if actual_count != count:
-            print("Warning, mismatch while arsing instance!")
-        return section_data, start_idx + count
-
-    # Extracting cardinalities directly from the instance list
-    cardinalities = {
-        'depots': int(instance[7].strip()),
-        'pick_up_locations': int(instance[3].strip()),
-        'delivery_locations': int(instance[5].strip()),
-    }
+    """Instance dict of the lines of an instance file, see parse_instance_tables for the format and errors.
 
-    # Starting line index for depots, pickups, and deliveries
-    depots_start_line = 17
-    pickups_start_line = depots_start_line + cardinalities['depots'] + 1
-    deliveries_start_line = pickups_start_line + cardinalities['pick_up_locations'] + 1
+    The node sections are dicts node id -> node dict with the NODE_COLUMNS keys. Besides the number of trucks and
+    their capacity the dict has the other header fields 'grid_cardinality', 'maximum_working_hours' and 'revenue'.
+    """
+    fields, tables = parse_instance_tables(instance)
+    instance_dict = {}
+    for (_, key, _), table in zip(INSTANCE_NODE_SECTIONS, tables):
+        instance_dict[key] = {row[0]: dict(zip(NODE_COLUMNS, row)) for row in table.tolist()}
+    instance_dict.update({
+        'number_of_trucks': fields['number_of_trucks'],
+        'vehicle_capacity': fields['vehicle_capacity'],
+        'grid_cardinality': fields['grid_cardinality'],
+        'maximum_working_hours': fields['maximum_working_hours'],
+        'revenue': fields['revenue'],
+        # Kept for old code, a mismatch raises a ValueError now
+        'cardinality_checks': {key: True for _, key, _ in INSTANCE_NODE_SECTIONS},
+    })
+    return instance_dict
 
-    # Parsing data dynamically
-    depots, _ = extract_section_data(depots_start_line, cardinalities['depots'])
-    pickups, _ = extract_section_data(pickups_start_line, cardinalities['pick_up_locations'])
-    deliveries, _ = extract_section_data(deliveries_start_line, cardinalities['delivery_locations'])
 
-    number_of_trucks = int(instance[9].strip())
-    vehicle_capacity = int(instance[11].strip())
+@profiler.timed()
+def parse_instance_arrays(instance):
+    """The arrays of build_instance_arrays straight from the lines of an instance file, without the instance dict."""
+    fields, tables = parse_instance_tables(instance)
+    return _fill_instance_arrays(tables, fields)
 
-    # Verifying cardinality
-    cardinality_checks = {
-        'depots': len(depots) == cardinalities['depots'],
-        'pick_up_locations': len(pickups) == cardinalities['pick_up_locations'],
-        'delivery_locations': len(deliveries) == cardinalities['delivery_locations'],
-    }
 
-    # Return structured data
-    return {
-        'depots': depots,
-        'pick_up_locations': pickups,
-        'delivery_locations': deliveries,
-        'number_of_trucks': number_of_trucks,
-        'vehicle_capacity': vehicle_capacity,
-        'cardinality_checks': cardinality_checks,
-    }
+def as_solution_dict(solution):
+    """The solution dict with 'routes' of a solution, which may also be an object with a to_dict() method.
+
+    All functions that take a solution accept such objects too, e.g., compact_solution.Solution of the starter code.
+    """
+    return solution if isinstance(solution, dict) else solution.to_dict()
+
+
+def solution_routes(solution):
+    """(node ids, waiting times) lists of every route of a solution dict or of an object with route_lists()."""
+    if isinstance(solution, dict):
+        return [([visit['node_id'] for visit in route], [visit['waiting_time'] for visit in route])
+                for route in solution['routes']]
+    return solution.route_lists()
 
 
 def check_vehicle_capacity(solution, instance_dict, vehicle_capacity):
+    solution = as_solution_dict(solution)
     for route in solution['routes']:
         total_demand = 0
         # Adjusted to handle new format
@@ -89,6 +342,7 @@ def check_vehicle_capacity(solution, instance_dict, vehicle_capacity):
 
 
 def check_start_end_at_depot(solution, instance_dict):
+    solution = as_solution_dict(solution)
     # Extract actual depot IDs for comparison
     depot_ids = {depot_detail['id'] for depot_detail in instance_dict['depots'].values()}
 
@@ -103,10 +357,11 @@ def check_start_end_at_depot(solution, instance_dict):
 
 
 def check_number_of_trucks(solution, number_of_trucks):
-    return len(solution['routes']) <= number_of_trucks
+    return len(as_solution_dict(solution)['routes']) <= number_of_trucks
 
 
 def check_pickup_before_delivery(solution, instance_dict):
+    solution = as_solution_dict(solution)
     total_customers = len(instance_dict['pick_up_locations'])
 
     for route in solution['routes']:
@@ -137,6 +392,7 @@ def check_pickup_before_delivery(solution, instance_dict):
     return True
 
 def check_no_duplicate_visits(solution):
+    solution = as_solution_dict(solution)
     visited_nodes = set()  # Track visited nodes across all routes
 
     for route in solution['routes']:
@@ -150,19 +406,136 @@ def check_no_duplicate_visits(solution):
     return True  # All nodes visited at most once across all routes, pass the check
 
 def check_solution_feasibility(solution, instance_dict):
-    vehicle_capacity = instance_dict.get('vehicle_capacity', 0)  # Default to 0 if not found
-    number_of_trucks = instance_dict.get('number_of_trucks', 0)  # Default to 0 if not found
+    report = validate_solution(solution, instance_dict)
+    kinds = {violation['kind'] for violation in report['violations']}
 
-    if not check_vehicle_capacity(solution, instance_dict, vehicle_capacity):
+    if 'capacity' in kinds:
         print("Warning: Vehicle capacity exceeded.")
-    if not check_start_end_at_depot(solution, instance_dict):
+    if 'depot' in kinds:
         print("Warning: Route does not start and end at a depot.")
-    if not check_number_of_trucks(solution, number_of_trucks):
+    if 'trucks' in kinds:
         print("Warning: Number of trucks exceeded.")
-    if not check_pickup_before_delivery(solution, instance_dict):
+    if 'pickup_delivery' in kinds:
         print("Warning: Delivery location visited before corresponding pickup location or only picked up and not delivered.")
-    if not check_no_duplicate_visits(solution):
+    if 'duplicate' in kinds:
         print("Warning: Multiple visits of the same customer.")
+    if 'unknown_node' in kinds:
+        print("Warning: Solution contains node ids that are not in the instance.")
+    return report
+
+
+# Messages used for each kind of violation reported by validate_solution, in the order they are reported
+FEASIBILITY_MESSAGES = {
+    'capacity': "Vehicle capacity exceeded",
+    'depot': "Route does not start/end at depot",
+    'trucks': "Number of trucks exceeded",
+    'pickup_delivery': "Delivery before pickup OR only pickup, no delivery",
+    'duplicate': "Visiting customer(s) more than once",
+    'unknown_node': "Unknown node id(s) in solution",
+}
+
+
+@profiler.timed()
+def validate_solution(solution, instance):
+    """Check all feasibility constraints in a single pass over the solution.
+
+    Applies the same rules as the separate check_* functions, but reports every violation instead of stopping at
+    the first one.
+
+    Args:
+        solution: solution dict with 'routes'
+        instance: parsed instance dict (or its arrays, see build_instance_arrays)
+    Returns:
+        dict with 'feasible' (bool) and 'violations', a list of dicts with the 'kind' of violation (a key of
+        FEASIBILITY_MESSAGES), the 'route' index, the 'position' in that route and the 'node_id' involved. Route and
+        position are None for violations of the whole solution.
+    """
+    arrays = get_instance_arrays(instance)
+    node_type = arrays['node_type'].tolist()
+    demand = arrays['demand'].tolist()
+    size = len(node_type)
+    vehicle_capacity = arrays['vehicle_capacity']
+    number_of_customers = arrays['number_of_customers']
+
+    violations = []
+    visited = bytearray(size)  # visits of known nodes over all routes, excluding the first and last visit of a route
+    visited_other = set()  # visits of unknown node ids
+
+    def add(kind, route_index, position, node_id):
+        violations.append({'kind': kind, 'route': route_index, 'position': position, 'node_id': node_id})
+
+    solution = as_solution_dict(solution)
+    if len(solution['routes']) > arrays['number_of_trucks']:
+        add('trucks', None, None, None)
+
+    for route_index, route in enumerate(solution['routes']):
+        if not route:
+            add('depot', route_index, 0, None)
+            continue
+
+        last = len(route) - 1
+        load, overloaded = 0, False
+        open_pickups = {}  # pickup id -> position, for pickups not delivered yet in this route
+        delivered = set()
+
+        for position, visit in enumerate(route):
+            node_id = visit['node_id']
+            try:
+                kind = node_type[node_id] if 0 <= node_id < size else NODE_UNKNOWN
+            except TypeError:
+                kind = NODE_UNKNOWN
+            interior = 0 < position < last
+
+            if kind == NODE_UNKNOWN:
+                add('unknown_node', route_index, position, node_id)
+            if (position == 0 or position == last) and kind != NODE_DEPOT:
+                add('depot', route_index, position, node_id)
+
+            if interior:
+                if kind == NODE_UNKNOWN:
+                    if node_id in visited_other:
+                        add('duplicate', route_index, position, node_id)
+                    visited_other.add(node_id)
+                else:
+                    if visited[node_id]:
+                        add('duplicate', route_index, position, node_id)
+                    visited[node_id] = 1
+
+                # Report the positions where the load goes over the capacity
+                if kind == NODE_PICKUP or kind == NODE_DELIVERY:
+                    load += demand[node_id]
+                    if load > vehicle_capacity and not overloaded:
+                        add('capacity', route_index, position, node_id)
+                    overloaded = load > vehicle_capacity
+
+            if kind == NODE_DELIVERY:
+                pickup_id = node_id - number_of_customers
+                if pickup_id not in open_pickups or pickup_id in delivered:
+                    add('pickup_delivery', route_index, position, node_id)
+                else:
+                    delivered.add(pickup_id)
+            elif kind == NODE_PICKUP:
+                open_pickups.setdefault(node_id, position)
+
+        for pickup_id, position in open_pickups.items():
+            if pickup_id not in delivered:
+                add('pickup_delivery', route_index, position, pickup_id)
+
+    order = list(FEASIBILITY_MESSAGES)
+    violations.sort(key=lambda violation: order.index(violation['kind']))
+    return {'feasible': not violations, 'violations': violations}
+
+
+def feasibility_messages(report):
+    """The distinct messages of the violations in a validate_solution report."""
+    return list(dict.fromkeys(FEASIBILITY_MESSAGES[violation['kind']] for violation in report['violations']))
+
+
+# Cost parameters of the profit calculation
+TRUCK_COST_PER_HOUR = 20
+TRUCK_SPEED = 25  # distance units per hour
+PENALTY_PER_HOUR = 6  # Euro per hour early or late
+REVENUE_PER_DEMAND_UNIT = 50  # Euro per unit of demand
 
 
 def calculate_euclidean_distance(x1, y1, x2, y2):
@@ -178,18 +551,20 @@ def total_profit_with_penalties(solution, instance):
     -The waiting time at the depot is not included in the waiting time, to start later delivery
     -Make clear that waiting time is in minutes and is a decision variable
     """
+    profiler.count('score_calls')
     total_distance = 0
     total_penalty = 0  # Initialize total penalty for time window violations
     total_revenue = 0  # Initialize total revenue from sales
     total_waiting_time_hours = 0  # Initialize total waiting time
-    truck_cost_per_hour = 20
-    truck_speed = 25  # distance units per hour
-    penalty_per_hour = 6  # Euro per hour early or late
-    revenue_per_demand_unit = 50  # Euro per unit of demand
+    truck_cost_per_hour = TRUCK_COST_PER_HOUR
+    truck_speed = TRUCK_SPEED
+    penalty_per_hour = PENALTY_PER_HOUR
+    revenue_per_demand_unit = REVENUE_PER_DEMAND_UNIT
 
     # Combine pickup and delivery locations for easy access
     node_data = {**instance['depots'], **instance['pick_up_locations'], **instance['delivery_locations']}
 
+    solution = as_solution_dict(solution)
     for route in solution['routes']:
         current_time = 0  # Start of the day for each route
         for i in range(len(route) - 1):
@@ -201,21 +576,22 @@ def total_profit_with_penalties(solution, instance):
             waiting_time_hours = node_current['waiting_time'] / 60.0  # Convert waiting time to hours
             total_waiting_time_hours += waiting_time_hours  # Accumulate total waiting time
 
-            x1, y1 = node_data[node_id_current]['x_coord'], node_data[node_id_current]['y_coord']
-            x2, y2 = node_data[node_id_next]['x_coord'], node_data[node_id_next]['y_coord']
-            travel_time_hours = calculate_euclidean_distance(x1, y1, x2, y2) / truck_speed
+            # Distances come from the instance dict on every call, so the reference scorer always follows the dict
+            data_current, data_next = node_data[node_id_current], node_data[node_id_next]
+            travel_time_hours = calculate_euclidean_distance(data_current['x_coord'], data_current['y_coord'],
+                                                             data_next['x_coord'], data_next['y_coord']) / truck_speed
 
             current_time += travel_time_hours + waiting_time_hours
             service_start_time = current_time
 
-            if service_start_time < node_data[node_id_next]['time_window_start']:
-                total_penalty += (node_data[node_id_next]['time_window_start'] - service_start_time) * penalty_per_hour
-            elif service_start_time > node_data[node_id_next]['time_window_end']:
-                total_penalty += (service_start_time - node_data[node_id_next]['time_window_end']) * penalty_per_hour
+            if service_start_time < data_next['time_window_start']:
+                total_penalty += (data_next['time_window_start'] - service_start_time) * penalty_per_hour
+            elif service_start_time > data_next['time_window_end']:
+                total_penalty += (service_start_time - data_next['time_window_end']) * penalty_per_hour
 
             # If the current node is a pickup location, calculate revenue
             if node_id_current in instance['pick_up_locations']:
-                demand = node_data[node_id_current]['demand']
+                demand = data_current['demand']
                 total_revenue += demand * revenue_per_demand_unit
 
             total_distance += travel_time_hours * truck_speed
@@ -226,6 +602,320 @@ def total_profit_with_penalties(solution, instance):
     return total_revenue-total_cost  # return profit
 
 
+# Array-backed instance representation and vectorized scoring. These give exactly the same profits as
+# total_profit_with_penalties (same floating point operations in the same order), but are much faster when many
+# solutions or routes need to be scored, e.g., inside a local search.
+
+NODE_UNKNOWN, NODE_DEPOT, NODE_PICKUP, NODE_DELIVERY = 0, 1, 2, 3
+
+
+# Distance matrices up to this size are materialized in full, larger ones are computed in blocks of rows
+FULL_DISTANCE_MATRIX_MAX_BYTES = 64 * 2 ** 20
+DISTANCE_BLOCK_BYTES = 4 * 2 ** 20
+DISTANCE_CACHE_BYTES = 64 * 2 ** 20
+
+
+class DistanceMatrix:
+    """Euclidean distances between all nodes (by node id), bit-identical to calculate_euclidean_distance.
+
+    Behaves like the full float64 matrix for integer indexing: matrix[i, j], matrix[i] (a row), matrix[rows] and
+    matrix[from_ids, to_ids] with integer arrays (broadcast element-wise, like numpy). The matrix is only
+    materialized on first use, and only if it takes at most `full_max_bytes`. Larger matrices compute single
+    distances directly and rows in blocks, of which at most `cache_bytes` are kept, so memory stays bounded. `full`
+    is the materialized matrix if it is already known, e.g. mapped from shared memory by islands.py.
+    """
+
+    def __init__(self, x_coord, y_coord, full_max_bytes=FULL_DISTANCE_MATRIX_MAX_BYTES,
+                 cache_bytes=DISTANCE_CACHE_BYTES, full=None):
+        self.x_coord = np.asarray(x_coord, dtype=np.float64)
+        self.y_coord = np.asarray(y_coord, dtype=np.float64)
+        self.full_max_bytes, self.cache_bytes = full_max_bytes, cache_bytes
+        size = len(self.x_coord)
+        self.shape, self.dtype, self.ndim = (size, size), np.dtype(np.float64), 2
+        self.lazy = size * size * 8 > full_max_bytes
+        self.block_size = max(1, DISTANCE_BLOCK_BYTES // max(8 * size, 1))
+        self.max_blocks = max(1, cache_bytes // max(8 * size * self.block_size, 1))
+        self.full = full
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._x, self._y = self.x_coord.tolist(), self.y_coord.tolist()
+
+    def __reduce__(self):
+        # Only the coordinates are pickled, e.g., to send the arrays to another process
+        return DistanceMatrix, (self.x_coord, self.y_coord, self.full_max_bytes, self.cache_bytes)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def between(self, a, b):
+        """Distance between two nodes as a Python float, the fastest for a single distance."""
+        x, y = self._x, self._y
+        return sqrt((x[b] - x[a]) ** 2 + (y[b] - y[a]) ** 2)  # as in calculate_euclidean_distance
+
+    def rows(self, rows):
+        """Distances from the nodes in `rows` to all nodes, a new array."""
+        rows = np.asarray(rows)
+        # The same operations as calculate_euclidean_distance, element-wise
+        return np.sqrt((self.x_coord[None, :] - self.x_coord[rows, None]) ** 2 +
+                       (self.y_coord[None, :] - self.y_coord[rows, None]) ** 2)
+
+    def materialize(self):
+        """The full matrix as a numpy array (also for large instances, where this takes a lot of memory)."""
+        if self.full is None:
+            full = self.rows(np.arange(len(self)))
+            full.flags.writeable = False
+            self.full = full
+        return self.full
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self.materialize()
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    def tolist(self):
+        return self.materialize().tolist()
+
+    def row(self, i):
+        """Distances from node i to all nodes (read-only)."""
+        if not self.lazy:
+            return self.materialize()[i]
+        block = i // self.block_size
+        with self._lock:
+            values = self._blocks.get(block)
+            if values is None:
+                values = self.rows(np.arange(block * self.block_size, min((block + 1) * self.block_size, len(self))))
+                values.flags.writeable = False
+                self._blocks[block] = values
+                if len(self._blocks) > self.max_blocks:
+                    self._blocks.popitem(last=False)
+            else:
+                self._blocks.move_to_end(block)
+        return values[i - block * self.block_size]
+
+    def __getitem__(self, key):
+        if not self.lazy:
+            return self.materialize()[key]
+        if isinstance(key, tuple) and len(key) == 2 and not any(isinstance(k, slice) for k in key):
+            a, b = key
+            if np.ndim(a) == 0 and np.ndim(b) == 0:
+                return np.float64(self.between(a, b))
+            if np.ndim(a) == 0:
+                return self.row(a)[b]
+            a, b = np.asarray(a), np.asarray(b)
+            return np.sqrt((self.x_coord[b] - self.x_coord[a]) ** 2 + (self.y_coord[b] - self.y_coord[a]) ** 2)
+        rows, columns = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if np.ndim(rows) == 0 and not isinstance(rows, slice):
+            return self.row(rows)[columns]
+        return self.rows(np.arange(len(self))[rows])[(slice(None),) + columns]
+
+    def row_lists(self):
+        """Rows as Python lists, indexed [i][j], which is the fastest for scalar access from Python code.
+
+        For a matrix that is not materialized the rows compute every distance on access instead, which is slower but
+        takes no memory (caching rows does not help when a search touches more rows than fit in the cache).
+        """
+        if not self.lazy:
+            return self.materialize().tolist()
+        return _DistanceRows(self._x, self._y)
+
+
+class _DistanceRows:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+        self.rows = {}
+
+    def __getitem__(self, i):
+        row = self.rows.get(i)
+        if row is None:
+            row = self.rows[i] = _DistanceRow(self.x, self.y, i)
+        return row
+
+    def __len__(self):
+        return len(self.x)
+
+
+class _DistanceRow:
+    __slots__ = ('x', 'y', 'x_i', 'y_i')
+
+    def __init__(self, x, y, i):
+        self.x, self.y, self.x_i, self.y_i = x, y, x[i], y[i]
+
+    def __getitem__(self, j):
+        return sqrt((self.x[j] - self.x_i) ** 2 + (self.y[j] - self.y_i) ** 2)
+
+    def __len__(self):
+        return len(self.x)
+
+
+def build_instance_arrays(instance_dict):
+    """Convert a parsed instance into numpy arrays indexed by node id, with a (lazy) DistanceMatrix."""
+    tables = []
+    for _, key, _ in INSTANCE_NODE_SECTIONS:
+        section = instance_dict[key]
+        table = np.empty((len(section), len(NODE_COLUMNS)))
+        table[:, 0] = np.fromiter(section, dtype=np.float64, count=len(section))
+        for j, column in enumerate(NODE_COLUMNS[1:], 1):
+            table[:, j] = np.fromiter((node[column] for node in section.values()), dtype=np.float64,
+                                      count=len(section))
+        tables.append(table)
+    return _fill_instance_arrays(tables, instance_dict)
+
+
+def _fill_instance_arrays(tables, fields):
+    # Arrays of the node tables of the depots, pick-ups and deliveries (rows of NODE_COLUMNS values)
+    size = max((int(table[:, 0].max()) for table in tables if len(table)), default=0) + 1
+
+    x_coord = np.zeros(size)
+    y_coord = np.zeros(size)
+    demand = np.zeros(size, dtype=np.int64)
+    time_window_start = np.zeros(size)
+    time_window_end = np.zeros(size)
+    node_type = np.full(size, NODE_UNKNOWN, dtype=np.int8)
+
+    for kind, table in zip((NODE_DEPOT, NODE_PICKUP, NODE_DELIVERY), tables):
+        node_ids = table[:, 0].astype(np.int64)
+        x_coord[node_ids] = table[:, 1]
+        y_coord[node_ids] = table[:, 2]
+        demand[node_ids] = table[:, 3]
+        time_window_start[node_ids] = table[:, 4]
+        time_window_end[node_ids] = table[:, 5]
+        node_type[node_ids] = kind
+
+    distance = DistanceMatrix(x_coord, y_coord)
+
+    return {
+        'x_coord': x_coord,
+        'y_coord': y_coord,
+        'demand': demand,
+        'time_window_start': time_window_start,
+        'time_window_end': time_window_end,
+        'node_type': node_type,
+        'distance': distance,
+        'number_of_customers': len(tables[1]),
+        'number_of_trucks': fields.get('number_of_trucks', 0),
+        'vehicle_capacity': fields.get('vehicle_capacity', 0),
+        'maximum_working_hours': fields.get('maximum_working_hours', 0),
+        'revenue': fields.get('revenue', 0),
+    }
+
+
+def get_instance_arrays(instance):
+    """Return the arrays of an instance, accepts both a parsed instance dict and the arrays themselves.
+
+    The arrays of an instance dict are built on every call, so the functions that take an instance dict always follow
+    its current contents. Build them once with build_instance_arrays and pass those to call such functions repeatedly.
+    """
+    if 'node_type' in instance:
+        return instance
+    return build_instance_arrays(instance)
+
+
+def encode_routes(routes, arrays):
+    """Flat encoding of a list of routes: node ids, waiting times (minutes) and route offsets (CSR layout)."""
+    nodes = np.fromiter((visit['node_id'] for route in routes for visit in route), dtype=np.int64)
+    waiting = np.fromiter((visit['waiting_time'] for route in routes for visit in route), dtype=np.float64,
+                          count=len(nodes))
+    route_offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+    np.cumsum([len(route) for route in routes], out=route_offsets[1:])
+
+    check_node_ids(nodes, arrays)
+    return nodes, waiting, route_offsets
+
+
+def check_node_ids(nodes, arrays):
+    # KeyError for the first node id that is not in the instance, like the instance dict lookups
+    unknown = (nodes < 0) | (nodes >= len(arrays['node_type']))
+    unknown[~unknown] = arrays['node_type'][nodes[~unknown]] == NODE_UNKNOWN
+    if unknown.any():
+        raise KeyError(int(nodes[np.argmax(unknown)]))
+
+
+def profits_from_encoding(nodes, waiting, route_offsets, solution_offsets, arrays):
+    """Score a flat encoding of many solutions at once.
+
+    Args:
+        nodes, waiting, route_offsets: flat route encoding, see encode_routes
+        solution_offsets: solution k consists of routes solution_offsets[k] up to solution_offsets[k + 1]
+        arrays: instance arrays, see build_instance_arrays
+    Returns:
+        numpy array with the profit of every solution
+    """
+    n_solutions = len(solution_offsets) - 1
+    edges_per_route = np.maximum(np.diff(route_offsets) - 1, 0)
+    if n_solutions == 0 or edges_per_route.sum() == 0:
+        return np.zeros(n_solutions)
+
+    # Route layout: one row per route, one column per edge, padded with zeros
+    column = np.arange(edges_per_route.max())
+    valid = column[None, :] < edges_per_route[:, None]
+    source = np.where(valid, route_offsets[:-1, None] + column[None, :], 0)
+    target = np.where(valid, source + 1, 0)
+    node_from, node_to = nodes[source], nodes[target]
+
+    travel_time_hours = np.where(valid, arrays['distance'][node_from, node_to] / TRUCK_SPEED, 0.0)
+    waiting_time_hours = np.where(valid, waiting[source] / 60.0, 0.0)
+    # accumulate is sequential, so this is bit-for-bit the same as the running sum per route
+    service_start_time = np.add.accumulate(travel_time_hours + waiting_time_hours, axis=1)
+
+    window_start = arrays['time_window_start'][node_to]
+    window_end = arrays['time_window_end'][node_to]
+    penalty = np.where(service_start_time < window_start, (window_start - service_start_time) * PENALTY_PER_HOUR,
+                       np.where(service_start_time > window_end, (service_start_time - window_end) * PENALTY_PER_HOUR,
+                                0.0))
+    penalty = np.where(valid, penalty, 0.0)
+    revenue = np.where(valid & (arrays['node_type'][node_from] == NODE_PICKUP),
+                       arrays['demand'][node_from] * REVENUE_PER_DEMAND_UNIT, 0)
+
+    # Solution layout: one row per solution with all its edges in route order, so the totals below are summed in
+    # exactly the same order as in total_profit_with_penalties
+    route_solution = np.repeat(np.arange(n_solutions), np.diff(solution_offsets))
+    edge_offsets = np.concatenate(([0], np.cumsum(edges_per_route)))
+    first_edge = edge_offsets[solution_offsets[:-1]][route_solution]
+    position = (edge_offsets[:-1] - first_edge)[:, None] + column[None, :]
+    row, col = np.broadcast_to(route_solution[:, None], valid.shape)[valid], position[valid]
+    width = np.bincount(route_solution, weights=edges_per_route, minlength=n_solutions).max()
+
+    def solution_totals(values):
+        per_solution = np.zeros((n_solutions, int(width)))
+        per_solution[row, col] = values[valid]
+        return np.add.accumulate(per_solution, axis=1)[:, -1]
+
+    total_distance = solution_totals(travel_time_hours * TRUCK_SPEED)
+    total_waiting_time_hours = solution_totals(waiting_time_hours)
+    total_penalty = solution_totals(penalty)
+    total_revenue = np.bincount(route_solution, weights=revenue.sum(axis=1), minlength=n_solutions)
+
+    total_time_hours = (total_distance / TRUCK_SPEED) + total_waiting_time_hours
+    total_cost = (total_time_hours * TRUCK_COST_PER_HOUR) + total_penalty
+    return total_revenue - total_cost
+
+
+def total_profit_batch(solutions, instance):
+    """Profits of many solutions (dicts with 'routes') at once, to score single routes wrap them in a solution."""
+    profiler.count('score_calls', len(solutions))
+    arrays = get_instance_arrays(instance)
+    solution_offsets = np.zeros(len(solutions) + 1, dtype=np.int64)
+    if all(isinstance(solution, dict) for solution in solutions):
+        routes = [route for solution in solutions for route in solution['routes']]
+        nodes, waiting, route_offsets = encode_routes(routes, arrays)
+        np.cumsum([len(solution['routes']) for solution in solutions], out=solution_offsets[1:])
+    else:
+        # Objects with an encode() method (like compact_solution.Solution) encode themselves
+        encodings = [encode_routes(solution['routes'], arrays) if isinstance(solution, dict) else solution.encode()
+                     for solution in solutions]
+        nodes = np.concatenate([encoding[0] for encoding in encodings])
+        waiting = np.concatenate([encoding[1] for encoding in encodings])
+        route_offsets = np.concatenate([[0]] + [encoding[2][1:] + start for encoding, start in
+                                                zip(encodings, np.cumsum([0] + [len(e[0]) for e in encodings]))])
+        check_node_ids(nodes, arrays)
+        np.cumsum([len(encoding[2]) - 1 for encoding in encodings], out=solution_offsets[1:])
+    return profits_from_encoding(nodes, waiting, route_offsets, solution_offsets, arrays)
+
+
+def total_profit_fast(solution, instance):
+    """Drop-in replacement for total_profit_with_penalties that uses the instance arrays."""
+    return float(total_profit_batch([solution], instance)[0])
+
+
 def generate_random_routes_from_instance(parsed_data, depot_id, min_size=1, max_size=5, max_waiting_time=10):
     # Extract IDs of all pickup and delivery locations
     pickup_ids = list(parsed_data['pick_up_locations'].keys())
@@ -259,3 +949,432 @@ def generate_random_routes_from_instance(parsed_data, depot_id, min_size=1, max_
         indices = indices[size:]
 
     return routes
+
+
+class SpatialIndex:
+    """Nearest neighbour queries over the node locations of an instance, with a KD-tree per node type.
+
+    Building the trees takes O(n log n) time and a query for k neighbours roughly O(k log n), so unlike a search in
+    the distance matrix this scales to instances with many thousands of nodes.
+    """
+
+    def __init__(self, instance):
+        arrays = get_instance_arrays(instance)
+        self.x_coord, self.y_coord = arrays['x_coord'], arrays['y_coord']
+        self.time_window_start, self.time_window_end = arrays['time_window_start'], arrays['time_window_end']
+        self.trees = {}
+        for kind in (NODE_DEPOT, NODE_PICKUP, NODE_DELIVERY):
+            node_ids = np.flatnonzero(arrays['node_type'] == kind)
+            if len(node_ids):
+                self.trees[kind] = (node_ids, cKDTree(np.column_stack((self.x_coord[node_ids], self.y_coord[node_ids]))))
+
+    def nearest(self, node_ids, count, kinds=(NODE_PICKUP, NODE_DELIVERY)):
+        """Ids and distances of the `count` nearest nodes of the given kinds for every node in `node_ids`.
+
+        Returns two arrays of shape (len(node_ids), count), sorted by distance (ties by node id), a node is not its
+        own neighbour. Rows are padded with id -1 and distance inf if there are fewer nodes.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        points = np.column_stack((self.x_coord[node_ids], self.y_coord[node_ids]))
+        found_ids, found_distances = [], []
+        for kind in kinds:
+            if kind not in self.trees:
+                continue
+            tree_ids, tree = self.trees[kind]
+            k = min(count + 1, len(tree_ids))
+            distances, indices = tree.query(points, k=k)
+            distances, indices = distances.reshape(len(node_ids), k), indices.reshape(len(node_ids), k)
+            found_ids.append(tree_ids[indices])
+            found_distances.append(distances)
+
+        ids = np.concatenate(found_ids, axis=1) if found_ids else np.empty((len(node_ids), 0), dtype=np.int64)
+        distances = np.concatenate(found_distances, axis=1) if found_distances else np.empty(ids.shape)
+        distances[ids == node_ids[:, None]] = np.inf
+        ids[np.isinf(distances)] = -1
+        order = np.lexsort((ids, distances), axis=1)[:, :count]
+        ids, distances = np.take_along_axis(ids, order, axis=1), np.take_along_axis(distances, order, axis=1)
+        if ids.shape[1] < count:
+            padding = count - ids.shape[1]
+            ids = np.pad(ids, ((0, 0), (0, padding)), constant_values=-1)
+            distances = np.pad(distances, ((0, 0), (0, padding)), constant_values=np.inf)
+        return ids, distances
+
+    def compatible(self, from_ids, to_ids, distances, slack=0.0):
+        """Whether a truck can go from `from_ids` to `to_ids` (element-wise, over the given distances) in time.
+
+        That is, leaving at the start of the first time window it does not arrive more than `slack` hours after the
+        end of the second one. Arriving early is always possible, the truck can wait.
+        """
+        return self.time_window_start[from_ids] + distances / TRUCK_SPEED <= self.time_window_end[to_ids] + slack
+
+
+@profiler.timed()
+def nearest_neighbours(instance, count=10, time_window_slack=1.0):
+    """For every pickup and delivery node id, the ids of the `count` nearest other pickup and delivery nodes.
+
+    Nodes that cannot follow each other in either order, because their time windows are too far apart (more than
+    `time_window_slack` hours late, see SpatialIndex.compatible), are left out. Use None to keep all nodes.
+    """
+    arrays = get_instance_arrays(instance)
+    node_type = arrays['node_type']
+    customers = np.flatnonzero((node_type == NODE_PICKUP) | (node_type == NODE_DELIVERY))
+    count = min(count, len(customers) - 1)
+    if count <= 0:
+        return {int(node_id): [] for node_id in customers}
+
+    index = SpatialIndex(arrays)
+    # Some candidates may be filtered out, so more are queried
+    candidates = count if time_window_slack is None else min(2 * count, len(customers) - 1)
+    ids, distances = index.nearest(customers, candidates)
+    keep = ids >= 0
+    if time_window_slack is not None:
+        from_ids = np.broadcast_to(customers[:, None], ids.shape)
+        keep &= (index.compatible(from_ids, ids, distances, time_window_slack) |
+                 index.compatible(ids, from_ids, distances, time_window_slack))
+    return {int(node_id): ids[i][keep[i]][:count].tolist() for i, node_id in enumerate(customers)}
+
+
+@profiler.timed()
+def regret_insertion(instance, k=3, neighbours=10):
+    """Construct a solution with regret-k insertion of pickup and delivery pairs.
+
+    In every step the pair with the largest regret (how much profit is lost if it cannot go to its best route) is
+    inserted at its best position. Pickup and delivery go in the same route with the pickup first, the vehicle
+    capacity and the number of trucks are respected, a new route starts at the depot nearest to its first pickup and
+    every route ends at the depot nearest to its last delivery. Only positions next to one of the `neighbours`
+    nearest nodes are tried (plus a new route), and pairs that do not increase the profit are left out. The time
+    windows are soft, like in total_profit_with_penalties, and no waiting times are used.
+
+    Args:
+        instance: parsed instance dict (or its arrays, see build_instance_arrays)
+        k: number of best routes the regret is computed over
+        neighbours: size of the nearest neighbour lists
+    Returns:
+        solution dict with 'routes'
+    """
+    arrays = get_instance_arrays(instance)
+    distance = arrays['distance']
+    demand = arrays['demand'].tolist()
+    time_window_start = arrays['time_window_start'].tolist()
+    time_window_end = arrays['time_window_end'].tolist()
+    node_type = arrays['node_type']
+    capacity = arrays['vehicle_capacity']
+    number_of_trucks = arrays['number_of_trucks']
+    n = arrays['number_of_customers']
+    cost_per_distance = TRUCK_COST_PER_HOUR / TRUCK_SPEED
+
+    depots = np.flatnonzero(node_type == NODE_DEPOT)
+    pickups = [int(p) for p in np.flatnonzero(node_type == NODE_PICKUP) if demand[p] <= capacity]
+    if len(depots) == 0 or not pickups:
+        return {'routes': []}
+    nearest_depot = depots[np.argmin(distance[depots], axis=0)].tolist()
+
+    # Rows of the distance matrix as lists, that is much faster to index from Python
+    rows = distance.row_lists() if isinstance(distance, DistanceMatrix) else distance.tolist()
+
+    def dist(a, b):
+        return rows[a][b]
+
+    def penalty(node_id, time):
+        if time < time_window_start[node_id]:
+            return (time_window_start[node_id] - time) * PENALTY_PER_HOUR
+        if time > time_window_end[node_id]:
+            return (time - time_window_end[node_id]) * PENALTY_PER_HOUR
+        return 0.0
+
+    nn = nearest_neighbours(arrays, neighbours)
+    # pickups whose pickup or delivery has node_id among its neighbours, to find the pairs affected by an insertion
+    near = {}
+    for p in pickups:
+        for node_id in set(nn[p]) | set(nn[p + n]):
+            near.setdefault(node_id, set()).add(p)
+
+    routes = []  # node ids, from start depot to end depot
+    route_state = []  # (arrival times, load after every position, penalty of the positions from i on, distance from i on)
+    route_of = {}
+    position_of = {}
+
+    def update_state(r):
+        nodes = routes[r]
+        arrival, load = [0.0], [0]
+        for a, b in zip(nodes, nodes[1:]):
+            arrival.append(arrival[-1] + dist(a, b) / TRUCK_SPEED)
+            load.append(load[-1] + demand[b])
+        suffix_penalty, suffix_distance = [0.0] * len(nodes), [0.0] * len(nodes)
+        for i in range(len(nodes) - 2, -1, -1):
+            suffix_penalty[i] = suffix_penalty[i + 1] + penalty(nodes[i + 1], arrival[i + 1])
+            suffix_distance[i] = suffix_distance[i + 1] + dist(nodes[i], nodes[i + 1])
+        route_state[r] = (arrival, load, suffix_penalty, suffix_distance)
+        for i, node_id in enumerate(nodes[1:-1], 1):
+            route_of[node_id] = r
+            position_of[node_id] = i
+
+    def insertion_delta(r, p, i, j):
+        # Profit change of inserting pickup p before position i and its delivery before position j (j >= i)
+        nodes = routes[r]
+        arrival, load, suffix_penalty, suffix_distance = route_state[r]
+        d = p + n
+        if max(load[i - 1:j]) + demand[p] > capacity:
+            return None
+
+        tail = [p] + nodes[i:j] + [d] + nodes[j:]
+        if j == len(nodes) - 1:
+            tail[-1] = nearest_depot[d]
+        previous, time, new_distance, new_penalty = nodes[i - 1], arrival[i - 1], 0.0, 0.0
+        for node_id in tail:
+            step = dist(previous, node_id)
+            new_distance += step
+            time += step / TRUCK_SPEED
+            new_penalty += penalty(node_id, time)
+            previous = node_id
+
+        return (demand[p] * REVENUE_PER_DEMAND_UNIT - (new_distance - suffix_distance[i - 1]) * cost_per_distance
+                - (new_penalty - suffix_penalty[i - 1]))
+
+    def new_route_delta(p):
+        d = p + n
+        nodes = [nearest_depot[p], p, d, nearest_depot[d]]
+        time, total_distance, total_penalty = 0.0, 0.0, 0.0
+        for a, b in zip(nodes, nodes[1:]):
+            total_distance += dist(a, b)
+            time += dist(a, b) / TRUCK_SPEED
+            total_penalty += penalty(b, time)
+        return demand[p] * REVENUE_PER_DEMAND_UNIT - total_distance * cost_per_distance - total_penalty
+
+    def best_insertions(p):
+        # Best (delta, i, j) per route, only positions next to a neighbour of the pickup or delivery are tried
+        d = p + n
+        pickup_positions, delivery_positions = {}, {}
+        for node_id in nn[p]:
+            if node_id in route_of:
+                position = position_of[node_id]
+                pickup_positions.setdefault(route_of[node_id], set()).update((position, position + 1))
+        for node_id in nn[d]:
+            if node_id in route_of:
+                position = position_of[node_id]
+                delivery_positions.setdefault(route_of[node_id], set()).update((position, position + 1))
+
+        best = {}
+        for r, positions in pickup_positions.items():
+            for i in positions:
+                for j in {i} | {j for j in delivery_positions.get(r, ()) if j >= i}:
+                    delta = insertion_delta(r, p, i, j)
+                    if delta is not None and (r not in best or delta > best[r][0]):
+                        best[r] = (delta, i, j)
+        return best
+
+    def regret(p):
+        # Leaving a pair out has a profit of 0, so it counts as an option too
+        values = sorted([option[0] for option in options[p].values()] +
+                        ([new_route[p]] if len(routes) < number_of_trucks else []), reverse=True)
+        values += [0.0] * k
+        return sum(values[0] - value for value in values[1:k]), values[0]
+
+    new_route = {p: new_route_delta(p) for p in pickups}
+    options = {p: {} for p in pickups}
+    regrets = {p: regret(p) for p in pickups}
+
+    while regrets:
+        p = max(regrets, key=lambda q: (regrets[q], q))
+        best_value = regrets[p][1]
+        if best_value <= 0:
+            # Not profitable, not even in its best route
+            del regrets[p]
+            continue
+
+        d = p + n
+        best_route = max(options[p].items(), key=lambda item: item[1][0], default=None)
+        if best_route is not None and best_route[1][0] >= best_value:
+            r, (_, i, j) = best_route[0], best_route[1]
+            nodes = routes[r]
+            if j == len(nodes) - 1:
+                nodes[-1] = nearest_depot[d]
+            routes[r] = nodes[:i] + [p] + nodes[i:j] + [d] + nodes[j:]
+        else:
+            r = len(routes)
+            routes.append([nearest_depot[p], p, d, nearest_depot[d]])
+            route_state.append(None)
+        update_state(r)
+        del regrets[p]
+
+        # Options in the changed route are recomputed for the pairs that had one or that are near the new nodes
+        affected = {q for q in regrets if r in options[q]} | ((near.get(p, set()) | near.get(d, set())) & regrets.keys())
+        for q in affected:
+            options[q] = best_insertions(q)
+        for q in (regrets if len(routes) == number_of_trucks else affected):
+            regrets[q] = regret(q)
+
+    return {'routes': [[{'node_id': node_id, 'waiting_time': 0} for node_id in nodes] for nodes in routes]}
+
+
+# Optimal waiting times. Waiting at a node delays the service at all later nodes of the route: it costs
+# TRUCK_COST_PER_HOUR, but avoids the penalties of serving before the start of a time window. With D_k the total
+# waiting before node k (nondecreasing in k), the cost of a route is a sum of convex piecewise linear functions of the
+# D_k, which is minimized with the slope trick: a forward pass keeps the breakpoints of the cost of the route prefix
+# in a heap, and a backward pass picks the delays.
+
+
+class WaitingSchedule:
+    """Optimal waiting times of a route that is built node by node.
+
+    The state after a route prefix can be copied, so a local search can keep it and evaluate many continuations of
+    the prefix without starting over. Appending a node takes O(log m) time for a route of m nodes.
+
+    Args:
+        instance: parsed instance dict (or its arrays, see build_instance_arrays)
+    """
+
+    def __init__(self, instance):
+        arrays = get_instance_arrays(instance)
+        self.distance = arrays['distance']
+        self.time_window_start = arrays['time_window_start']
+        self.time_window_end = arrays['time_window_end']
+        self.nodes = []
+        self.time = 0.0  # service time at the last node without any waiting
+        # Max heap (negated positions) of (position, weight) breakpoints of the cost as a function of the delay,
+        # the delay cannot be negative, that is a breakpoint at 0 with an infinite weight
+        self.breakpoints = [(-0.0, float('inf'))]
+        self.best_delay = []  # delay that minimizes the cost of the prefix up to every node
+
+    def copy(self):
+        schedule = WaitingSchedule.__new__(WaitingSchedule)
+        schedule.__dict__.update(self.__dict__)
+        schedule.nodes, schedule.breakpoints, schedule.best_delay = \
+            self.nodes[:], self.breakpoints[:], self.best_delay[:]
+        return schedule
+
+    def append(self, node_id):
+        if self.nodes:
+            self.time += self.distance.between(self.nodes[-1], node_id) / TRUCK_SPEED
+            # Penalty of this node: slope -PENALTY_PER_HOUR before `early`, +PENALTY_PER_HOUR after `late`. The
+            # increasing part is written as a linear function plus a breakpoint, the linear function then cancels
+            # the weight of the rightmost breakpoints, which also gives the minimum
+            early = float(self.time_window_start[node_id]) - self.time
+            late = float(self.time_window_end[node_id]) - self.time
+            heapq.heappush(self.breakpoints, (-early, PENALTY_PER_HOUR))
+            heapq.heappush(self.breakpoints, (-late, PENALTY_PER_HOUR))
+            self.best_delay.append(self._cancel(self.breakpoints, PENALTY_PER_HOUR))
+        else:
+            self.best_delay.append(0.0)  # the start depot has no time window penalty
+        self.nodes.append(node_id)
+
+    def extend(self, nodes):
+        for node_id in nodes:
+            self.append(node_id)
+
+    @staticmethod
+    def _cancel(breakpoints, weight):
+        # Remove `weight` of slope from the right, returns where the slope becomes zero (the minimum)
+        while True:
+            position, available = heapq.heappop(breakpoints)
+            if available > weight:
+                heapq.heappush(breakpoints, (position, available - weight))
+                return -position
+            weight -= available
+            if weight <= 0:
+                return -position
+
+    def waiting_times(self):
+        """Waiting times in minutes for every node of the route so far (the last one is always 0)."""
+        m = len(self.nodes)
+        if m < 2:
+            return [0] * m
+        delay = [0.0] * m
+        # Waiting costs TRUCK_COST_PER_HOUR for every hour of the total delay at the end of the route
+        delay[-1] = self._cancel(self.breakpoints[:], TRUCK_COST_PER_HOUR)
+        for k in range(m - 2, 0, -1):
+            delay[k] = min(delay[k + 1], self.best_delay[k])
+        return [(delay[k + 1] - delay[k]) * 60.0 for k in range(m - 1)] + [0]
+
+
+def optimal_waiting_times(nodes, instance):
+    """Waiting times (minutes) that maximize the profit of a route with the given node ids (depots included).
+
+    The node sequence does not change, so only the waiting cost and the time window penalties change. The result is
+    exact up to floating point rounding, in O(m log m) time for a route of m nodes.
+    """
+    schedule = WaitingSchedule(instance)
+    schedule.extend(nodes)
+    return schedule.waiting_times()
+
+
+@profiler.timed()
+def optimize_waiting_times(solution, instance):
+    """Solution dict with the same routes as `solution` and the optimal waiting times, never less profitable."""
+    arrays = get_instance_arrays(instance)
+    return {'routes': [[{'node_id': node_id, 'waiting_time': waiting_time}
+                        for node_id, waiting_time in zip(nodes, optimal_waiting_times(nodes, arrays))]
+                       for nodes, _ in solution_routes(solution)]}
+
+
+# Handing the solution to the competition harness. The harness passes a file descriptor in the VRP_RESULT_FD
+# environment variable and reads one JSON record per line from it, e.g.,
+#     {"v": 1, "type": "result", "routes": [[1, 4, 154, 1]], "waiting": [[0, 0, 12.5, 0]]}
+# with the node ids per route and the waiting times in minutes ("waiting" is left out when all are zero). Without the
+# variable, e.g. when you run main.py yourself, the solution is printed as the usual RESULT line.
+
+RESULT_PROTOCOL_VERSION = 1
+RESULT_FD_ENV = "VRP_RESULT_FD"
+
+
+def solution_to_record(solution, record_type='result'):
+    route_lists = solution_routes(solution)
+    routes = [[int(node_id) for node_id in nodes] for nodes, _ in route_lists]
+    waiting = [[float(waiting_time) if waiting_time % 1 else int(waiting_time) for waiting_time in waiting_times]
+               for _, waiting_times in route_lists]
+    record = {'v': RESULT_PROTOCOL_VERSION, 'type': record_type, 'routes': routes}
+    if any(waiting_time for route in waiting for waiting_time in route):
+        record['waiting'] = waiting
+    return record
+
+
+def write_record(record):
+    """Write a record to the result channel, returns False if there is no result channel."""
+    fd = os.environ.get(RESULT_FD_ENV)
+    if fd is None:
+        return False
+    data = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+    try:
+        while data:
+            data = data[os.write(int(fd), data):]
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def emit_result(solution):
+    """Hand your final solution to the competition harness, use this instead of printing it yourself.
+
+    With profiling on (see Profiler) the profile summary is written right after the solution.
+    """
+    if not write_record(solution_to_record(solution)):
+        print("RESULT:", solution)
+    profiler.emit()
+
+
+def emit_incumbent(solution):
+    """Report a solution found on the way (e.g. every new best), the harness records when it got there.
+
+    Incumbents only make up the profit-vs-time curve of the run, the solution of emit_result is the one that counts.
+    """
+    if not write_record(solution_to_record(solution, 'incumbent')):
+        print("INCUMBENT:", solution)
+
+
+# Time budgets. In a time-budgeted round the harness tells your code how long it may run: VRP_TIME_BUDGET holds the
+# budget in seconds and VRP_DEADLINE the time.time() at which it ends. At the deadline the harness sends SIGUSR1, a
+# little later SIGTERM and then it kills the run. The last solution you emitted is evaluated (that of emit_result, or
+# of emit_incumbent if there is no result yet), so emit your best solution early and stop on these signals, the
+# reference ALNS does both.
+TIME_BUDGET_ENV = "VRP_TIME_BUDGET"
+DEADLINE_ENV = "VRP_DEADLINE"
+STOP_SIGNALS = tuple(getattr(signal, name) for name in ("SIGUSR1", "SIGTERM") if hasattr(signal, name))
+
+
+def time_budget(default=None):
+    """Seconds left until the deadline of the harness, `default` without one (e.g. when you run main.py yourself)."""
+    if os.environ.get(DEADLINE_ENV):
+        return max(0.0, float(os.environ[DEADLINE_ENV]) - time.time())
+    if os.environ.get(TIME_BUDGET_ENV):
+        return float(os.environ[TIME_BUDGET_ENV])
+    return default
@@ -0,0 +1,334 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import alns
+import helper
+
+
+# Island model for the reference ALNS: every island is a process that runs its own ALNS (with its own seed) on the
+# same instance. The instance arrays are put in shared memory once, the islands map them read-only instead of each
+# holding a copy. The search runs in epochs, after every epoch each island sends its best solution to the
+# coordinator, which keeps the overall best (and writes it to the result channel when it improves) and passes the
+# best of every island on to the next island in the ring. An island continues from a received solution only if it
+# is better than its own best, so the islands stay diverse but good solutions spread.
+#
+# Usage from main.py:
+#     import islands
+#     solution = islands.solve(instance_dict, time_limit=60)  # one island per core
+#     helper.emit_result(solution)
+#
+# On a single core this is just alns.solve.
+
+def available_cores():
+    # The cores this process may run on, evaluate.py pins every job to its own cores
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# How long the coordinator waits for an island after the end of an epoch before it gives up on it
+ISLAND_GRACE_SECONDS = 30
+
+
+def share_array(value, blocks):
+    block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+    np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+    blocks.append(block)
+    return block.name, value.shape, value.dtype.str
+
+
+def attach_array(spec, blocks):
+    name, shape, dtype = spec
+    # The islands share the resource tracker of the coordinator, so the block is still unlinked only once
+    block = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype, buffer=block.buf)
+    array.flags.writeable = False
+    blocks.append(block)
+    return array
+
+
+def share_arrays(arrays):
+    """Copy the numpy arrays of an instance to shared memory, returns the blocks and a picklable spec to attach them.
+
+    The distance matrix goes to shared memory as well: its coordinates, and the full matrix unless it is too large to
+    be materialized (helper.DistanceMatrix), then every island keeps its own bounded cache of rows.
+    """
+    blocks, spec = [], {}
+    for key, value in arrays.items():
+        if isinstance(value, np.ndarray):
+            spec[key] = ('array', share_array(value, blocks))
+        elif isinstance(value, helper.DistanceMatrix):
+            full = None if value.lazy else share_array(value.materialize(), blocks)
+            spec[key] = ('distance_matrix', share_array(value.x_coord, blocks), share_array(value.y_coord, blocks), full,
+                         value.full_max_bytes, value.cache_bytes)
+        else:
+            spec[key] = ('value', value)
+    return blocks, spec
+
+
+def attach_arrays(spec):
+    """Map the shared arrays of share_arrays, returns the blocks (keep them open while the arrays are used) and arrays."""
+    blocks, arrays = [], {}
+    for key, (kind, *value) in spec.items():
+        if kind == 'array':
+            arrays[key] = attach_array(value[0], blocks)
+        elif kind == 'distance_matrix':
+            x_coord, y_coord, full, full_max_bytes, cache_bytes = value
+            arrays[key] = helper.DistanceMatrix(attach_array(x_coord, blocks), attach_array(y_coord, blocks),
+                                                full_max_bytes, cache_bytes,
+                                                attach_array(full, blocks) if full is not None else None)
+        else:
+            arrays[key] = value[0]
+    return blocks, arrays
+
+
+def island(index, spec, time_limit, seed, inbox, outbox, options):
+    # Only the coordinator writes to the result channel (or stdout), records of several processes would interleave
+    os.environ.pop(helper.RESULT_FD_ENV, None)
+    # and only it reports the profile, the counters of the island are sent with its results
+    helper.profiler.emitted = True
+    blocks, arrays = attach_arrays(spec)
+    try:
+        # Epochs end at a time.time() value, the perf_counter clocks of different processes are not comparable
+        _, solution, epoch_end = inbox.get()
+        search = alns.ALNS(arrays, time_limit, seed, solution, **dict(options, emit_interval=None))
+        for signum in helper.STOP_SIGNALS:
+            signal.signal(signum, search.stop)
+        while epoch_end is not None:
+            search.run(until=time.perf_counter() + epoch_end - time.time())
+            outbox.put((index, search.best_profit, search.best_solution, search.iterations, search.trace,
+                        dict(helper.profiler.counters)))
+            search.trace = []
+            profit, solution, epoch_end = inbox.get()
+            if solution is not None and profit > search.best_profit + 1e-9:
+                search.set_solution(solution)
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+
+class Islands:
+    """Coordinator of the island processes, see solve.
+
+    Args:
+        instance: parsed instance dict (or its arrays, see helper.build_instance_arrays)
+        time_limit: wall-clock budget in seconds, counted from the creation of the object
+        islands: number of island processes, one per core this process may run on by default
+        epoch: seconds between two exchanges of the best solutions
+        seed: random seed, island i uses seed + i
+        solution: initial solution of every island, helper.regret_insertion by default
+        emit_interval: minimum number of seconds between two best solutions written to the result channel (or printed
+            as RESULT lines without one)
+        options: further ALNS arguments
+    """
+
+    def __init__(self, instance, time_limit=60, islands=None, epoch=5.0, seed=None, solution=None, emit_interval=5.0,
+                 **options):
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + time_limit
+        self.number_of_islands = islands or available_cores()
+        self.epoch = epoch
+        self.seed = seed if seed is not None else int.from_bytes(os.urandom(4), 'little')
+        self.emit_interval = emit_interval
+        self.options = options
+        self.stopped = False
+
+        self.arrays = helper.get_instance_arrays(instance)
+        self.best_solution = helper.regret_insertion(self.arrays) if solution is None else solution
+        self.best_profit = helper.total_profit_fast(self.best_solution, self.arrays)
+        self.trace = [(time.time(), self.best_profit)]  # (wall-clock time, best profit) for every new best solution
+        self.iterations = [0] * self.number_of_islands
+        self.island_counters = [{} for _ in range(self.number_of_islands)]  # profiler counters, see helper.Profiler
+        self.last_emit = 0.0
+
+    def emit_best(self, force=False):
+        now = time.perf_counter()
+        if force or now - self.last_emit >= self.emit_interval:
+            solution = helper.optimize_waiting_times(self.best_solution, self.arrays)
+            if not helper.write_record(helper.solution_to_record(solution, 'result')):
+                print("RESULT:", solution, flush=True)
+            self.last_emit = now
+
+    def stop(self, *_):
+        self.stopped = True
+        self.stop_time = time.perf_counter()
+
+    def run(self):
+        """Run the islands until the deadline (or until stop() is called) and return the best solution."""
+        # spawn works the same on every platform and does not copy the state of the caller into the islands
+        context = multiprocessing.get_context('spawn')
+        blocks, spec = share_arrays(self.arrays)
+        outbox = context.Queue()
+        inboxes = [context.Queue() for _ in range(self.number_of_islands)]
+        processes = [context.Process(target=island, daemon=True,
+                                     args=(i, spec, self.deadline - time.perf_counter(), self.seed + i, inboxes[i],
+                                           outbox, self.options))
+                     for i in range(self.number_of_islands)]
+        try:
+            for process in processes:
+                process.start()
+            epoch_end = self.next_epoch()
+            for inbox in inboxes:
+                inbox.put((self.best_profit, self.best_solution, epoch_end))
+
+            while epoch_end is not None:
+                bests = self.collect(outbox, processes)
+                if bests is None:
+                    break
+                epoch_end = self.next_epoch()
+                if epoch_end is not None:
+                    for i, inbox in enumerate(inboxes):
+                        # Ring migration, island i receives the best solution of island i - 1
+                        inbox.put((*bests[i - 1], epoch_end))
+        finally:
+            for inbox in inboxes:
+                inbox.put((None, None, None))
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.kill()
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        for counters in self.island_counters:
+            for name, n in counters.items():
+                helper.profiler.count(name, n)
+        self.emit_best(force=True)
+        return helper.optimize_waiting_times(self.best_solution, self.arrays)
+
+    def next_epoch(self):
+        # time.time() at the end of the next epoch, None when the search is over
+        remaining = self.deadline - time.perf_counter()
+        if self.stopped or remaining <= 0:
+            return None
+        # A short last epoch is merged into the one before
+        return time.time() + (remaining if remaining < 1.5 * self.epoch else self.epoch)
+
+    def collect(self, outbox, processes):
+        # Best (profit, solution) of every island after an epoch, None if the search was stopped or an island died
+        bests = [None] * len(processes)
+        waiting = len(processes)
+        give_up = max(self.deadline, time.perf_counter() + self.epoch) + ISLAND_GRACE_SECONDS
+        while waiting:
+            try:
+                i, profit, solution, iterations, trace, counters = outbox.get(timeout=0.5)
+            except queue.Empty:
+                if self.stopped:
+                    # The islands usually get the same signal, give them a moment to report
+                    give_up = min(give_up, self.stop_time + 1)
+                if time.perf_counter() > give_up or not all(process.is_alive() for process in processes):
+                    return None
+                continue
+            bests[i] = (profit, solution)
+            self.iterations[i] = iterations
+            self.island_counters[i] = counters
+            waiting -= 1
+            self.trace.extend(trace)
+            if profit > self.best_profit + 1e-9:
+                self.best_profit, self.best_solution = profit, solution
+                self.emit_best()
+        self.trace.sort()
+        return bests
+
+
+def solve(instance, time_limit=60, islands=None, epoch=5.0, seed=None, solution=None, verbose=False, **kwargs):
+    """Run the island model for `time_limit` seconds and return the best solution, stops on helper.STOP_SIGNALS."""
+    if (islands or available_cores()) <= 1:
+        return alns.solve(instance, time_limit, seed, solution, verbose, **kwargs)
+
+    search = Islands(instance, time_limit, islands, epoch, seed, solution, **kwargs)
+    try:
+        previous_handlers = {signum: signal.signal(signum, search.stop) for signum in helper.STOP_SIGNALS}
+    except ValueError:
+        previous_handlers = {}  # not in the main thread
+    try:
+        best = search.run()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    if verbose:
+        print(f"Islands: {search.number_of_islands} islands, {sum(search.iterations)} iterations in "
+              f"{time.perf_counter() - search.start_time:.1f}s, best profit {search.best_profit:.2f}")
+    return best
+
+
+def time_to_target(trace, start, target):
+    for timestamp, profit in trace:
+        if profit >= target - 1e-6:
+            return timestamp - start
+    return None
+
+
+def speedup_report(instance_paths, island_counts, time_limit, epoch=1.0, seed=0):
+    """Time to reach the profit of a single island for every number of islands, per instance.
+
+    The single-island run (which goes through the same coordinator, so the overhead is counted) sets the target
+    profit, the speedup of k islands is the time the single island needed divided by the time of k islands.
+    """
+    rows = []
+    for instance_path in instance_paths:
+        instance_dict = helper.parse_instance(helper.read_instance(instance_path))
+        arrays = helper.get_instance_arrays(instance_dict)
+        runs = {}
+        for count in island_counts:
+            start = time.time()
+            search = Islands(arrays, time_limit, count, epoch, seed)
+            search.run()
+            runs[count] = (start, search)
+
+        target = max(search.best_profit for _, search in runs.values()) if 1 not in runs else runs[1][1].best_profit
+        base = time_to_target(runs[1][1].trace, runs[1][0], target) if 1 in runs else None
+        for count, (start, search) in runs.items():
+            reached = time_to_target(search.trace, start, target)
+            rows.append((os.path.basename(instance_path), count, search.best_profit, sum(search.iterations), reached,
+                         base / reached if base and reached else None))
+    return rows
+
+
+def print_report(rows):
+    print(f"{'instance':<16} {'islands':>7} {'best profit':>14} {'iterations':>10} {'time to target':>14} {'speedup':>8}")
+    for name, count, profit, iterations, reached, speedup in rows:
+        reached = f"{reached:.2f}s" if reached is not None else "-"
+        speedup = f"{speedup:.2f}x" if speedup is not None else "-"
+        print(f"{name:<16} {count:>7} {profit:>14.2f} {iterations:>10} {reached:>14} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Island model of the reference ALNS solver.")
+    parser.add_argument("--instance_path", type=str, help="Path to the instance file")
+    parser.add_argument("--time_limit", default=60, type=float, help="Wall-clock budget in seconds")
+    parser.add_argument("--islands", default=None, type=int, help="Number of island processes, one per core by default")
+    parser.add_argument("--epoch", default=5.0, type=float, help="Seconds between two exchanges of the best solutions")
+    parser.add_argument("--seed", default=None, type=int, help="Random seed")
+    parser.add_argument("--speedup", nargs='*', type=int, help="Report the speedup of these numbers of islands (1 2 4 ... up to the cores by default) on --instance_path or all instances in Instances")
+    args = parser.parse_args()
+
+    if args.speedup is not None:
+        counts = args.speedup or sorted({1} | {2 ** i for i in range(available_cores().bit_length())})
+        if 1 not in counts:
+            counts = [1] + counts
+        if args.instance_path:
+            paths = [args.instance_path]
+        else:
+            folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Instances")
+            paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".txt")]
+        print(f"{available_cores()} cores")
+        print_report(speedup_report(paths, counts, args.time_limit, min(args.epoch, 1.0), args.seed or 0))
+    else:
+        if not args.instance_path:
+            parser.error("--instance_path is required")
+        instance_dict = helper.parse_instance(helper.read_instance(args.instance_path))
+        solution = solve(instance_dict, args.time_limit, args.islands, args.epoch, args.seed, verbose=True)
+        helper.check_solution_feasibility(solution, instance_dict)
+        print("Profit:", helper.total_profit_with_penalties(solution, instance_dict))
+        helper.emit_result(solution)
@@ -33,16 +33,19 @@ def main(instance):
     # parse the instance into a dictionary
     instance_dict = helper.parse_instance(instance)
 
+    # set VRP_PROFILE=1 to time your own steps and count what your algorithm does, the summary is emitted with the
+    # result, e.g. wrap a step in "with helper.profiler.timer('construction'):" or call helper.profiler.count('moves')
+
     # For this example, we implement a function that returns a random route, always starting from the same depot.
     # It is your task to come up with a better approach to reduce the total distance covered,
-    # and provide a feasible solution
+    # and provide a feasible solution. helper.regret_insertion(instance_dict) gives a feasible baseline to start from,
+    # alns.solve(instance_dict, time_limit=...) is a reference metaheuristic that improves it within a time budget.
     depot_id = 1
-    random_routes = helper.generate_random_routes_from_instance(instance_dict, depot_id)
+    with helper.profiler.timer('construction'):
+        random_routes = helper.generate_random_routes_from_instance(instance_dict, depot_id)
 
     # Create the solution dictionary
     solution = {'routes': random_routes}
-    print('\nRandom sequence solution (likely infeasible):')
-    print(solution)
 
     # check feasibility of solution
     helper.check_solution_feasibility(solution, instance_dict)
@@ -54,8 +57,12 @@ def main(instance):
     # you should implement logic to generate the solution, it is not enough to just provide the solution sequence!
     # on the competition server, we will test your solution code on different (secret) instances that are of similar
     # size as the 3 instances provided. The computation time limit is 15 minutes in total for solving all 3 instances.
+    # In time-budgeted rounds helper.time_budget() gives the seconds left for this instance, the run is stopped at the
+    # deadline and your last emitted solution counts (see helper.py).
 
-    print("RESULT:", solution)  # you need to return a solution in this exact (vrplib) format, do not change this!
+    # you need to return a solution in this exact (vrplib) format, do not change this! emit_result hands the solution
+    # to the competition server, when you run main.py yourself it prints the "RESULT:" line
+    helper.emit_result(solution)
 
 
 # please keep the below code as-is, you can only change the default "instance_path" to your liking. We provide example
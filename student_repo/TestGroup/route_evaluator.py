@@ -0,0 +1,365 @@
+from math import inf
+
+import helper
+from compact_solution import Solution
+
+
+# Incremental (delta) evaluation of route moves. The RouteEvaluator keeps per-route prefix data (arrival times, loads,
+# distances, waiting times, revenue and penalties) so the profit change of a move can be computed without rescoring
+# the full solution with helper.total_profit_with_penalties.
+#
+# All moves are expressed as a segment replacement: positions start..end-1 of a route are replaced by a new list of
+# nodes. The nodes of the new segment are evaluated one by one (O(k) for a segment of k nodes), and the rest of the
+# route only shifts in time. That shift is evaluated in O(1) from suffix aggregates of the penalty slopes, unless it
+# moves a node across the start or end of its time window, in which case the suffix is scanned.
+
+
+def _penalty(t, window_start, window_end):
+    if t < window_start:
+        return (window_start - t) * helper.PENALTY_PER_HOUR
+    elif t > window_end:
+        return (t - window_end) * helper.PENALTY_PER_HOUR
+    return 0.0
+
+
+class _RouteState:
+    __slots__ = ('nodes', 'waits', 'arrival', 'load', 'distance', 'waiting', 'revenue', 'penalty',
+                 'forward_slope', 'forward_slack', 'backward_slope', 'backward_slack', 'profit', 'schedules')
+
+
+class RouteEvaluator:
+    """Stateful evaluator of a solution that supports O(1)/O(k) delta evaluation of route moves.
+
+    Positions are indices in a route, position 0 and the last position are the depots. Every *_delta method returns
+    the change in profit (positive is an improvement) without changing the solution, the method without the _delta
+    suffix applies the move. Delta methods do not check feasibility, use the capacity helpers for that.
+
+    Args:
+        solution: solution dict with 'routes', as printed in the RESULT line, or a compact_solution.Solution
+        instance: parsed instance dict (or its arrays, see helper.build_instance_arrays)
+        debug: if True, every delta is verified against a full recomputation of the route profit
+    """
+
+    def __init__(self, solution, instance, debug=False):
+        self.arrays = helper.get_instance_arrays(instance)
+        self.debug = debug
+        self.capacity = self.arrays['vehicle_capacity']
+
+        # plain python lists are much faster than numpy arrays for the element-wise access below
+        distance = self.arrays['distance']
+        self._distance = distance.row_lists() if isinstance(distance, helper.DistanceMatrix) else distance.tolist()
+        self._demand = self.arrays['demand'].tolist()
+        self._window_start = self.arrays['time_window_start'].tolist()
+        self._window_end = self.arrays['time_window_end'].tolist()
+        self._revenue = [demand * helper.REVENUE_PER_DEMAND_UNIT if node_type == helper.NODE_PICKUP else 0
+                         for demand, node_type in zip(self._demand, self.arrays['node_type'].tolist())]
+
+        self.routes = []
+        for nodes, waits in helper.solution_routes(solution):
+            state = _RouteState()
+            state.nodes, state.waits = nodes, waits
+            self._rebuild(state)
+            self.routes.append(state)
+
+    def _rebuild(self, state):
+        # Recompute all cached data of a route, O(L)
+        nodes, waits = state.nodes, state.waits
+        size = len(nodes)
+        arrival, load = [0.0] * size, [0] * size
+        distance, waiting, revenue, penalty = [0.0] * (size + 1), [0.0] * (size + 1), [0] * (size + 1), [0.0] * (size + 1)
+
+        for k in range(size):
+            node = nodes[k]
+            if k > 0:
+                previous = nodes[k - 1]
+                edge = self._distance[previous][node]
+                arrival[k] = arrival[k - 1] + (edge / helper.TRUCK_SPEED + waits[k - 1] / 60.0)
+                load[k] = load[k - 1] + self._demand[node]
+                distance[k + 1] = distance[k] + edge
+                penalty[k + 1] = penalty[k] + _penalty(arrival[k], self._window_start[node], self._window_end[node])
+            else:
+                distance[1], penalty[1] = 0.0, 0.0
+            # waiting time and revenue only count for the nodes a truck departs from, so not for the last node
+            last = k == size - 1
+            waiting[k + 1] = waiting[k] + (0.0 if last else waits[k] / 60.0)
+            revenue[k + 1] = revenue[k] + (0 if last else self._revenue[node])
+
+        # Suffix aggregates: the summed penalty slope when all nodes from position k onward shift later (forward) or
+        # earlier (backward), and how far they can shift before any of them crosses a time window boundary
+        forward_slope, forward_slack = [0] * (size + 1), [inf] * (size + 1)
+        backward_slope, backward_slack = [0] * (size + 1), [inf] * (size + 1)
+        for k in range(size - 1, 0, -1):
+            node, t = nodes[k], arrival[k]
+            window_start, window_end = self._window_start[node], self._window_end[node]
+            if t < window_start:
+                slope, slack = -1, window_start - t
+            elif t < window_end:
+                slope, slack = 0, window_end - t
+            else:
+                slope, slack = 1, inf
+            forward_slope[k] = forward_slope[k + 1] + slope
+            forward_slack[k] = min(forward_slack[k + 1], slack)
+
+            if t > window_end:
+                slope, slack = 1, t - window_end
+            elif t > window_start:
+                slope, slack = 0, t - window_start
+            else:
+                slope, slack = -1, inf
+            backward_slope[k] = backward_slope[k + 1] + slope
+            backward_slack[k] = min(backward_slack[k + 1], slack)
+
+        state.arrival, state.load = arrival, load
+        state.distance, state.waiting, state.revenue, state.penalty = distance, waiting, revenue, penalty
+        state.forward_slope, state.forward_slack = forward_slope, forward_slack
+        state.backward_slope, state.backward_slack = backward_slope, backward_slack
+        state.profit = revenue[size] - ((distance[size] / helper.TRUCK_SPEED + waiting[size])
+                                        * helper.TRUCK_COST_PER_HOUR + penalty[size])
+        state.schedules = None
+
+    def _shift_penalty(self, state, k, shift):
+        # Penalty change when all nodes from position k onward arrive `shift` hours later (or earlier if negative)
+        if shift == 0 or k >= len(state.nodes):
+            return 0.0
+        if 0 < shift <= state.forward_slack[k]:
+            return shift * state.forward_slope[k] * helper.PENALTY_PER_HOUR
+        if 0 < -shift <= state.backward_slack[k]:
+            return shift * state.backward_slope[k] * helper.PENALTY_PER_HOUR
+
+        change = 0.0
+        for j in range(k, len(state.nodes)):
+            node, t = state.nodes[j], state.arrival[j]
+            window_start, window_end = self._window_start[node], self._window_end[node]
+            change += _penalty(t + shift, window_start, window_end) - _penalty(t, window_start, window_end)
+        return change
+
+    def segment_delta(self, r, start, end, nodes, waits=None):
+        """Profit change of replacing positions start..end-1 of route r by `nodes` (1 <= start <= end <= L).
+
+        With end == L the route tail is replaced, so `nodes` has to end with a depot. `waits` are the waiting times
+        in minutes of the new nodes, zero by default.
+        """
+        state = self.routes[r]
+        size = len(state.nodes)
+        if waits is None:
+            waits = [0] * len(nodes)
+
+        # Evaluate the new segment node by node, starting from the departure at position start - 1
+        previous = state.nodes[start - 1]
+        t = state.arrival[start - 1]
+        departure_wait = state.waits[start - 1] / 60.0
+        new_distance = new_waiting = new_penalty = 0.0
+        new_revenue = 0
+        for i, node in enumerate(nodes):
+            edge = self._distance[previous][node]
+            t += edge / helper.TRUCK_SPEED + departure_wait
+            new_distance += edge
+            new_penalty += _penalty(t, self._window_start[node], self._window_end[node])
+            if end < size or i < len(nodes) - 1:
+                departure_wait = waits[i] / 60.0
+                new_waiting += departure_wait
+                new_revenue += self._revenue[node]
+            previous = node
+
+        # Costs of the old segment follow from the prefix sums, positions end..L-1 only shift in time
+        last = min(end, size - 1)
+        old_distance = state.distance[min(end + 1, size)] - state.distance[start]
+        old_waiting = state.waiting[last] - state.waiting[start]
+        old_revenue = state.revenue[last] - state.revenue[start]
+        old_penalty = state.penalty[end] - state.penalty[start]
+        shift_penalty = 0.0
+        if end < size:
+            edge = self._distance[previous][state.nodes[end]]
+            new_distance += edge
+            t += edge / helper.TRUCK_SPEED + departure_wait
+            shift_penalty = self._shift_penalty(state, end, t - state.arrival[end])
+
+        delta = (new_revenue - old_revenue) - ((new_distance - old_distance) / helper.TRUCK_SPEED
+                                               + (new_waiting - old_waiting)) * helper.TRUCK_COST_PER_HOUR \
+            - (new_penalty - old_penalty + shift_penalty)
+
+        if self.debug:
+            self._verify_delta(r, start, end, nodes, waits, delta)
+        return delta
+
+    def _verify_delta(self, r, start, end, nodes, waits, delta):
+        state = self.routes[r]
+        route = [{'node_id': node, 'waiting_time': wait} for node, wait in
+                 zip(state.nodes[:start] + list(nodes) + state.nodes[end:], state.waits[:start] + list(waits) + state.waits[end:])]
+        expected = helper.total_profit_fast({'routes': [route]}, self.arrays) - state.profit
+        assert abs(expected - delta) < 1e-6 * max(1.0, abs(expected)), f"delta {delta} != recomputed {expected}"
+
+    def apply_segment(self, r, start, end, nodes, waits=None):
+        """Replace positions start..end-1 of route r by `nodes`, see segment_delta."""
+        state = self.routes[r]
+        if waits is None:
+            waits = [0] * len(nodes)
+        state.nodes[start:end] = nodes
+        state.waits[start:end] = waits
+        self._rebuild(state)
+
+    # Single node moves
+
+    def insert_delta(self, r, pos, node, waiting=0):
+        """Insert `node` before position pos of route r."""
+        return self.segment_delta(r, pos, pos, [node], [waiting])
+
+    def insert(self, r, pos, node, waiting=0):
+        self.apply_segment(r, pos, pos, [node], [waiting])
+
+    def remove_delta(self, r, pos):
+        return self.segment_delta(r, pos, pos + 1, [])
+
+    def remove(self, r, pos):
+        self.apply_segment(r, pos, pos + 1, [])
+
+    def _relocate_segment(self, r, pos_from, pos_to):
+        # Intra-route relocate as one segment replacement, pos_to is the position the node is inserted before
+        state = self.routes[r]
+        if pos_from < pos_to:
+            return pos_from, pos_to, state.nodes[pos_from + 1:pos_to] + [state.nodes[pos_from]], \
+                state.waits[pos_from + 1:pos_to] + [state.waits[pos_from]]
+        return pos_to, pos_from + 1, [state.nodes[pos_from]] + state.nodes[pos_to:pos_from], \
+            [state.waits[pos_from]] + state.waits[pos_to:pos_from]
+
+    def relocate_delta(self, r_from, pos_from, r_to, pos_to):
+        """Move the node at pos_from of route r_from to before position pos_to of route r_to."""
+        if r_from == r_to:
+            return self.segment_delta(r_from, *self._relocate_segment(r_from, pos_from, pos_to))
+        state = self.routes[r_from]
+        return self.remove_delta(r_from, pos_from) + \
+            self.insert_delta(r_to, pos_to, state.nodes[pos_from], state.waits[pos_from])
+
+    def relocate(self, r_from, pos_from, r_to, pos_to):
+        if r_from == r_to:
+            self.apply_segment(r_from, *self._relocate_segment(r_from, pos_from, pos_to))
+            return
+        state = self.routes[r_from]
+        node, waiting = state.nodes[pos_from], state.waits[pos_from]
+        self.remove(r_from, pos_from)
+        self.insert(r_to, pos_to, node, waiting)
+
+    def two_opt_delta(self, r, i, j):
+        """Reverse positions i..j (inclusive) of route r."""
+        state = self.routes[r]
+        return self.segment_delta(r, i, j + 1, state.nodes[i:j + 1][::-1], state.waits[i:j + 1][::-1])
+
+    def two_opt(self, r, i, j):
+        state = self.routes[r]
+        self.apply_segment(r, i, j + 1, state.nodes[i:j + 1][::-1], state.waits[i:j + 1][::-1])
+
+    # Pickup and delivery pair moves, the pickup is at (or inserted before) position i, the delivery at position j
+
+    def insert_pair_delta(self, r, i, j, pickup, delivery):
+        """Insert `pickup` before position i and `delivery` before position j of route r (i <= j)."""
+        state = self.routes[r]
+        return self.segment_delta(r, i, j, [pickup] + state.nodes[i:j] + [delivery], [0] + state.waits[i:j] + [0])
+
+    def insert_pair(self, r, i, j, pickup, delivery):
+        state = self.routes[r]
+        self.apply_segment(r, i, j, [pickup] + state.nodes[i:j] + [delivery], [0] + state.waits[i:j] + [0])
+
+    def remove_pair_delta(self, r, i, j):
+        """Remove the pickup at position i and the delivery at position j of route r (i < j)."""
+        state = self.routes[r]
+        return self.segment_delta(r, i, j + 1, state.nodes[i + 1:j], state.waits[i + 1:j])
+
+    def remove_pair(self, r, i, j):
+        state = self.routes[r]
+        self.apply_segment(r, i, j + 1, state.nodes[i + 1:j], state.waits[i + 1:j])
+
+    def relocate_pair_delta(self, r_from, i, j, r_to, k, l):
+        """Move the pair at positions i, j of route r_from to before positions k, l (k <= l) of another route."""
+        state = self.routes[r_from]
+        return self.remove_pair_delta(r_from, i, j) + \
+            self.insert_pair_delta(r_to, k, l, state.nodes[i], state.nodes[j])
+
+    def relocate_pair(self, r_from, i, j, r_to, k, l):
+        state = self.routes[r_from]
+        pickup, delivery = state.nodes[i], state.nodes[j]
+        self.remove_pair(r_from, i, j)
+        self.insert_pair(r_to, k, l, pickup, delivery)
+
+    # Capacity helpers, the load at a position is the load after visiting that node
+
+    def insert_capacity_ok(self, r, pos, node):
+        state = self.routes[r]
+        demand = self._demand[node]
+        # deliveries never increase the load
+        return demand <= 0 or max(state.load[pos - 1:]) + demand <= self.capacity
+
+    def insert_pair_capacity_ok(self, r, i, j, pickup):
+        state = self.routes[r]
+        return max(state.load[i - 1:j]) + self._demand[pickup] <= self.capacity
+
+    # Optimal waiting times (see helper.optimal_waiting_times)
+
+    def _schedules(self, state):
+        # helper.WaitingSchedule after every prefix of the route, built on first use (O(L^2) memory) until a change
+        if state.schedules is None:
+            schedule = helper.WaitingSchedule(self.arrays)
+            state.schedules = []
+            for node in state.nodes:
+                schedule.append(node)
+                state.schedules.append(schedule.copy())
+        return state.schedules
+
+    def optimal_waits_delta(self, r, start, end, nodes):
+        """Profit change of the segment replacement of segment_delta, with optimal waiting times for the new route.
+
+        The waiting times of the route prefix are not reused, but the schedule of the prefix is, so only the nodes
+        from `start` on are processed.
+        """
+        state = self.routes[r]
+        schedule = self._schedules(state)[start - 1].copy()
+        schedule.extend(list(nodes) + state.nodes[end:])
+        new = _RouteState()
+        new.nodes, new.waits = schedule.nodes, schedule.waiting_times()
+        self._rebuild(new)
+        return new.profit - state.profit
+
+    def optimize_waits(self, r):
+        """Set the optimal waiting times for route r, returns the profit change (never negative)."""
+        state = self.routes[r]
+        old_profit = state.profit
+        schedules = self._schedules(state)
+        waits = schedules[-1].waiting_times()
+        if waits != state.waits:
+            state.waits = waits
+            self._rebuild(state)
+            state.schedules = schedules  # the schedules only depend on the nodes
+        return state.profit - old_profit
+
+    # Whole routes
+
+    def add_route(self, start_depot, end_depot=None):
+        """Append an empty route from start_depot to end_depot (the same depot by default), returns its index."""
+        state = _RouteState()
+        state.nodes = [start_depot, start_depot if end_depot is None else end_depot]
+        state.waits = [0, 0]
+        self._rebuild(state)
+        self.routes.append(state)
+        return len(self.routes) - 1
+
+    def set_route(self, r, nodes, waits=None):
+        """Replace route r by `nodes` (including the depots), e.g., to undo moves."""
+        state = self.routes[r]
+        state.nodes = list(nodes)
+        state.waits = [0] * len(nodes) if waits is None else list(waits)
+        self._rebuild(state)
+
+    # Solution level
+
+    def profit(self):
+        """Total profit, equal to total_profit_with_penalties up to floating point rounding."""
+        return sum(state.profit for state in self.routes)
+
+    def to_solution(self, drop_empty=True):
+        """Solution dict in the RESULT format, routes without customers are dropped by default."""
+        return {'routes': [[{'node_id': node, 'waiting_time': wait} for node, wait in zip(state.nodes, state.waits)]
+                           for state in self.routes if not (drop_empty and len(state.nodes) <= 2)]}
+
+    def to_compact(self, drop_empty=True):
+        """Like to_solution, but a compact_solution.Solution, which is much cheaper to keep many copies of."""
+        routes = [state for state in self.routes if not (drop_empty and len(state.nodes) <= 2)]
+        return Solution.from_routes([state.nodes for state in routes], [state.waits for state in routes])